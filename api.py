@@ -0,0 +1,439 @@
+# api.py
+"""
+Headless HTTP API: the extraction and generation stack behind an ASGI app
+(Starlette), for the LMS and anything else that can't drive the
+Streamlit page.
+
+    python -m api                        # NOTES_API_WORKERS processes on $PORT
+    uvicorn api:app --workers 4
+
+POST bodies are JSON with either `url` (fetched and extracted like in the
+app, with the same caches and duplicate detection) or `text`, plus the
+usual generation options:
+
+- POST /extract  {url}                               -> ExtractionResult fields
+- POST /notes    {url|text, bullets, max_tokens}     -> {summary, bullets}
+- POST /faqs     {url|text, count, max_tokens}       -> [{q, a}]
+- POST /mcqs     {url|text, count, max_tokens}       -> [{question, options, answer}]
+- POST /pack     {url|text, bullets, faq_count, mcq_count, max_tokens, single_request}
+                 -> {notes, faqs, mcqs}; with `Accept: text/event-stream`
+                 the response is Server-Sent Events: "progress", "partial"
+                 (sections so far), then "result" or "error"
+- POST /pdf      a pack as returned by /pack, or a /pack request -> PDF
+- GET /health, GET /metrics (Prometheus text, this worker's counters)
+
+Handlers are async; extraction and generation run on a thread pool
+(NOTES_API_THREADS), so a worker keeps accepting requests while LLM calls
+are in flight. Every client (a key from NOTES_API_KEYS sent as X-API-Key,
+else its address) gets a token bucket of NOTES_API_RATE requests per
+minute with bursts of NOTES_API_BURST; buckets live in each worker, so the
+limits are split evenly between the NOTES_API_WORKERS processes.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Tuple
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import tracing
+
+API_HOST = os.environ.get("NOTES_API_HOST", "0.0.0.0")
+API_PORT = int(os.environ.get("PORT", os.environ.get("NOTES_API_PORT", 8000)))
+API_WORKERS = int(os.environ.get("NOTES_API_WORKERS", os.cpu_count() or 1))
+# blocking extraction/generation calls in flight per worker
+API_THREADS = int(os.environ.get("NOTES_API_THREADS", 64))
+# per client, across all workers
+API_RATE = float(os.environ.get("NOTES_API_RATE", 60))
+API_BURST = float(os.environ.get("NOTES_API_BURST", 20))
+# X-API-Key values that get their own rate-limit bucket; any other key is ignored
+API_KEYS = {k.strip() for k in os.environ.get("NOTES_API_KEYS", "").split(",") if k.strip()}
+# behind a load balancer that sets X-Forwarded-For: rate-limit by the address it saw
+TRUST_PROXY = os.environ.get("NOTES_API_TRUST_PROXY", "").lower() in ("1", "true", "yes")
+# seconds between SSE keep-alive comments while a stream is idle
+SSE_KEEPALIVE = 15.0
+
+logger = logging.getLogger(__name__)
+
+_POOL = ThreadPoolExecutor(max_workers=API_THREADS, thread_name_prefix="api")
+_STARTED = time.time()
+_inflight = 0
+
+
+class ApiError(Exception):
+    """
+    A request that can't be served; becomes {"error": message} with `status`.
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+################################################################################
+# Rate limiting
+################################################################################
+class ClientLimiter:
+    """
+    One token bucket per client: `rate` requests per minute, up to `burst`
+    at once. Safe to share between threads.
+    """
+
+    # idle clients are forgotten once there are this many buckets
+    MAX_CLIENTS = 10_000
+
+    def __init__(self, rate: float = API_RATE, burst: float = API_BURST):
+        self.rate, self.burst = rate, max(1.0, burst)
+        self._lock = threading.Lock()
+        # client -> (tokens, updated)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def take(self, client: str) -> float:
+        """
+        Spend one request for `client`; returns 0 if allowed, else the
+        seconds until it would be.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate / 60.0)
+            if tokens >= 1:
+                self._buckets[client] = (tokens - 1, now)
+                if len(self._buckets) > self.MAX_CLIENTS:
+                    self._prune(now)
+                return 0.0
+            self._buckets[client] = (tokens, now)
+            return (1 - tokens) * 60.0 / self.rate
+
+    def _prune(self, now: float) -> None:
+        # a bucket that has refilled completely carries no state
+        full = 60.0 * self.burst / self.rate
+        for client, (_, updated) in list(self._buckets.items()):
+            if now - updated >= full:
+                del self._buckets[client]
+
+
+LIMITER = ClientLimiter(API_RATE / max(1, API_WORKERS), API_BURST / max(1, API_WORKERS))
+
+
+def client_id(request: Request) -> str:
+    # unknown keys would let a client mint a fresh bucket per request
+    key = request.headers.get("x-api-key")
+    if key and key in API_KEYS:
+        return "key:" + key
+    forwarded = request.headers.get("x-forwarded-for")
+    if TRUST_PROXY and forwarded:
+        # the last hop, appended by our own load balancer; earlier ones are client-supplied
+        return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+
+tracing.register_metrics(lambda: [("api_inflight_requests", {}, _inflight)])
+
+
+################################################################################
+# Request helpers
+################################################################################
+async def _body(request: Request) -> Dict[str, Any]:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ApiError(400, "body must be JSON")
+    if not isinstance(body, dict):
+        raise ApiError(400, "body must be a JSON object")
+    return body
+
+
+def _int(body: Dict[str, Any], key: str, default: int, low: int, high: int) -> int:
+    value = body.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise ApiError(400, f"{key} must be an integer between {low} and {high}")
+    return value
+
+
+def _options(body: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "bullets": _int(body, "bullets", 6, 1, 30),
+        "faq_count": _int(body, "faq_count", 5, 0, 30),
+        "mcq_count": _int(body, "mcq_count", 5, 0, 30),
+        "max_tokens": _int(body, "max_tokens", 600, 50, 4000),
+        "single_request": bool(body.get("single_request", True)),
+        "stream": True,
+    }
+
+
+def _source(body: Dict[str, Any]) -> Tuple[str, str]:
+    # (url, text) of the request; exactly one of them is set
+    url, text = body.get("url"), body.get("text")
+    if bool(url) == bool(text) or not isinstance(url or text, str):
+        raise ApiError(400, "give either url or text")
+    if url and not url.startswith(("http://", "https://")):
+        raise ApiError(400, "url must be http(s)")
+    return url or "", text or ""
+
+
+def _text(body: Dict[str, Any]) -> str:
+    # the document text: given, or extracted from the url (blocking)
+    from extraction import MAX_TEXT_CHARS, MIN_TEXT_CHARS, extract_url
+    url, text = _source(body)
+    if url:
+        try:
+            page = extract_url(url)
+        except Exception as e:
+            raise ApiError(422, f"Failed to extract text from URL: {e}")
+        text = page.text if page else ""
+    elif len(text) > MAX_TEXT_CHARS:
+        raise ApiError(413, f"text is longer than {MAX_TEXT_CHARS} characters")
+    if len(text.strip()) < MIN_TEXT_CHARS:
+        raise ApiError(422, "not enough text to generate from")
+    return text
+
+
+async def _run(name: str, fn: Callable[..., Any], *args) -> Any:
+    # blocking work on the pool, in its own trace
+    def traced():
+        with tracing.trace(f"api.{name}"):
+            return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(_POOL, traced)
+
+
+def endpoint(name: str, limited: bool = True):
+    """
+    Decorator for route handlers: rate limiting, request counters and
+    errors as JSON.
+    """
+    def decorate(handler):
+        async def wrapped(request: Request) -> Response:
+            global _inflight
+            if limited:
+                wait = LIMITER.take(client_id(request))
+                if wait:
+                    tracing.count("api_requests", route=name, status=429)
+                    return JSONResponse({"error": "rate limit exceeded"}, status_code=429,
+                                        headers={"Retry-After": str(max(1, round(wait)))})
+            _inflight += 1
+            try:
+                response = await handler(request)
+            except ApiError as e:
+                response = JSONResponse({"error": str(e)}, status_code=e.status)
+            except Exception as e:
+                logger.exception("%s failed", name)
+                response = JSONResponse({"error": f"{type(e).__name__}: {e}"}, status_code=500)
+            finally:
+                _inflight -= 1
+            tracing.count("api_requests", route=name, status=response.status_code)
+            return response
+        return wrapped
+    return decorate
+
+
+################################################################################
+# Generation
+################################################################################
+def _section(name: str, body: Dict[str, Any]) -> Any:
+    # one of notes/faqs/mcqs; failed or late LLM calls get the fallback's answer
+    import backends
+    import utils
+    kwargs = dict(bullets=_int(body, "bullets", 6, 1, 30), faq_count=_int(body, "count", 5, 1, 30),
+                  mcq_count=_int(body, "count", 5, 1, 30), max_tokens=_int(body, "max_tokens", 600, 50, 4000))
+    text = _text(body)
+    if backends.get_backend() is None:
+        fallbacks = {"notes": lambda: utils.generate_notes_fallback(text, bullets=kwargs["bullets"]),
+                     "faqs": lambda: utils.generate_faqs_fallback(text, count=kwargs["faq_count"]),
+                     "mcqs": lambda: utils.generate_mcqs_fallback(text, count=kwargs["mcq_count"])}
+        return fallbacks[name]()
+    return dict(utils.iter_generated_sections(text, sections=[name], **kwargs))[name]
+
+
+def _pack(body: Dict[str, Any], report: Callable[..., None]) -> Dict[str, Any]:
+    import jobs
+    options = _options(body)
+    url, _ = _source(body)
+    try:
+        if url:
+            # same path as the app's jobs: caches, duplicate detection, streaming
+            return dict(jobs.run_pipeline(url, options, report), url=url)
+        return jobs.generate_sections(_text(body), options, report)
+    except jobs.JobError as e:
+        raise ApiError(422, str(e))
+
+
+def _ignore(*args, **kwargs) -> None:
+    pass
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class _Disconnected(Exception):
+    """
+    Raised inside a streamed generation once its client has gone away.
+    """
+
+
+def _event_stream(name: str, request: Request, body: Dict[str, Any]) -> StreamingResponse:
+    # run _pack on the pool and relay its reports as they happen
+    loop = asyncio.get_running_loop()
+    events: "asyncio.Queue" = asyncio.Queue()
+    # set when the stream closes; the next report() stops the generation
+    closed = threading.Event()
+
+    def emit(item) -> None:
+        loop.call_soon_threadsafe(events.put_nowait, item)
+
+    def report(progress, stage, partial=None):
+        if closed.is_set():
+            raise _Disconnected()
+        # serialised here: the generator keeps mutating `partial`
+        emit(_sse("progress", {"progress": round(progress, 3), "stage": stage}))
+        if partial is not None:
+            emit(_sse("partial", partial))
+
+    def work():
+        try:
+            with tracing.trace(f"api.{name}", stream=True):
+                emit(_sse("result", _pack(body, report)))
+        except _Disconnected:
+            tracing.count("api_streams_abandoned", route=name)
+        except ApiError as e:
+            emit(_sse("error", {"error": str(e), "status": e.status}))
+        except Exception as e:
+            logger.exception("%s stream failed", name)
+            emit(_sse("error", {"error": f"{type(e).__name__}: {e}", "status": 500}))
+        finally:
+            emit(None)
+
+    _POOL.submit(work)
+
+    async def stream():
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(events.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is None:
+                    return
+                yield item
+        finally:
+            # also reached when the client disconnects and the response is cancelled
+            closed.set()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+################################################################################
+# Routes
+################################################################################
+@endpoint("extract")
+async def extract(request: Request) -> Response:
+    from extraction import extract_url
+    body = await _body(request)
+    url, _ = _source(body)
+    if not url:
+        raise ApiError(400, "extract needs a url")
+    result = await _run("extract", extract_url, url)
+    if result is None:
+        raise ApiError(422, "not enough text on the page")
+    return JSONResponse(result.to_dict())
+
+
+def _section_route(name: str):
+    @endpoint(name)
+    async def handler(request: Request) -> Response:
+        body = await _body(request)
+        return JSONResponse(await _run(name, _section, name, body))
+    return handler
+
+
+@endpoint("pack")
+async def pack(request: Request) -> Response:
+    body = await _body(request)
+    _options(body)
+    _source(body)
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return _event_stream("pack", request, body)
+    return JSONResponse(await _run("pack", _pack, body, _ignore))
+
+
+@endpoint("pdf")
+async def pdf(request: Request) -> Response:
+    import export
+    body = await _body(request)
+    if not any(key in body for key in ("notes", "faqs", "mcqs")):
+        body = dict(await _run("pdf", _pack, body, _ignore), url=body.get("url", ""))
+    try:
+        study_pack = export.StudyPack.from_sections(body, title=str(body.get("title") or ""))
+    except (AttributeError, TypeError, ValueError):
+        raise ApiError(400, "notes must be an object and faqs/mcqs lists of objects, as returned by /pack")
+    data = await _run("pdf", export.render, study_pack, "pdf")
+    return Response(data, media_type="application/pdf", headers={
+        "Content-Disposition": f'attachment; filename="{export.filename(study_pack, "pdf")}"'})
+
+
+@endpoint("health", limited=False)
+async def health(request: Request) -> Response:
+    import backends
+    return JSONResponse({"status": "ok", "backend": backends.active_name() or "fallback", "pid": os.getpid(),
+                         "uptime": round(time.time() - _STARTED, 1), "inflight": _inflight})
+
+
+@endpoint("metrics", limited=False)
+async def metrics(request: Request) -> Response:
+    return PlainTextResponse(tracing.prometheus_text(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # each worker loads the heavy dependencies in the background
+    import warmup
+    warmup.start()
+    yield
+    _POOL.shutdown(wait=False, cancel_futures=True)
+
+
+app = Starlette(
+    routes=[
+        Route("/extract", extract, methods=["POST"]),
+        Route("/notes", _section_route("notes"), methods=["POST"]),
+        Route("/faqs", _section_route("faqs"), methods=["POST"]),
+        Route("/mcqs", _section_route("mcqs"), methods=["POST"]),
+        Route("/pack", pack, methods=["POST"]),
+        Route("/pdf", pdf, methods=["POST"]),
+        Route("/health", health, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
+
+
+def main(argv=None) -> int:
+    import uvicorn
+    parser = argparse.ArgumentParser(prog="python -m api", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=API_WORKERS)
+    opts = parser.parse_args(argv)
+    # the workers read NOTES_API_WORKERS to split the rate limits
+    os.environ["NOTES_API_WORKERS"] = str(opts.workers)
+    uvicorn.run("api:app", host=opts.host, port=opts.port, workers=opts.workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
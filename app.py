@@ -4,9 +4,12 @@ from pathlib import Path
 import time
 import os
 
-from utils import extract_text_from_url, generate_notes_with_openai, generate_notes_fallback
-from utils import generate_faqs_with_openai, generate_faqs_fallback
-from utils import generate_mcqs_with_openai, generate_mcqs_fallback
+import backends
+import export
+import tracing
+import warmup
+from cache import CACHE
+from jobs import get_queue, QUEUED, RUNNING, FAILED
 
 
 st.set_page_config(page_title="URL → Smart Notes", layout="wide")
@@ -27,63 +30,137 @@ num_bullets = st.sidebar.slider("Number of bullet points (notes)", 3, 12, 6)
 num_faq = st.sidebar.slider("Number of FAQs", 1, 10, 5)
 num_mcq = st.sidebar.slider("Number of MCQs", 1, 10, 5)
 max_tokens = st.sidebar.slider("Max tokens for LLM (if used)", 200, 1500, 600)
+single_request = st.sidebar.checkbox(
+    "Single-request study pack", value=True,
+    help="Ask for notes, FAQs and MCQs in one LLM call; only broken sections are re-requested.",
+)
+stream_output = st.sidebar.checkbox(
+    "Stream results as they're written", value=True,
+    help="Show each summary, bullet, FAQ and MCQ as soon as the model finishes it (single-request mode).",
+)
+
+debug_panel = st.sidebar.checkbox(
+    "Debug: timing waterfall", value=False,
+    help="Show where time, tokens and money went for the current job.",
+)
 
 st.sidebar.markdown("---")
 st.sidebar.markdown(
     "Tip: Provide an OpenAI key for high-quality notes & MCQs. If not provided the app uses a local fallback summarizer."
 )
 
+@st.cache_resource
+def metrics_server():
+    # Prometheus text at :NOTES_METRICS_PORT/metrics, one per server process
+    port = os.environ.get("NOTES_METRICS_PORT")
+    return tracing.start_metrics_server(int(port)) if port else None
+
+metrics_server()
+
+@st.cache_resource
+def warm_up():
+    # load openai/trafilatura/lxml/reportlab in the background so the first
+    # job doesn't pay for the imports; reruns skip this
+    return warmup.start()
+
+warm_up()
+
+def render_trace(trace):
+    totals = trace["totals"]
+    st.sidebar.markdown("**Debug: last job**")
+    st.sidebar.write(
+        f"{trace['duration_ms'] / 1000:.2f}s • {totals['llm_calls']} LLM calls • "
+        f"{totals['prompt_tokens']}+{totals['completion_tokens']} tokens • ~${totals['cost_usd']:.4f} • "
+        f"{totals['cache_hits']} cache hits • {totals['retries']} retries"
+    )
+    st.sidebar.code(tracing.format_waterfall(trace) or "(no spans yet)", language=None)
+
+def render_notes(area, notes):
+    with area.container():
+        st.header("📄 Summary / Notes")
+        st.write(notes.get("summary") or "…")
+        st.markdown("**Key bullet points:**")
+        for i, b in enumerate(notes.get("bullets", []), 1):
+            st.write(f"{i}. {b}")
+        st.markdown("---")
+
+def render_faqs(area, faqs):
+    with area.container():
+        st.header("❓ FAQs (Auto-generated)")
+        for i, qa in enumerate(faqs, 1):
+            st.write(f"**Q{i}. {qa['q']}**")
+            st.write(f"- A: {qa['a']}")
+        st.markdown("---")
+
+def render_mcqs(area, mcqs):
+    with area.container():
+        st.header("✏️ MCQs (Auto-generated)")
+        for i, mcq in enumerate(mcqs, 1):
+            st.write(f"**Q{i}. {mcq['question']}**")
+            for idx, opt in enumerate(mcq["options"], 1):
+                st.write(f"- {chr(64+idx)}. {opt}")
+            st.write(f"**Answer:** {mcq['answer']}")
+        st.markdown("---")
+
+RENDERERS = {"notes": render_notes, "faqs": render_faqs, "mcqs": render_mcqs}
+
+EXPORT_FORMATS = {"pdf": "PDF", "md": "Markdown", "html": "HTML", "csv": "Anki (CSV)", "json": "JSON"}
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def export_bytes(job_id, fmt):
+    # rendered once per finished job and format, not on every rerun
+    job = job_queue().get(job_id)
+    return export.render(export.StudyPack.from_sections(job["result"], url=job["url"]), fmt)
+
 # Main UI
 url = st.text_input("Paste a URL to extract notes from", "")
 
+@st.cache_resource
+def job_queue():
+    # one worker pool + job table per server process, shared by every session
+    return get_queue()
+
 col1, col2 = st.columns([3,1])
 with col1:
     if st.button("Generate Notes"):
         if not url.strip():
             st.warning("Please paste a URL first.")
         else:
-            with st.spinner("Fetching and processing the webpage..."):
-                try:
-                    raw_text = extract_text_from_url(url)
-                except Exception as e:
-                    st.error(f"Failed to extract text from URL: {e}")
-                    raw_text = ""
-                if not raw_text or len(raw_text.strip()) < 200:
-                    st.error("Couldn't extract enough textual content from the URL. Try another page.")
-                else:
-                    # Use OpenAI if key present
-                    use_openai = bool(os.environ.get("OPENAI_API_KEY"))
-                    if use_openai:
-                        # Notes
-                        notes = generate_notes_with_openai(raw_text, bullets=num_bullets, max_tokens=max_tokens)
-                        faqs = generate_faqs_with_openai(raw_text, count=num_faq, max_tokens=max_tokens)
-                        mcqs = generate_mcqs_with_openai(raw_text, count=num_mcq, max_tokens=max_tokens)
-                    else:
-                        notes = generate_notes_fallback(raw_text, bullets=num_bullets)
-                        faqs = generate_faqs_fallback(raw_text, count=num_faq)
-                        mcqs = generate_mcqs_fallback(raw_text, count=num_mcq)
-                    st.success("Generated!")
-                    st.markdown("---")
-                    st.header("📄 Summary / Notes")
-                    st.write(notes["summary"])
-                    st.markdown("**Key bullet points:**")
-                    for i, b in enumerate(notes["bullets"], 1):
-                        st.write(f"{i}. {b}")
-                    st.markdown("---")
-                    st.header("❓ FAQs (Auto-generated)")
-                    for i, qa in enumerate(faqs, 1):
-                        st.write(f"**Q{i}. {qa['q']}**")
-                        st.write(f"- A: {qa['a']}")
-                    st.markdown("---")
-                    st.header("✏️ MCQs (Auto-generated)")
-                    for i, mcq in enumerate(mcqs, 1):
-                        st.write(f"**Q{i}. {mcq['question']}**")
-                        for idx, opt in enumerate(mcq["options"], 1):
-                            st.write(f"- {chr(64+idx)}. {opt}")
-                        st.write(f"**Answer:** {mcq['answer']}")
-                    st.markdown("---")
-
-                   
+            options = {
+                "bullets": num_bullets, "faq_count": num_faq, "mcq_count": num_mcq,
+                "max_tokens": max_tokens, "single_request": single_request, "stream": stream_output,
+            }
+            # generation runs on the job workers; this session only keeps the id and polls
+            st.session_state["job_id"] = job_queue().submit(url.strip(), options)
+
+    job_id = st.session_state.get("job_id")
+    job = job_queue().get(job_id) if job_id else None
+    if job:
+        sections = job["result"] or job["partial"] or {}
+        if sections:
+            st.markdown("---")
+        for name in ("notes", "faqs", "mcqs"):
+            if name in sections:
+                RENDERERS[name](st.empty(), sections[name])
+        trace = tracing.get_trace(job_id) if debug_panel else None
+        if trace:
+            render_trace(trace)
+        if job["status"] in (QUEUED, RUNNING):
+            st.progress(job["progress"], text=job["stage"])
+            time.sleep(0.75)
+            st.rerun()
+        elif job["status"] == FAILED:
+            st.error(job["error"])
+        else:
+            st.success("Generated!")
+            fmt = st.selectbox("Download as", list(EXPORT_FORMATS), format_func=EXPORT_FORMATS.get)
+            renderer = export.get_renderer(fmt)
+            st.download_button(
+                f"Download {EXPORT_FORMATS[fmt]}", export_bytes(job_id, fmt),
+                file_name=export.filename(export.StudyPack.from_sections(job["result"], url=job["url"]), fmt),
+                mime=renderer.mime,
+            )
+
 with col2:
     st.header("Preview / Quick tools")
     st.write("Useful quick actions:")
@@ -98,6 +175,10 @@ with col2:
     )
     st.markdown("---")
     st.write("Status:")
-    st.write(f"OpenAI available: {'Yes' if os.environ.get('OPENAI_API_KEY') else 'No (fallback enabled)'}")
+    backend = backends.active_name()
+    st.write(f"Generation backend: {backend or 'none (fallback enabled)'}")
+    cache_stats = CACHE.stats()
+    for ns, counts in cache_stats["namespaces"].items():
+        st.write(f"Cache `{ns}`: {counts['hits']} hits / {counts['misses']} misses")
 
 st.markdown("\n---\nBuilt for hackathons • Simple to extend (chatbot, highlights, multi-language).")
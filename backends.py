@@ -0,0 +1,398 @@
+# backends.py
+"""
+Where generation requests go: the hosted OpenAI API or a local model.
+
+Every LLM call in utils.py and summarizer.py goes through chat(), which
+hands it to the active GenerationBackend:
+
+- "openai": llm_client.chat (pooled client, cache, retries, rate limits)
+- "local": a model running on this machine's CPU, no network and no per
+  token cost. NOTES_LOCAL_MODEL is either a GGUF file (llama.cpp, via
+  llama-cpp-python) or a Hugging Face seq2seq/instruct model id or path
+  (transformers; ONNX exports work through optimum when installed).
+
+NOTES_BACKEND picks one: "auto" (default; OpenAI when a key is set, else
+the local model when one is configured), "openai", "local" or "none"
+(local fallback generators only). get_backend() returns None when the
+chosen backend can't run, and callers then use the fallback generators.
+
+The local backend loads its model once per process, on first use (or in
+warmup.py). Requests from all sessions and jobs go into one queue; a worker
+takes up to NOTES_LOCAL_BATCH of them at a time, waiting at most
+NOTES_LOCAL_BATCH_WAIT_MS for more to arrive, and hands the batch to a pool
+of NOTES_LOCAL_WORKERS threads (default: one per core). Requests with the
+same temperature and max_tokens run as one model call; streamed requests
+(stream=True) are batched with the rest and get their row's text piece by
+piece as it is decoded. A llama.cpp model still runs one sequence at a
+time. Replies share the "llm" cache with the API.
+"""
+import os
+import time
+import queue
+import threading
+import importlib.util
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import tracing
+from cache import CACHE, LLM_TTL, make_key
+
+BACKEND = os.environ.get("NOTES_BACKEND", "auto").lower()
+LOCAL_MODEL = os.environ.get("NOTES_LOCAL_MODEL", "")
+# pool threads running batches, and CPU threads each model call uses;
+# by default the two multiply out to the available cores
+LOCAL_WORKERS = max(1, int(os.environ.get("NOTES_LOCAL_WORKERS", os.cpu_count() or 1)))
+LOCAL_THREADS = int(os.environ.get("NOTES_LOCAL_THREADS", max(1, (os.cpu_count() or 1) // LOCAL_WORKERS)))
+LOCAL_BATCH = int(os.environ.get("NOTES_LOCAL_BATCH", 8))
+LOCAL_BATCH_WAIT = float(os.environ.get("NOTES_LOCAL_BATCH_WAIT_MS", 20)) / 1000.0
+LOCAL_CONTEXT = int(os.environ.get("NOTES_LOCAL_CONTEXT", 4096))
+# seconds a local call may wait in the queue plus run
+LOCAL_TIMEOUT = float(os.environ.get("NOTES_LOCAL_TIMEOUT", 120))
+
+
+class GenerationBackend(ABC):
+    """
+    Interface for a place to send chat requests. chat() returns the reply
+    text, or with stream=True an iterator of text pieces, and raises
+    llm_client.LLMError when the request fails.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def available(self) -> bool:
+        ...
+
+    @abstractmethod
+    def chat(self, messages: List[Dict[str, str]], max_tokens: int = 800, temperature: float = 0.2,
+             stream: bool = False, timeout: Optional[float] = None,
+             model: Optional[str] = None) -> Union[str, Iterator[str]]:
+        ...
+
+
+################################################################################
+# OpenAI
+################################################################################
+class OpenAIBackend(GenerationBackend):
+    name = "openai"
+
+    def available(self) -> bool:
+        import llm_client
+        return llm_client.OPENAI_AVAILABLE and bool(os.environ.get("OPENAI_API_KEY"))
+
+    def chat(self, messages, max_tokens=800, temperature=0.2, stream=False, timeout=None, model=None):
+        import llm_client
+        return llm_client.chat(messages, model=model, max_tokens=max_tokens, temperature=temperature,
+                               stream=stream, timeout=timeout)
+
+
+################################################################################
+# Local model
+################################################################################
+def _engine(model: str) -> str:
+    return "llama_cpp" if model.lower().endswith(".gguf") else "transformers"
+
+
+def _sampling(temperature: float) -> Dict[str, Any]:
+    return {"do_sample": temperature > 0, "temperature": temperature or None}
+
+
+class _LlamaCpp:
+    # llama.cpp: quantized GGUF models, applies the model's own chat template
+    def __init__(self, path: str):
+        from llama_cpp import Llama
+        self.llm = Llama(model_path=path, n_ctx=LOCAL_CONTEXT, n_threads=LOCAL_THREADS, verbose=False)
+        # one llama.cpp context holds one sequence's state at a time
+        self.lock = threading.Lock()
+
+    def generate(self, batch: List[dict]) -> List[str]:
+        # the high-level API runs one sequence at a time; the batch still
+        # shares one loaded model and one worker
+        with self.lock:
+            return [self._one(req) for req in batch]
+
+    def _one(self, req: dict) -> str:
+        kwargs = dict(messages=req["messages"], max_tokens=req["max_tokens"], temperature=req["temperature"])
+        if req["deltas"] is None:
+            return self.llm.create_chat_completion(**kwargs)["choices"][0]["message"]["content"] or ""
+        parts = []
+        for chunk in self.llm.create_chat_completion(stream=True, **kwargs):
+            if req["closed"]:
+                break
+            piece = chunk["choices"][0]["delta"].get("content")
+            if piece:
+                parts.append(piece)
+                req["deltas"].put(piece)
+        return "".join(parts)
+
+
+class _RowStreamer:
+    """
+    transformers streamer for a whole batch: generate() hands it each step's
+    new token per row, and every streamed request gets its row's new text.
+    """
+
+    def __init__(self, tokenizer, batch: List[dict]):
+        self.tokenizer = tokenizer
+        self.batch = batch
+        self.ids: List[List[int]] = [[] for _ in batch]
+        self.sent = [0] * len(batch)
+        self.prompt = True
+
+    def put(self, value) -> None:
+        if self.prompt:
+            # the first call carries the prompt (or the decoder start tokens)
+            self.prompt = False
+            return
+        for row, tokens in enumerate(value.reshape(len(self.batch), -1).tolist()):
+            self.ids[row].extend(tokens)
+            req = self.batch[row]
+            if req["deltas"] is None or req["closed"]:
+                continue
+            text = self.tokenizer.decode(self.ids[row], skip_special_tokens=True)
+            # hold back a partial character until its next token arrives
+            if len(text) > self.sent[row] and not text.endswith("\ufffd"):
+                req["deltas"].put(text[self.sent[row]:])
+                self.sent[row] = len(text)
+
+    def end(self) -> None:
+        pass
+
+
+class _Transformers:
+    # transformers: seq2seq (T5/BART style) or causal instruct models, run batched
+    def __init__(self, name: str):
+        import torch
+        import transformers
+        torch.set_num_threads(LOCAL_THREADS)
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(name)
+        config = transformers.AutoConfig.from_pretrained(name)
+        self.seq2seq = bool(getattr(config, "is_encoder_decoder", False))
+        auto = transformers.AutoModelForSeq2SeqLM if self.seq2seq else transformers.AutoModelForCausalLM
+        if importlib.util.find_spec("optimum") and os.path.exists(os.path.join(name, "model.onnx")):
+            from optimum import onnxruntime as ort
+            auto = ort.ORTModelForSeq2SeqLM if self.seq2seq else ort.ORTModelForCausalLM
+        self.model = auto.from_pretrained(name)
+        if not self.seq2seq:
+            # batched generation pads on the left for decoder-only models
+            self.tokenizer.padding_side = "left"
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+
+    def _prompt(self, messages: List[Dict[str, str]]) -> str:
+        if not self.seq2seq and getattr(self.tokenizer, "chat_template", None):
+            return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return "\n\n".join(m["content"] for m in messages)
+
+    def generate(self, batch: List[dict]) -> List[str]:
+        # the worker groups batches by temperature and max_tokens
+        from transformers import StoppingCriteriaList
+        prompts = [self._prompt(req["messages"]) for req in batch]
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True, truncation=True,
+                                max_length=LOCAL_CONTEXT)
+        kwargs = _sampling(batch[0]["temperature"])
+        if any(req["deltas"] is not None for req in batch):
+            kwargs["streamer"] = _RowStreamer(self.tokenizer, batch)
+            # stop early only once every caller in the batch has gone away
+            kwargs["stopping_criteria"] = StoppingCriteriaList(
+                [lambda input_ids, scores, **kw: all(req["closed"] for req in batch)])
+        ids = self.model.generate(**inputs, max_new_tokens=batch[0]["max_tokens"], **kwargs)
+        if not self.seq2seq:
+            ids = ids[:, inputs["input_ids"].shape[1]:]
+        return self.tokenizer.batch_decode(ids, skip_special_tokens=True)
+
+
+class LocalBackend(GenerationBackend):
+    name = "local"
+
+    def __init__(self, model: str = LOCAL_MODEL):
+        self.model_name = model
+        self._queue: "queue.Queue[dict]" = queue.Queue()
+        self._worker = None
+        self._pool = None
+        # a batch is only collected once a pool thread is free to run it,
+        # so requests arriving meanwhile join the next batch
+        self._slots = threading.Semaphore(LOCAL_WORKERS)
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        if not self.model_name:
+            return False
+        return importlib.util.find_spec(_engine(self.model_name)) is not None
+
+    @property
+    def model(self):
+        return _load_model(self.model_name)
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._worker is None:
+                self._pool = ThreadPoolExecutor(max_workers=LOCAL_WORKERS, thread_name_prefix="local-llm")
+                self._worker = threading.Thread(target=self._run, name="local-llm-batcher", daemon=True)
+                self._worker.start()
+
+    def _next_batch(self) -> List[dict]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + LOCAL_BATCH_WAIT
+        while len(batch) < LOCAL_BATCH:
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            self._slots.acquire()
+            batch = [req for req in self._next_batch() if req["future"].set_running_or_notify_cancel()]
+            try:
+                # loaded here, once, rather than by several pool threads at the same time
+                model = self.model
+            except Exception as e:
+                for req in batch:
+                    self._fail(req, e)
+                batch = []
+            if not batch:
+                self._slots.release()
+                continue
+            self._pool.submit(tracing.bind(self._run_batch), model, batch)
+
+    def _run_batch(self, model, batch: List[dict]) -> None:
+        try:
+            groups: Dict[Tuple[float, int], List[dict]] = {}
+            for req in batch:
+                groups.setdefault((req["temperature"], req["max_tokens"]), []).append(req)
+            for group in groups.values():
+                try:
+                    with tracing.span("llm.batch", backend=self.name, size=len(group)):
+                        replies = model.generate(group)
+                except Exception as e:
+                    for req in group:
+                        self._fail(req, e)
+                    continue
+                for req, reply in zip(group, replies):
+                    req["future"].set_result(reply.strip())
+                    if req["deltas"] is not None:
+                        req["deltas"].put(None)
+        finally:
+            self._slots.release()
+
+    def _fail(self, req: dict, error: Exception) -> None:
+        req["future"].set_exception(error)
+        if req["deltas"] is not None:
+            req["deltas"].put(error)
+
+    def chat(self, messages, max_tokens=800, temperature=0.2, stream=False, timeout=None, model=None):
+        from llm_client import LLMError, LLMTimeout
+        key = make_key("local", self.model_name, messages, max_tokens, temperature)
+        # a streamed call's span stays open until the stream is consumed
+        span = tracing.start_span("llm", backend=self.name, model=self.model_name, max_tokens=max_tokens,
+                                  stream=stream)
+        out = CACHE.get("llm", key)
+        if out is not None:
+            span.set(cache="hit")
+            span.finish()
+            return iter([out]) if stream else out
+        span.set(cache="miss")
+        req = {"messages": messages, "max_tokens": max_tokens, "temperature": temperature, "future": Future(),
+               "deltas": queue.Queue() if stream else None, "closed": False}
+        self._start()
+        self._queue.put(req)
+        wait = timeout if timeout is not None else LOCAL_TIMEOUT
+        if stream:
+            return self._deltas(req, key, span, wait)
+        try:
+            out = req["future"].result(timeout=wait)
+        except FutureTimeout as e:
+            req["future"].cancel()
+            span.finish(e)
+            raise LLMTimeout("local model did not answer in time") from e
+        except Exception as e:
+            span.finish(e)
+            raise LLMError(f"local model failed: {type(e).__name__}: {e}") from e
+        self._record(span, key, messages, out)
+        return out
+
+    def _deltas(self, req: dict, key: str, span, wait: float) -> Iterator[str]:
+        # text pieces as the worker produces them; `wait` bounds the wait
+        # for each piece (the first one includes queueing and the prompt)
+        from llm_client import LLMError, LLMTimeout
+        try:
+            while True:
+                try:
+                    piece = req["deltas"].get(timeout=wait)
+                except queue.Empty as e:
+                    req["closed"] = True
+                    req["future"].cancel()
+                    raise LLMTimeout("local model did not answer in time") from e
+                if piece is None:
+                    break
+                if isinstance(piece, Exception):
+                    raise LLMError(f"local model failed: {type(piece).__name__}: {piece}") from piece
+                yield piece
+        except BaseException as e:
+            # closed early (GeneratorExit) or failed: stop generating for nobody
+            req["closed"] = True
+            span.finish(None if isinstance(e, GeneratorExit) else e)
+            raise
+        # the full reply, as decoded in one piece by the worker
+        self._record(span, key, req["messages"], req["future"].result())
+
+    def _record(self, span, key: str, messages, out: str) -> None:
+        try:
+            tracing.record_llm_usage(span, self.model_name, messages, out)
+            CACHE.set("llm", key, out, ttl=LLM_TTL)
+        finally:
+            span.finish()
+
+
+@lru_cache(maxsize=None)
+def _load_model(name: str):
+    # once per process and model
+    with tracing.span("llm.load", backend="local", model=name):
+        return _LlamaCpp(name) if _engine(name) == "llama_cpp" else _Transformers(name)
+
+
+################################################################################
+# Selection
+################################################################################
+BACKENDS: Dict[str, GenerationBackend] = {"openai": OpenAIBackend(), "local": LocalBackend()}
+
+
+def get_backend(name: str = "") -> Optional[GenerationBackend]:
+    """
+    The backend to use (NOTES_BACKEND unless `name` is given), or None if
+    it can't run and the fallback generators should be used instead.
+    """
+    name = (name or BACKEND).lower()
+    if name == "auto":
+        for candidate in ("openai", "local"):
+            if BACKENDS[candidate].available():
+                return BACKENDS[candidate]
+        return None
+    backend = BACKENDS.get(name)
+    return backend if backend is not None and backend.available() else None
+
+
+def active_name() -> str:
+    """
+    Name of the backend chat() would use right now; "" for none.
+    """
+    backend = get_backend()
+    return backend.name if backend else ""
+
+
+def chat(messages, max_tokens: int = 800, temperature: float = 0.2, stream: bool = False,
+         timeout: Optional[float] = None, model: Optional[str] = None) -> Union[str, Iterator[str]]:
+    """
+    Send a chat request to the active backend. Raises llm_client.LLMError
+    when there is none or the request fails.
+    """
+    backend = get_backend()
+    if backend is None:
+        from llm_client import LLMError
+        raise LLMError("no generation backend available (set OPENAI_API_KEY or NOTES_LOCAL_MODEL)")
+    return backend.chat(messages, max_tokens=max_tokens, temperature=temperature, stream=stream,
+                        timeout=timeout, model=model)
@@ -0,0 +1,4 @@
+# benchmarks/__init__.py
+"""
+Offline benchmark harness: python -m benchmarks --help
+"""
@@ -0,0 +1,102 @@
+# benchmarks/corpus.py
+"""
+HTML corpus for the benchmarks.
+
+Hand-written pages live in benchmarks/fixtures/*.html. Larger pages are
+generated from a fixed seed the first time they're needed and saved under
+benchmarks/fixtures/generated/, so every run (and every machine) measures
+the same bytes without committing megabytes of HTML.
+"""
+import os
+import random
+from html import escape
+from typing import Dict
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+GENERATED_DIR = os.path.join(FIXTURES_DIR, "generated")
+
+# name -> approximate number of words in the article body
+SYNTHETIC_SIZES = {"small": 1_000, "medium": 10_000, "large": 50_000}
+
+_WORDS = """
+system network process energy signal memory structure pattern model method theory
+cell protein enzyme membrane molecule reaction pressure current voltage circuit
+market price demand supply capital labour policy contract agreement revenue
+algorithm compiler database request server cache thread buffer packet protocol
+history empire treaty border colony revolution election parliament dynasty
+climate rainfall glacier sediment erosion volcano mineral aquifer coastline
+measurement analysis evidence experiment hypothesis observation variable sample
+""".split()
+_PROPER = """
+Amsterdam Berlin Cairo Delhi Edinburgh Florence Geneva Helsinki Istanbul Jakarta
+Kepler Lovelace Maxwell Newton Okafor Pasteur Quinn Ramanujan Sagan Turing
+""".split()
+_FILLER = "the a of in to and with for on by from that which is was are were has have can may".split()
+
+
+def _sentence(rng: random.Random) -> str:
+    words = []
+    for _ in range(rng.randint(9, 24)):
+        roll = rng.random()
+        if roll < 0.08:
+            words.append(rng.choice(_PROPER))
+        elif roll < 0.55:
+            words.append(rng.choice(_WORDS))
+        else:
+            words.append(rng.choice(_FILLER))
+    words[0] = words[0].capitalize()
+    return " ".join(words) + rng.choice(".....?!")
+
+
+def synthetic_page(words: int, seed: int = 0) -> str:
+    """
+    Article-shaped HTML page with roughly `words` words of body text,
+    headings, lists and the usual nav/aside/footer boilerplate.
+    """
+    rng = random.Random(seed)
+    body, count, section = [], 0, 0
+    while count < words:
+        if count == 0 or rng.random() < 0.15:
+            section += 1
+            body.append(f"<h2>Section {section}: {escape(rng.choice(_WORDS).title())}</h2>")
+        sentences = [_sentence(rng) for _ in range(rng.randint(3, 8))]
+        count += sum(len(s.split()) for s in sentences)
+        if rng.random() < 0.1:
+            body.append("<ul>" + "".join(f"<li>{escape(s)}</li>" for s in sentences) + "</ul>")
+        else:
+            body.append(f"<p>{escape(' '.join(sentences))}</p>")
+    nav = "".join(f'<a href="/{w}">{w.title()}</a>' for w in _WORDS[:12])
+    return (
+        "<!DOCTYPE html>\n<html lang=\"en\"><head><meta charset=\"utf-8\">"
+        f"<title>Synthetic article ({words} words)</title>"
+        "<script>var tracker = {};</script></head><body>"
+        f"<header><nav>{nav}</nav></header><main><article>"
+        f"<h1>Synthetic article ({words} words)</h1>\n" + "\n".join(body) +
+        "</article><aside><h3>Related</h3><ul><li>More reading</li></ul></aside></main>"
+        "<footer><p>&copy; Benchmark corpus</p></footer></body></html>\n"
+    )
+
+
+def load_corpus(names=None) -> Dict[str, bytes]:
+    """
+    {name: html bytes} for the saved fixtures and the synthetic sizes,
+    optionally limited to `names`.
+    """
+    corpus = {}
+    for filename in sorted(os.listdir(FIXTURES_DIR)):
+        if filename.endswith(".html"):
+            with open(os.path.join(FIXTURES_DIR, filename), "rb") as fh:
+                corpus[filename[:-5]] = fh.read()
+    os.makedirs(GENERATED_DIR, exist_ok=True)
+    for name, words in SYNTHETIC_SIZES.items():
+        if names and name not in names:
+            continue
+        path = os.path.join(GENERATED_DIR, f"{name}.html")
+        if not os.path.exists(path):
+            with open(path, "w", encoding="utf-8") as fh:
+                fh.write(synthetic_page(words, seed=words))
+        with open(path, "rb") as fh:
+            corpus[name] = fh.read()
+    if names:
+        corpus = {k: v for k, v in corpus.items() if k in names}
+    return corpus
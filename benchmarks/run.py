@@ -0,0 +1,272 @@
+# benchmarks/run.py
+"""
+Offline benchmarks for the processing stages.
+
+    python -m benchmarks                      # run everything, compare with baseline.json if present
+    python -m benchmarks --save-baseline      # record the current numbers as the baseline
+    python -m benchmarks --stages extract,mcqs_fallback --fixtures large --repeat 10
+
+Every stage runs against every fixture in the corpus (benchmarks/corpus.py).
+Pages are fetched from a local FixtureServer and the LLM stages talk to a
+FakeOpenAI server (benchmarks/servers.py), so nothing leaves the machine
+and the on-disk cache is disabled for the run. Fallback stages rebuild the
+document index on every call, so each timing is a cold run.
+
+For each stage x fixture the report has latency percentiles, throughput
+(calls/s and input MB/s), the Python peak memory of one call (tracemalloc)
+and, for LLM stages, how many requests reached the fake API. Results are
+written as JSON; with a baseline present every p50 and peak is compared and
+anything slower than --threshold is flagged. Timings only compare on the
+same machine, so no baseline is committed: record one locally with
+--save-baseline first (without one the comparison is skipped).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+from benchmarks.corpus import load_corpus
+from benchmarks.servers import FakeOpenAI, FixtureServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, "baseline.json")
+DEFAULT_OUT = os.path.join(HERE, "results", "latest.json")
+
+STAGES = ["extract", "split_sentences", "notes_fallback", "faqs_fallback", "mcqs_fallback",
+          "llm_pack", "llm_stream", "pdf"]
+
+
+def _configure_env(api_base: str) -> None:
+    # must run before the app modules are imported: cache.py and the OpenAI
+    # client read these at import time
+    os.environ["NOTES_CACHE_DISABLE"] = "1"
+    os.environ["OPENAI_API_KEY"] = "bench-key"
+    os.environ["NOTES_BACKEND"] = "openai"
+    os.environ["OPENAI_BASE_URL"] = api_base
+    os.environ["OPENAI_API_BASE"] = api_base
+    # measure our code, not the org's rate limits (set these to benchmark throttling)
+    os.environ.setdefault("OPENAI_RPM", "1000000")
+    os.environ.setdefault("OPENAI_TPM", "1000000000")
+
+
+def _build_cases(stages: List[str], corpus: Dict[str, bytes], pages: FixtureServer,
+                 texts: Dict[str, str]) -> List[Tuple[str, str, int, Callable[[], object]]]:
+    """
+    (stage, fixture, input bytes, call) for every requested combination.
+    """
+    import utils
+    import docindex
+    from pdf_utils import create_pdf_bytes
+
+    def cold(fn):
+        # drop the memoised DocumentIndex so every call pays for indexing
+        def call():
+            docindex._cached_index.cache_clear()
+            return fn()
+        return call
+
+    cases = []
+    for name, html in corpus.items():
+        text = texts[name]
+        size = len(text.encode("utf-8"))
+        by_stage = {
+            "extract": (len(html), lambda url=pages.url(name): utils.extract_text_from_url(url)),
+            "split_sentences": (size, cold(lambda t=text: utils.split_sentences(t))),
+            "notes_fallback": (size, cold(lambda t=text: utils.generate_notes_fallback(t))),
+            "faqs_fallback": (size, cold(lambda t=text: utils.generate_faqs_fallback(t))),
+            "mcqs_fallback": (size, cold(lambda t=text: utils.generate_mcqs_fallback(t))),
+            "llm_pack": (size, lambda t=text: dict(utils.iter_note_sections(t, use_openai=True))),
+            "llm_stream": (size, lambda t=text: list(utils.iter_study_pack_stream(t))),
+        }
+        if "pdf" in stages:
+            notes = utils.generate_notes_fallback(text)
+            faqs = utils.generate_faqs_fallback(text)
+            mcqs = utils.generate_mcqs_fallback(text)
+            by_stage["pdf"] = (size, lambda n=notes, f=faqs, m=mcqs: create_pdf_bytes(
+                name, n["summary"], n["bullets"], f, m))
+        for stage in stages:
+            nbytes, call = by_stage[stage]
+            cases.append((stage, name, nbytes, call))
+    return cases
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    # nearest-rank
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def measure(call: Callable[[], object], repeat: int, nbytes: int, llm: Optional[FakeOpenAI] = None) -> Dict:
+    """
+    Time `repeat` calls after one warm-up, then one more under tracemalloc
+    for the peak. Exceptions are counted, not raised.
+    """
+    errors = 0
+    try:
+        call()
+    except Exception:
+        errors += 1
+    requests_before = llm.requests if llm else 0
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            call()
+        except Exception:
+            errors += 1
+        timings.append(time.perf_counter() - started)
+    requests = (llm.requests - requests_before) / repeat if llm else None
+    tracemalloc.start()
+    try:
+        call()
+    except Exception:
+        errors += 1
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    timings.sort()
+    total = sum(timings) or 1e-9
+    result = {
+        "n": repeat,
+        "p50_ms": _percentile(timings, 50) * 1000,
+        "p90_ms": _percentile(timings, 90) * 1000,
+        "p99_ms": _percentile(timings, 99) * 1000,
+        "mean_ms": total / repeat * 1000,
+        "ops_per_s": repeat / total,
+        "mb_per_s": nbytes * repeat / total / 1e6,
+        "peak_kb": peak / 1024,
+        "errors": errors,
+    }
+    if requests is not None:
+        result["llm_requests"] = requests
+    return result
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[Dict]:
+    """
+    Per stage/fixture p50 and peak deltas against `baseline`; `regressed`
+    is set when either grew by more than `threshold` (a fraction).
+    """
+    rows = []
+    for key, now in current["results"].items():
+        before = baseline.get("results", {}).get(key)
+        if not before:
+            continue
+        row = {"case": key}
+        for metric in ("p50_ms", "peak_kb"):
+            old = before.get(metric) or 0.0
+            row[metric] = (now[metric] - old) / old if old else 0.0
+        row["regressed"] = any(row[m] > threshold for m in ("p50_ms", "peak_kb"))
+        rows.append(row)
+    return rows
+
+
+def _print_results(results: Dict[str, Dict], deltas: Dict[str, Dict]) -> None:
+    header = (f"{'case':<32}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'ops/s':>9}{'MB/s':>8}"
+              f"{'peak KB':>10}{'err':>5}{'llm':>5}{'Δp50':>8}{'Δpeak':>8}")
+    print(header)
+    print("-" * len(header))
+    for key, r in results.items():
+        delta = deltas.get(key)
+        d50 = f"{delta['p50_ms']:+.0%}" if delta else ""
+        dpeak = f"{delta['peak_kb']:+.0%}" if delta else ""
+        flag = "  <-- slower" if delta and delta["regressed"] else ""
+        # requests per call that reached the fake API; 0 means the stage fell back
+        llm = f"{r['llm_requests']:.0f}" if "llm_requests" in r else ""
+        print(f"{key:<32}{r['p50_ms']:>10.1f}{r['p90_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['ops_per_s']:>9.1f}"
+              f"{r['mb_per_s']:>8.2f}{r['peak_kb']:>10.0f}{r['errors']:>5}{llm:>5}{d50:>8}{dpeak:>8}{flag}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Offline benchmarks.")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma-separated subset of {STAGES}")
+    parser.add_argument("--fixtures", default="", help="comma-separated fixture names (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed calls per stage and fixture")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="fake API seconds to first token")
+    parser.add_argument("--llm-jitter", type=float, default=0.05, help="extra random fake API delay (max s)")
+    parser.add_argument("--llm-tps", type=float, default=0.0, help="fake API tokens/s (0: reply is instant)")
+    parser.add_argument("--out", default=DEFAULT_OUT, help="where to write this run's JSON results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before flagging")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 if anything is flagged")
+    return parser
+
+
+def main(argv=None) -> int:
+    opts = build_parser().parse_args(argv)
+    stages = [s for s in opts.stages.split(",") if s]
+    unknown = sorted(set(stages) - set(STAGES))
+    if unknown:
+        print(f"unknown stages: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    names = [n for n in opts.fixtures.split(",") if n] or None
+    corpus = load_corpus(names)
+    if not corpus:
+        print("no fixtures selected", file=sys.stderr)
+        return 2
+
+    with FixtureServer(corpus) as pages, \
+            FakeOpenAI(opts.llm_latency, opts.llm_jitter, opts.llm_tps) as llm:
+        _configure_env(llm.api_base)
+        import utils
+        # the text each fixture extracts to is the input of every later stage
+        texts = {name: utils.extract_text_from_url(pages.url(name)) for name in corpus}
+        results = {}
+        for stage, name, nbytes, call in _build_cases(stages, corpus, pages, texts):
+            key = f"{stage}/{name}"
+            print(f"running {key} ...", file=sys.stderr)
+            results[key] = measure(call, opts.repeat, nbytes, llm if stage.startswith("llm") else None)
+
+    run = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": opts.repeat,
+            "llm_latency": opts.llm_latency,
+            "llm_jitter": opts.llm_jitter,
+            "llm_tps": opts.llm_tps,
+            "input_chars": {name: len(text) for name, text in texts.items()},
+            # ru_maxrss is KB on Linux, bytes on macOS
+            "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        },
+        "results": results,
+    }
+
+    deltas = {}
+    baseline = None
+    if not opts.save_baseline and os.path.exists(opts.baseline):
+        with open(opts.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        deltas = {row["case"]: row for row in compare(run, baseline, opts.threshold)}
+    elif not opts.save_baseline:
+        # timings are machine-specific, so no baseline ships with the repo
+        print(f"no baseline at {opts.baseline}; skipping comparison "
+              "(record one on this machine with --save-baseline)", file=sys.stderr)
+    _print_results(results, deltas)
+
+    targets = [opts.out] + ([opts.baseline] if opts.save_baseline else [])
+    for path in targets:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(run, fh, indent=2)
+    print(f"\nresults written to {', '.join(targets)}", file=sys.stderr)
+
+    regressed = [key for key, row in deltas.items() if row["regressed"]]
+    if regressed:
+        print(f"{len(regressed)} case(s) slower than baseline by more than {opts.threshold:.0%}: "
+              + ", ".join(regressed), file=sys.stderr)
+        if opts.fail_on_regression:
+            return 1
+    return 0
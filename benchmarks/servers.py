@@ -0,0 +1,177 @@
+# benchmarks/servers.py
+"""
+Local stand-ins for the two network dependencies, so benchmarks run offline
+and repeatably:
+
+- FixtureServer serves the HTML corpus over HTTP (with ETag support, like a
+  real site) for the fetch + extract stage.
+- FakeOpenAI answers /chat/completions (plain and streamed) with
+  well-formed replies after a configurable delay, standing in for the API.
+
+Both bind 127.0.0.1 on a free port and run on a daemon thread; use them as
+context managers.
+"""
+import json
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+
+class _Server:
+    def __init__(self, handler):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._httpd.daemon_threads = True
+        self._httpd.owner = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Dict[str, str] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _FixtureHandler(_QuietHandler):
+    def do_GET(self):
+        server = self.server.owner
+        name = self.path.strip("/").split("?")[0]
+        body = server.pages.get(name)
+        if body is None:
+            self._send(404, b"not found", "text/plain")
+            return
+        etag = server.etags[name]
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._send(200, body, "text/html; charset=utf-8", {"ETag": etag})
+
+
+class FixtureServer(_Server):
+    """
+    Serves `pages` ({name: html bytes}) at /<name>.
+    """
+
+    def __init__(self, pages: Dict[str, bytes]):
+        self.pages = pages
+        self.etags = {name: '"%s"' % hashlib.sha1(body).hexdigest()[:16] for name, body in pages.items()}
+        super().__init__(_FixtureHandler)
+
+    def url(self, name: str) -> str:
+        return f"{self.base_url}/{name}"
+
+
+def _fake_reply(prompt: str, items: int = 12) -> str:
+    """
+    Reply text shaped like what each of the app's prompts asks for.
+    """
+    bullets = [f"Key concept number {i} explained in one short line." for i in range(1, items + 1)]
+    faqs = [{"q": f"What does point {i} describe?", "a": f"Point {i} describes a central idea of the article."}
+            for i in range(1, items + 1)]
+    mcqs = [{"question": f"Which option completes statement {i}?",
+             "options": [f"Option {i}A", f"Option {i}B", f"Option {i}C", f"Option {i}D"],
+             "answer": f"Option {i}B"} for i in range(1, items + 1)]
+    summary = "The article explains its topic in a few connected steps. It closes with why the topic matters."
+    if "ONE JSON object" in prompt:
+        return json.dumps({"summary": summary, "bullets": bullets, "definitions": ["Term: meaning."],
+                           "faqs": faqs, "mcqs": mcqs})
+    if "JSON with keys: summary" in prompt:
+        return json.dumps({"summary": summary, "bullets": bullets, "definitions": []})
+    if "'q' and 'a'" in prompt:
+        return json.dumps(faqs)
+    if "multiple-choice" in prompt:
+        return json.dumps(mcqs)
+    return summary + "\n" + "\n".join(f"- {b}" for b in bullets)
+
+
+class _FakeOpenAIHandler(_QuietHandler):
+    def do_POST(self):
+        server = self.server.owner
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._send(404, b'{"error": {"message": "not found"}}', "application/json")
+            return
+        with server.lock:
+            server.requests += 1
+        prompt = "\n".join(str(m.get("content", "")) for m in request.get("messages", []))
+        reply = _fake_reply(prompt)
+        model = request.get("model", "fake")
+        # first token after `latency` (+ jitter), then the reply at `tokens_per_sec`
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+        pieces = [reply[i:i + 16] for i in range(0, len(reply), 16)]
+        per_piece = 4.0 / server.tokens_per_sec if server.tokens_per_sec else 0.0
+        if not request.get("stream"):
+            time.sleep(per_piece * len(pieces))
+            body = json.dumps({
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(reply) // 4,
+                          "total_tokens": (len(prompt) + len(reply)) // 4},
+            }).encode()
+            self._send(200, body, "application/json")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for piece in pieces + [None]:
+            delta = {"content": piece} if piece is not None else {}
+            chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": delta,
+                                                  "finish_reason": None if piece is not None else "stop"}]}
+            self.wfile.write(b"data: " + json.dumps(chunk).encode() + b"\n\n")
+            self.wfile.flush()
+            time.sleep(per_piece)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class FakeOpenAI(_Server):
+    """
+    OpenAI-compatible chat completions endpoint. Each request waits
+    `latency` seconds plus up to `jitter` more before answering; with
+    `tokens_per_sec` set the reply itself also takes time to "generate".
+    Point clients at `api_base`.
+    """
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.05, tokens_per_sec: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_sec = tokens_per_sec
+        self.requests = 0
+        self.lock = threading.Lock()
+        super().__init__(_FakeOpenAIHandler)
+
+    @property
+    def api_base(self) -> str:
+        return f"{self.base_url}/v1"
@@ -0,0 +1,231 @@
+# cache.py
+"""
+Small disk-backed cache shared by the extraction and generation stages.
+
+Entries live in a single SQLite file, grouped by namespace ("extract",
+"llm", ...). Every entry has a TTL, the file is kept under a size budget
+by evicting the least recently used entries, and hit/miss counters are
+kept per namespace for the status panel.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import tracing
+
+CACHE_PATH = os.environ.get("NOTES_CACHE_PATH", os.path.join(".cache", "notes.sqlite3"))
+CACHE_MAX_BYTES = int(float(os.environ.get("NOTES_CACHE_MAX_MB", 256)) * 1024 * 1024)
+CACHE_DISABLED = os.environ.get("NOTES_CACHE_DISABLE", "").lower() in ("1", "true", "yes")
+
+# writes between recounts of the total size; catches what other processes
+# sharing the file added since
+_RECOUNT_WRITES = 1000
+
+# Default lifetimes (seconds)
+EXTRACT_TTL = float(os.environ.get("NOTES_CACHE_TTL_EXTRACT", 6 * 3600))
+LLM_TTL = float(os.environ.get("NOTES_CACHE_TTL_LLM", 30 * 24 * 3600))
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Content-addressed key: sha256 over the JSON encoding of `parts`.
+    """
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def normalize_url(url: str) -> str:
+    """
+    Lower-case scheme/host, drop default ports and fragments and sort the
+    query string so trivially different spellings share one cache entry.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or "http"
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    path = parts.path or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+class DiskCache:
+    """
+    SQLite-backed key/value store with per-entry TTL and LRU eviction.
+    Values must be JSON-serialisable. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        self._conn = None
+        # running total of entry sizes, so a write doesn't have to sum the table
+        self._bytes = 0
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " size INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_expires ON entries(expires)")
+            conn.commit()
+            self._bytes = self._total(conn)
+            self._conn = conn
+        return self._conn
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """
+        Return the cached value or None on a miss / expired entry.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires, size FROM entries WHERE namespace=? AND key=?", (namespace, key)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    conn.execute("DELETE FROM entries WHERE namespace=? AND key=?", (namespace, key))
+                    conn.commit()
+                    self._bytes -= row[2]
+                self.misses[namespace] += 1
+                return None
+            conn.execute(
+                "UPDATE entries SET accessed=? WHERE namespace=? AND key=?", (now, namespace, key)
+            )
+            conn.commit()
+            self.hits[namespace] += 1
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            self._bytes += size - self._size(conn, namespace, key)
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, expires, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, payload, size, now + ttl, now),
+            )
+            self._evict(conn, now)
+            conn.commit()
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            self._bytes -= self._size(conn, namespace, key)
+            conn.execute("DELETE FROM entries WHERE namespace=? AND key=?", (namespace, key))
+            conn.commit()
+
+    @staticmethod
+    def _size(conn: sqlite3.Connection, namespace: str, key: str) -> int:
+        row = conn.execute("SELECT size FROM entries WHERE namespace=? AND key=?", (namespace, key)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _total(conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        # expired entries go first (found through their index), then least
+        # recently used until under budget
+        expired = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries WHERE expires < ?", (now,)).fetchone()[0]
+        if expired:
+            conn.execute("DELETE FROM entries WHERE expires < ?", (now,))
+            self._bytes -= expired
+        self._writes += 1
+        if self._writes % _RECOUNT_WRITES == 0:
+            self._bytes = self._total(conn)
+        if self._bytes <= self.max_bytes:
+            return
+        # recount before evicting: other processes may have evicted already
+        self._bytes = total = self._total(conn)
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute("SELECT namespace, key, size FROM entries ORDER BY accessed ASC")
+        victims = []
+        for namespace, key, size in rows:
+            if total <= self.max_bytes:
+                break
+            victims.append((namespace, key))
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE namespace=? AND key=?", victims)
+        self._bytes = total
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Hit/miss counters per namespace plus the current entry count and size.
+        """
+        with self._lock:
+            conn = self._connect()
+            count, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        namespaces = set(self.hits) | set(self.misses)
+        return {
+            "entries": count,
+            "bytes": size,
+            "namespaces": {
+                ns: {"hits": self.hits[ns], "misses": self.misses[ns]} for ns in sorted(namespaces)
+            },
+        }
+
+
+class _NullCache(DiskCache):
+    """
+    Drop-in used when NOTES_CACHE_DISABLE is set: always misses, stores nothing.
+    """
+
+    def get(self, namespace, key):
+        self.misses[namespace] += 1
+        return None
+
+    def set(self, namespace, key, value, ttl):
+        pass
+
+    def delete(self, namespace, key):
+        pass
+
+    def stats(self):
+        return {"entries": 0, "bytes": 0, "namespaces": {
+            ns: {"hits": 0, "misses": n} for ns, n in sorted(self.misses.items())
+        }}
+
+
+# Process-wide instance used by utils.py / extractor.py / summarizer.py
+CACHE = _NullCache() if CACHE_DISABLED else DiskCache()
+
+
+def _cache_metrics():
+    # exported by tracing.prometheus_text()
+    stats = CACHE.stats()
+    yield "cache_entries", {}, stats["entries"]
+    yield "cache_bytes", {}, stats["bytes"]
+    for ns, counts in stats["namespaces"].items():
+        yield "cache_hits_total", {"namespace": ns}, counts["hits"]
+        yield "cache_misses_total", {"namespace": ns}, counts["misses"]
+
+
+tracing.register_metrics(_cache_metrics)
@@ -0,0 +1,158 @@
+# chunking.py
+"""
+Token-aware chunking and map-reduce condensation for long documents.
+
+Instead of cutting every prompt at text[:4000], long text is split on
+paragraph/sentence boundaries into chunks of roughly CHUNK_TOKENS tokens,
+each chunk is summarized in parallel (the "map"), and the summaries are
+joined and, if still too long, condensed again (the "reduce") until they
+fit the prompt budget.
+
+Chunk boundaries are content-defined: besides the size limit, a chunk is
+closed after any paragraph whose hash hits a fixed pattern. An edit to one
+section therefore only changes the chunks around it, and since LLM calls
+are cached by prompt content, only those chunks are re-summarized.
+"""
+import os
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, List
+
+import tracing
+
+# Tokens of article text a single prompt may carry
+INPUT_TOKEN_BUDGET = int(os.environ.get("NOTES_INPUT_TOKEN_BUDGET", 3000))
+# Target size of one map-step chunk
+CHUNK_TOKENS = int(os.environ.get("NOTES_CHUNK_TOKENS", 1500))
+# Reduce passes before we give up and truncate
+MAX_REDUCE_DEPTH = 3
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    # loading the BPE tables is slow (and may download them), so on first use
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+_PARAGRAPH_SPLIT = re.compile(r"\n\s*\n|\n")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+
+# Separate from the generation pool: generation tasks wait on these, so
+# sharing one pool could deadlock once it's saturated
+_CHUNK_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("NOTES_CHUNK_WORKERS", 8)),
+    thread_name_prefix="chunk",
+)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Exact count with tiktoken when it's installed, else ~4 chars per token.
+    """
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def _pieces(text: str, max_tokens: int) -> List[str]:
+    """
+    Paragraphs, with any paragraph over `max_tokens` broken into sentences
+    (and any sentence still over it hard-cut).
+    """
+    out = []
+    for para in _PARAGRAPH_SPLIT.split(text):
+        para = para.strip()
+        if not para:
+            continue
+        if count_tokens(para) <= max_tokens:
+            out.append(para)
+            continue
+        for sent in _SENTENCE_SPLIT.split(para):
+            while count_tokens(sent) > max_tokens:
+                head = truncate_to_tokens(sent, max_tokens)
+                out.append(head)
+                sent = sent[len(head):]
+            if sent.strip():
+                out.append(sent.strip())
+    return out
+
+
+def split_into_chunks(text: str, max_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """
+    Split `text` into chunks of at most `max_tokens` tokens on paragraph
+    (then sentence) boundaries, using content-defined cut points so that
+    boundaries stay put when an unrelated part of the document changes.
+    """
+    min_tokens = max_tokens // 2
+    chunks, current, size = [], [], 0
+    for piece in _pieces(text, max_tokens):
+        n = count_tokens(piece)
+        if current and size + n > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += n
+        if size >= min_tokens and zlib.crc32(piece.encode("utf-8")) % 4 == 0:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def condense_text(text: str, summarize: Callable[[str], str], budget: int = INPUT_TOKEN_BUDGET,
+                  chunk_tokens: int = CHUNK_TOKENS) -> str:
+    """
+    Return `text` unchanged if it fits in `budget` tokens; otherwise
+    map-reduce it: summarize every chunk in parallel with `summarize`,
+    join the results in document order and repeat on the joined summaries
+    until they fit. A chunk whose summary fails keeps its leading text.
+    """
+    def safe_summarize(chunk: str) -> str:
+        try:
+            out = summarize(chunk)
+        except Exception:
+            out = ""
+        # never let a "summary" grow the text
+        return out.strip() or truncate_to_tokens(chunk, chunk_tokens // 4)
+
+    if count_tokens(text) <= budget:
+        return text
+    with tracing.span("condense") as sp:
+        for depth in range(MAX_REDUCE_DEPTH):
+            if count_tokens(text) <= budget:
+                return text
+            chunks = split_into_chunks(text, chunk_tokens)
+            sp.set(rounds=depth + 1, chunks=sp.attrs.get("chunks", 0) + len(chunks))
+            text = "\n\n".join(_CHUNK_POOL.map(tracing.bind(safe_summarize), chunks))
+        return truncate_to_tokens(text, budget)
+
+
+def chunk_summary_prompt(chunk: str) -> list:
+    """
+    Chat messages for the map step; shared so every caller hits the same cache entries.
+    """
+    return [
+        {"role": "system", "content": "You condense article sections into dense study notes."},
+        {"role": "user", "content": (
+            "Condense this section of a longer article into compact notes. Keep every key fact, "
+            "definition, number and name; drop filler. Plain text, no preamble.\n\n"
+            "SECTION:\n\n" + chunk
+        )},
+    ]
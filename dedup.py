@@ -0,0 +1,295 @@
+# dedup.py
+"""
+Recognise the same article under different URLs and reuse its notes.
+
+Two layers:
+
+- canonical_url(url) folds the usual URL variants together: tracking
+  parameters (utm_*, fbclid, gclid, ...), AMP variants (/amp, ?amp=1,
+  amp. subdomains), www., fragments and trailing slashes. The page's own
+  <link rel="canonical"> (extraction metadata) is used once it's known.
+- simhash(text) is a 64-bit fingerprint of the text's word shingles; two
+  copies of an article that differ only in boilerplate, ads or small edits
+  are a few bits apart. Fingerprints are split into LSH_BANDS bands, and
+  near-duplicates within MAX_DISTANCE bits are guaranteed to share at least
+  one band (pigeonhole), so a lookup only compares against the documents in
+  matching band buckets.
+
+DedupStore keeps canonical URL + fingerprint + generated result per
+document and output options in a SQLite file; jobs.py checks it before
+extracting and again before generating.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, Optional
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
+
+import numpy as np
+
+import tracing
+from cache import make_key, normalize_url
+
+DEDUP_PATH = os.environ.get("NOTES_DEDUP_PATH", os.path.join(".cache", "dedup.sqlite3"))
+DEDUP_DISABLED = os.environ.get("NOTES_DEDUP_DISABLE", "").lower() in ("1", "true", "yes")
+# near-duplicate if the fingerprints differ in at most this many bits
+MAX_DISTANCE = int(os.environ.get("NOTES_DEDUP_DISTANCE", 6))
+# ... and the texts are within this length ratio of each other
+MIN_LENGTH_RATIO = 0.8
+# stored results older than this are ignored and purged (seconds)
+DEDUP_TTL = float(os.environ.get("NOTES_DEDUP_TTL", 30 * 24 * 3600))
+# MAX_DISTANCE < LSH_BANDS, so every near-duplicate shares a band
+LSH_BANDS = 8
+SHINGLE_WORDS = 3
+
+_BAND_BITS = 64 // LSH_BANDS
+_TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_ga", "_gl",
+    "ref", "ref_src", "ref_url", "referrer", "cmpid", "icid", "ito", "ns_campaign", "ns_mchannel",
+    "ns_source", "ocid", "smid", "sr_share", "spm", "amp", "outputtype",
+}
+_TRACKING_PREFIXES = ("utm_", "pk_", "mtm_", "hsa_", "oly_")
+_AMP_PATH = re.compile(r"/amp(?:\.html?)?/?$|\.amp(?=\.html?$|$)", re.I)
+_WORD = re.compile(r"\w+")
+
+
+def canonical_url(url: str, page_canonical: str = "") -> str:
+    """
+    One spelling for every variant of `url`. `page_canonical` is the page's
+    rel=canonical href, if known; it wins when it's a usable http(s) URL.
+    """
+    if page_canonical:
+        target = urljoin(url, page_canonical.strip())
+        if urlsplit(target).scheme in ("http", "https") and urlsplit(target).hostname:
+            url = target
+    parts = urlsplit(normalize_url(url))
+    host = parts.netloc
+    for prefix in ("www.", "amp."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = _AMP_PATH.sub("", parts.path).rstrip("/") or "/"
+    query = urlencode([
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in _TRACKING_PARAMS and not k.lower().startswith(_TRACKING_PREFIXES)
+    ])
+    # http and https copies are the same article
+    return urlunsplit(("https", host, path, query, ""))
+
+
+def simhash(text: str) -> int:
+    """
+    64-bit SimHash over overlapping SHINGLE_WORDS-word shingles of `text`.
+    """
+    words = _WORD.findall(text.lower())
+    if not words:
+        return 0
+    n = max(1, len(words) - SHINGLE_WORDS + 1)
+    shingles = (" ".join(words[i:i + SHINGLE_WORDS]) for i in range(n))
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64, count=n,
+    )
+    # per bit: +1 for every shingle hash with the bit set, -1 otherwise
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) - n
+    return int(sum(1 << i for i in np.flatnonzero(votes > 0).tolist()))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(fingerprint: int) -> Iterable[int]:
+    mask = (1 << _BAND_BITS) - 1
+    return [(fingerprint >> (i * _BAND_BITS)) & mask for i in range(LSH_BANDS)]
+
+
+def _signed(fingerprint: int) -> int:
+    # SQLite integers are signed 64-bit
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def options_key(options: Dict[str, Any], use_openai: bool) -> str:
+    """
+    The options that change what gets generated; results are only reused
+    for the same ones and the same generation backend (LLM notes are never
+    replaced by fallback ones, nor API notes by local-model ones).
+    """
+    import backends
+    backend = backends.active_name() if use_openai else ""
+    return make_key(options.get("bullets", 6), options.get("faq_count", 5), options.get("mcq_count", 5),
+                    options.get("max_tokens", 600), backend)
+
+
+class DedupStore:
+    """
+    Documents (canonical URL, fingerprint, length), the URLs seen for each
+    and their generated results per options key. Safe to share between
+    threads.
+    """
+
+    def __init__(self, path: str = DEDUP_PATH, max_distance: int = MAX_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " id INTEGER PRIMARY KEY, canonical TEXT NOT NULL, fingerprint INTEGER NOT NULL,"
+                " chars INTEGER NOT NULL, created REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, doc INTEGER NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, bucket INTEGER NOT NULL,"
+                " doc INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS bands_bucket ON bands(band, bucket)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results (doc INTEGER NOT NULL, options TEXT NOT NULL,"
+                " result TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (doc, options))"
+            )
+            conn.commit()
+            self._conn = conn
+            self._purge(conn)
+        return self._conn
+
+    def _purge(self, conn: sqlite3.Connection) -> None:
+        # expired results first, then documents nothing refers to any more
+        conn.execute("DELETE FROM results WHERE created < ?", (time.time() - DEDUP_TTL,))
+        conn.execute("DELETE FROM documents WHERE id NOT IN (SELECT doc FROM results)")
+        conn.execute("DELETE FROM urls WHERE doc NOT IN (SELECT id FROM documents)")
+        conn.execute("DELETE FROM bands WHERE doc NOT IN (SELECT id FROM documents)")
+        conn.commit()
+
+    def _result(self, conn, doc: int, options: str, max_age: float = DEDUP_TTL) -> Optional[Dict[str, Any]]:
+        row = conn.execute("SELECT result FROM results WHERE doc=? AND options=? AND created >= ?",
+                           (doc, options, time.time() - max_age)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _distance(self, fingerprint: int, chars: int, stored: int, stored_chars: int) -> Optional[int]:
+        # bits between the fingerprints, or None if the documents aren't near-duplicates
+        if min(chars, stored_chars) < MIN_LENGTH_RATIO * max(chars, stored_chars):
+            return None
+        distance = hamming(fingerprint, stored & ((1 << 64) - 1))
+        return distance if distance <= self.max_distance else None
+
+    def find_by_url(self, url: str, options: str, max_age: float = DEDUP_TTL,
+                    fingerprint: Optional[int] = None, chars: int = 0) -> Optional[Dict[str, Any]]:
+        """
+        Stored result, at most `max_age` seconds old, for a document already
+        seen under canonical `url`. With `fingerprint` and `chars` (of the
+        text in hand) the document must also be a near-duplicate of it.
+        """
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT d.id, d.fingerprint, d.chars FROM urls u JOIN documents d ON d.id = u.doc WHERE u.url=?",
+                (url,)).fetchone()
+            if row is None:
+                return None
+            if fingerprint is not None and self._distance(fingerprint, chars, row[1], row[2]) is None:
+                return None
+            return self._result(conn, row[0], options, max_age)
+
+    def _near(self, conn, fingerprint: int, chars: int):
+        # (distance, doc) of every stored near-duplicate, closest first
+        buckets = list(enumerate(_bands(fingerprint)))
+        rows = conn.execute(
+            "SELECT DISTINCT d.id, d.fingerprint, d.chars FROM bands b JOIN documents d ON d.id = b.doc"
+            " WHERE " + " OR ".join(["(b.band=? AND b.bucket=?)"] * len(buckets)),
+            [v for pair in buckets for v in pair],
+        ).fetchall()
+        matches = []
+        for doc, stored, stored_chars in rows:
+            distance = self._distance(fingerprint, chars, stored, stored_chars)
+            if distance is not None:
+                matches.append((distance, doc))
+        return sorted(matches)
+
+    def _nearest(self, conn, fingerprint: int, chars: int) -> Optional[int]:
+        matches = self._near(conn, fingerprint, chars)
+        return matches[0][1] if matches else None
+
+    def find_similar(self, fingerprint: int, chars: int, options: str) -> Optional[Dict[str, Any]]:
+        """
+        Stored result of the closest near-duplicate document, if any.
+        """
+        with self._lock:
+            conn = self._connect()
+            for _, doc in self._near(conn, fingerprint, chars):
+                result = self._result(conn, doc, options)
+                if result is not None:
+                    return result
+            return None
+
+    def add(self, urls: Iterable[str], fingerprint: int, chars: int, options: str,
+            result: Dict[str, Any]) -> None:
+        """
+        Record a generated `result`. Joins an existing document when one of
+        `urls` or the fingerprint already matches, so every variant points
+        at the same row.
+        """
+        urls = list(dict.fromkeys(u for u in urls if u))
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            doc = None
+            for url in urls:
+                row = conn.execute("SELECT doc FROM urls WHERE url=?", (url,)).fetchone()
+                if row:
+                    doc = row[0]
+                    break
+            if doc is not None:
+                row = conn.execute("SELECT fingerprint FROM documents WHERE id=?", (doc,)).fetchone()
+                if row is None or hamming(fingerprint, row[0] & ((1 << 64) - 1)) > self.max_distance:
+                    # the page at this URL has changed: its old results no longer apply
+                    conn.execute("DELETE FROM results WHERE doc=?", (doc,))
+                    conn.execute("DELETE FROM bands WHERE doc=?", (doc,))
+                    conn.execute("DELETE FROM urls WHERE doc=?", (doc,))
+                    conn.execute("DELETE FROM documents WHERE id=?", (doc,))
+                    doc = None
+            if doc is None:
+                doc = self._nearest(conn, fingerprint, chars)
+            if doc is None:
+                doc = conn.execute(
+                    "INSERT INTO documents (canonical, fingerprint, chars, created) VALUES (?, ?, ?, ?)",
+                    (urls[0] if urls else "", _signed(fingerprint), chars, now),
+                ).lastrowid
+                conn.executemany("INSERT INTO bands (band, bucket, doc) VALUES (?, ?, ?)",
+                                 [(band, bucket, doc) for band, bucket in enumerate(_bands(fingerprint))])
+            conn.executemany("INSERT OR REPLACE INTO urls (url, doc) VALUES (?, ?)", [(u, doc) for u in urls])
+            conn.execute("INSERT OR REPLACE INTO results (doc, options, result, created) VALUES (?, ?, ?, ?)",
+                         (doc, options, json.dumps(result), now))
+            conn.commit()
+        tracing.count("dedup_stored")
+
+
+class _NullStore(DedupStore):
+    """
+    Drop-in used when NOTES_DEDUP_DISABLE is set: never matches, stores nothing.
+    """
+
+    def find_by_url(self, url, options, max_age=DEDUP_TTL, fingerprint=None, chars=0):
+        return None
+
+    def find_similar(self, fingerprint, chars, options):
+        return None
+
+    def add(self, urls, fingerprint, chars, options, result):
+        pass
+
+
+# Process-wide instance used by jobs.py and notes.py
+STORE = _NullStore() if DEDUP_DISABLED else DedupStore()
@@ -0,0 +1,131 @@
+# distractors.py
+"""
+MCQ distractor engine for the fallback generator.
+
+Built once per DocumentIndex. Every keyword candidate is put in a bucket by
+a cheap part-of-speech proxy (proper noun / suffix class) and a length band,
+and each bucket keeps its members best-first. Answering "3 plausible
+distractors for X" is then a dict lookup plus a rescoring of a fixed-size
+slice of X's bucket by paragraph co-occurrence: options look like the answer
+(same shape, similar length) and come from the same part of the document,
+without scanning the text per question.
+"""
+import re
+from collections import defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from docindex import DocumentIndex
+
+# how many bucket members are rescored per question
+_SHORTLIST = 24
+
+_SUFFIX_CLASSES = (
+    ("noun", ("tion", "sion", "ment", "ness", "ity", "ance", "ence", "ism", "ist", "ship", "ure", "age")),
+    ("gerund", ("ing",)),
+    ("past", ("ed",)),
+    ("adverb", ("ly",)),
+    ("adjective", ("ous", "ful", "ive", "able", "ible", "al", "ic", "less", "ary")),
+    ("plural", ("s",)),
+)
+
+# capitalised words that don't start a sentence or line
+_CAPITALIZED = re.compile(r"(?<![.!?]\s)(?<!\n)(?<!^)\b([A-Z]\w{4,})")
+
+
+def word_class(term: str, proper: bool) -> str:
+    if proper:
+        return "proper"
+    for name, suffixes in _SUFFIX_CLASSES:
+        if term.endswith(suffixes):
+            return name
+    return "other"
+
+
+class DistractorIndex:
+    """
+    Bucketed keyword index: (class, length band) -> term ids, best first.
+    Use DistractorIndex.for_index(index) to reuse one per document.
+    """
+
+    __slots__ = ("index", "buckets", "by_class", "bucket_of", "paragraphs", "proper")
+
+    def __init__(self, index: DocumentIndex):
+        self.index = index
+        vocab = index.vocab
+        # capitalised mid-sentence more often than not -> treat as a proper noun
+        caps: Dict[str, int] = defaultdict(int)
+        for word in _CAPITALIZED.findall(index.text):
+            caps[word.lower()] += 1
+        keywords = index.keywords.tolist()
+        self.proper = {t for t in keywords if caps.get(vocab[t], 0) * 2 > index.term_freq[t]}
+        # paragraphs each keyword occurs in, for co-occurrence scoring
+        mask = index.is_keyword[index.word_ids]
+        terms = index.word_ids[mask].astype(np.int64)
+        paras = index.sent_para[index.word_sents[mask]].astype(np.int64)
+        width = int(paras.max()) + 1 if paras.size else 1
+        pairs = np.unique(terms * width + paras)
+        self.paragraphs: Dict[int, set] = defaultdict(set)
+        for term, para in zip((pairs // width).tolist(), (pairs % width).tolist()):
+            self.paragraphs[term].add(para)
+        self.buckets: Dict[Tuple[str, int], List[int]] = defaultdict(list)
+        self.by_class: Dict[str, List[int]] = defaultdict(list)
+        self.bucket_of: Dict[int, Tuple[str, int]] = {}
+        # keywords are already ranked best-first, so buckets stay ranked
+        for t in keywords:
+            cls = word_class(vocab[t], t in self.proper)
+            key = (cls, self._band(int(index.term_len[t])))
+            self.buckets[key].append(t)
+            self.by_class[cls].append(t)
+            self.bucket_of[t] = key
+
+    @classmethod
+    def for_index(cls, index: DocumentIndex) -> "DistractorIndex":
+        if index._distractors is None:
+            index._distractors = cls(index)
+        return index._distractors
+
+    @staticmethod
+    def _band(length: int) -> int:
+        return min(length // 3, 4)
+
+    def _score(self, answer: int, candidate: int) -> float:
+        a, c = self.paragraphs.get(answer, ()), self.paragraphs.get(candidate, ())
+        shared = len(a & c) if a and c else 0
+        # Jaccard overlap; ties keep bucket (keyword rank) order since the sort is stable
+        return shared / (len(a) + len(c) - shared or 1)
+
+    def pick(self, answer: int, k: int = 3, exclude: Sequence[int] = ()) -> List[int]:
+        """
+        Up to `k` distractor term ids for the answer term: from its own bucket
+        first, widening to the same word class and then to any keyword.
+        """
+        banned = set(exclude)
+        banned.add(answer)
+        answer_word = self.index.vocab[answer]
+        picked: List[int] = []
+        key = self.bucket_of.get(answer)
+        pools = []
+        if key is not None:
+            pools.append(self.buckets[key])
+            pools.append(self.by_class[key[0]])
+        pools.append(self.index.keywords[:_SHORTLIST * 4].tolist())
+        for pool in pools:
+            shortlist = []
+            for t in pool:
+                if t in banned or t in picked:
+                    continue
+                word = self.index.vocab[t]
+                # skip inflections of the answer ("network" vs "networks")
+                if word.startswith(answer_word) or answer_word.startswith(word):
+                    continue
+                shortlist.append(t)
+                if len(shortlist) >= _SHORTLIST:
+                    break
+            shortlist.sort(key=lambda t: -self._score(answer, t))
+            for t in shortlist:
+                picked.append(t)
+                if len(picked) >= k:
+                    return picked
+        return picked
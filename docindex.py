@@ -0,0 +1,175 @@
+# docindex.py
+"""
+One-pass text index shared by the fallback generators.
+
+Splitting a document into sentences, paragraphs and words used to happen
+separately in every fallback (and again per MCQ while picking distractors).
+DocumentIndex does it once and keeps the result in compact numpy arrays:
+
+- sentence spans (start/end offsets into the text) and the paragraph each
+  sentence belongs to
+- every word occurrence as a term id plus the sentence it occurs in
+- per-term counts, document frequencies and a keyword ranking
+
+Use DocumentIndex.for_text(text); it is memoised, so the notes, FAQ and MCQ
+fallbacks for one document all share a single index.
+"""
+import re
+import itertools
+from functools import lru_cache
+from typing import Iterable, Iterator, List
+
+import numpy as np
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from further had
+has have having he her here hers herself him himself his how i if in into is it its itself just
+me more most my myself no nor not now of off on once only or other our ours ourselves out over
+own same she should so some such than that the their theirs them themselves then there these
+they this those through to too under until up very was we were what when where which while who
+whom why will with would you your yours yourself yourselves one two may might must shall also
+however therefore thus etc eg ie many much use used using like well new
+""".split())
+
+# sentence ends, plus line breaks so paragraphs / list items never merge
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\s*\n\s*")
+_BLANK_LINE = re.compile(r"\n\s*\n")
+_WORD = re.compile(r"\w{3,}")
+# marker word joining sentences for the single word-tokenizing pass
+_BREAK = "zzsentbreakzz"
+
+# sentences shorter than this are headings / debris, not content
+MIN_SENTENCE_CHARS = 20
+# a line break ends a segment too; without closing punctuation one this
+# short is a heading or a nav/caption line rather than a sentence
+HEADING_MAX_WORDS = 8
+_SENTENCE_END = re.compile(r"[.!?:;][\"'\u201d\u2019)\]]*$")
+
+
+def _is_sentence(seg: str, min_chars: int) -> bool:
+    if len(seg) <= min_chars:
+        return False
+    return bool(_SENTENCE_END.search(seg)) or len(seg.split()) > HEADING_MAX_WORDS
+
+
+def iter_sentences(blocks: Iterable[str], min_chars: int = MIN_SENTENCE_CHARS) -> Iterator[str]:
+    """
+    Sentences of a stream of text blocks (e.g. extraction.stream_blocks),
+    split the same way as DocumentIndex but one block at a time, so the
+    whole text never has to exist at once.
+    """
+    for block in blocks:
+        for seg in _SENTENCE_SPLIT.split(block):
+            seg = seg.strip()
+            if _is_sentence(seg, min_chars):
+                yield seg
+
+
+class DocumentIndex:
+    """
+    Sentence/paragraph/word index over one text. Arrays are int32 unless
+    noted; term ids index into `vocab`.
+    """
+
+    __slots__ = (
+        "text",
+        "sent_starts", "sent_ends",   # sentence i is text[sent_starts[i]:sent_ends[i]]
+        "sent_para",                  # paragraph number of each sentence
+        "word_ids", "word_sents",     # one entry per word occurrence, in document order
+        "word_offsets",               # words of sentence i are word_ids[word_offsets[i]:word_offsets[i+1]]
+        "vocab",                      # list of lower-cased terms
+        "term_freq", "doc_freq",      # per term: occurrences / sentences containing it
+        "is_stop",                    # bool per term
+        "term_len",                   # characters per term
+        "is_keyword",                 # bool per term: content word usable as a keyword
+        "keywords",                   # keyword term ids, best first
+        "_matrix",                    # lazily built SentenceTermMatrix (extractive.py)
+        "_distractors",               # lazily built DistractorIndex (distractors.py)
+    )
+
+    def __init__(self, text: str, min_chars: int = MIN_SENTENCE_CHARS):
+        self.text = text
+        self._matrix = None
+        self._distractors = None
+        self._index_sentences(min_chars)
+        self._index_words()
+        self._rank_keywords()
+
+    @classmethod
+    def for_text(cls, text: str) -> "DocumentIndex":
+        return _cached_index(text)
+
+    def _index_sentences(self, min_chars: int) -> None:
+        text = self.text
+        starts, ends = [], []
+        pos = 0
+        for m in itertools.chain(_SENTENCE_SPLIT.finditer(text), [None]):
+            end = m.start() if m else len(text)
+            seg = text[pos:end]
+            stripped = seg.strip()
+            if _is_sentence(stripped, min_chars):
+                lead = len(seg) - len(seg.lstrip())
+                starts.append(pos + lead)
+                ends.append(pos + lead + len(stripped))
+            if m:
+                pos = m.end()
+        self.sent_starts = np.asarray(starts, dtype=np.int32)
+        self.sent_ends = np.asarray(ends, dtype=np.int32)
+        # paragraphs are blank-line separated blocks, or lines if the text has no blank lines
+        breaks = _BLANK_LINE if _BLANK_LINE.search(text) else re.compile(r"\n")
+        para_ends = np.asarray([m.end() for m in breaks.finditer(text)], dtype=np.int64)
+        self.sent_para = np.searchsorted(para_ends, self.sent_starts, side="right").astype(np.int32)
+
+    def _index_words(self) -> None:
+        # one regex pass: sentences joined by a marker word, whose running
+        # count then gives the sentence of every word
+        joined = (" " + _BREAK + " ").join(self.sentences())
+        words = _WORD.findall(joined.lower())
+        # setdefault with a counter hands out a fresh id per new word and
+        # the stored id for repeats; ids are sparse, compacted below
+        seen = {_BREAK: -1}
+        raw = np.fromiter(map(seen.setdefault, words, itertools.count()), dtype=np.int64, count=len(words))
+        is_break = raw == -1
+        sents = np.cumsum(is_break)[~is_break]
+        uniq, ids = np.unique(raw[~is_break], return_inverse=True)
+        self.vocab = [words[i] for i in uniq.tolist()]
+        self.word_ids = ids.astype(np.int32)
+        self.word_sents = sents.astype(np.int32)
+        n_terms = len(self.vocab)
+        self.word_offsets = np.searchsorted(self.word_sents, np.arange(self.n_sentences + 1)).astype(np.int32)
+        self.term_freq = np.bincount(self.word_ids, minlength=n_terms).astype(np.int32)
+        pairs = np.unique(self.word_sents.astype(np.int64) * max(n_terms, 1) + self.word_ids)
+        self.doc_freq = np.bincount(pairs % max(n_terms, 1), minlength=n_terms).astype(np.int32)
+        self.is_stop = np.fromiter((t in STOPWORDS for t in self.vocab), dtype=bool, count=n_terms)
+
+    def _rank_keywords(self) -> None:
+        # content words (>4 chars, not numbers/stopwords) by tf * idf
+        n = max(self.n_sentences, 1)
+        self.term_len = np.fromiter((len(t) for t in self.vocab), dtype=np.int32, count=len(self.vocab))
+        is_num = np.fromiter((t.isdigit() for t in self.vocab), dtype=bool, count=len(self.vocab))
+        self.is_keyword = (self.term_len > 4) & ~is_num & ~self.is_stop
+        score = self.term_freq * (np.log((1.0 + n) / (1.0 + self.doc_freq)) + 1.0)
+        candidates = np.flatnonzero(self.is_keyword)
+        self.keywords = candidates[np.argsort(-score[candidates], kind="stable")].astype(np.int32)
+
+    @property
+    def n_sentences(self) -> int:
+        return len(self.sent_starts)
+
+    def sentence(self, i: int) -> str:
+        return self.text[self.sent_starts[i]:self.sent_ends[i]]
+
+    def sentences(self) -> List[str]:
+        return [self.text[a:b] for a, b in zip(self.sent_starts.tolist(), self.sent_ends.tolist())]
+
+    def sentence_terms(self, i: int) -> np.ndarray:
+        """
+        Term ids of the words in sentence i, in order.
+        """
+        return self.word_ids[self.word_offsets[i]:self.word_offsets[i + 1]]
+
+
+@lru_cache(maxsize=8)
+def _cached_index(text: str) -> DocumentIndex:
+    return DocumentIndex(text)
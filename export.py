@@ -0,0 +1,349 @@
+# export.py
+"""
+Study packs in every format we hand out: PDF, Markdown, HTML, JSON and Anki
+(CSV for import, .apkg with genanki installed).
+
+Everything goes through one typed model, StudyPack, built from the
+sections the generators produce (StudyPack.from_sections). Renderers are
+pluggable like the extraction backends: RENDERERS maps a format name to a
+Renderer whose write(packs, out) streams one or more packs into a binary
+file object, so a response body or a zip entry can be written without
+holding the whole file in memory.
+
+    data = render(pack, "md")                          # bytes
+    write(packs, "html", out)                          # many packs, one file
+    export_zip(packs, ["pdf", "md"], "packs.zip")      # bulk, process pool
+
+export_zip renders every pack x format in a process pool (rendering is
+CPU-bound, mostly reportlab) and writes the files into the zip as they
+finish. `python -m notes export` does this for a batch JSONL file.
+"""
+import io
+import os
+import re
+import csv
+import json
+from html import escape
+from dataclasses import dataclass, field, asdict
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Sequence, Union
+
+import tracing
+
+EXPORT_WORKERS = int(os.environ.get("NOTES_EXPORT_WORKERS", os.cpu_count() or 1))
+
+
+class ExportError(RuntimeError):
+    """
+    Unknown format, or a format whose optional dependency isn't installed.
+    """
+
+
+################################################################################
+# Model
+################################################################################
+@dataclass
+class FAQ:
+    q: str
+    a: str
+
+
+@dataclass
+class MCQ:
+    question: str
+    options: List[str]
+    answer: str
+
+
+@dataclass
+class StudyPack:
+    title: str = "Document"
+    url: str = ""
+    summary: str = ""
+    bullets: List[str] = field(default_factory=list)
+    faqs: List[FAQ] = field(default_factory=list)
+    mcqs: List[MCQ] = field(default_factory=list)
+
+    @classmethod
+    def from_sections(cls, sections: Dict[str, Any], title: str = "", url: str = "") -> "StudyPack":
+        """
+        Build from generator output: {"notes": {summary, bullets}, "faqs":
+        [{q, a}], "mcqs": [{question, options, answer}]}; a batch JSONL
+        record (which also carries "url") works as well.
+        """
+        notes = sections.get("notes") or {}
+        return cls(
+            title=title or sections.get("title") or url or sections.get("url") or "Document",
+            url=url or sections.get("url", ""),
+            summary=str(notes.get("summary", "")),
+            bullets=[str(b) for b in notes.get("bullets", [])],
+            faqs=[FAQ(str(f.get("q", "")), str(f.get("a", ""))) for f in sections.get("faqs") or []],
+            mcqs=[MCQ(str(m.get("question", "")), [str(o) for o in m.get("options", [])], str(m.get("answer", "")))
+                  for m in sections.get("mcqs") or []],
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StudyPack":
+        return cls(
+            title=data.get("title", "Document"), url=data.get("url", ""), summary=data.get("summary", ""),
+            bullets=list(data.get("bullets", [])),
+            faqs=[FAQ(**f) for f in data.get("faqs", [])],
+            mcqs=[MCQ(**m) for m in data.get("mcqs", [])],
+        )
+
+
+################################################################################
+# Renderers
+################################################################################
+@dataclass(frozen=True)
+class Renderer:
+    name: str
+    extension: str
+    mime: str
+    # write(packs, out): render every pack into the binary file object `out`
+    write: Callable[[Iterable[StudyPack], BinaryIO], None]
+
+
+RENDERERS: Dict[str, Renderer] = {}
+# alternative names accepted by get_renderer
+_ALIASES = {"markdown": "md", "htm": "html", "anki": "csv", "anki_csv": "csv"}
+
+
+def register_renderer(renderer: Renderer) -> None:
+    """
+    Add or replace a renderer.
+    """
+    RENDERERS[renderer.name] = renderer
+
+
+def get_renderer(fmt: str) -> Renderer:
+    name = _ALIASES.get(fmt.lower().lstrip("."), fmt.lower().lstrip("."))
+    if name not in RENDERERS:
+        raise ExportError(f"unknown export format {fmt!r} (have: {', '.join(sorted(RENDERERS))})")
+    return RENDERERS[name]
+
+
+def _text_renderer(chunks: Callable[[Iterable[StudyPack]], Iterator[str]]):
+    # text formats produce str pieces; encode and write them as they come
+    def write_text(packs: Iterable[StudyPack], out: BinaryIO) -> None:
+        for chunk in chunks(packs):
+            out.write(chunk.encode("utf-8"))
+    return write_text
+
+
+def _letter(i: int) -> str:
+    return chr(65 + i)
+
+
+def _markdown(packs: Iterable[StudyPack]) -> Iterator[str]:
+    for n, pack in enumerate(packs):
+        if n:
+            yield "\n---\n\n"
+        yield f"# {pack.title}\n\n"
+        if pack.url:
+            yield f"<{pack.url}>\n\n"
+        yield f"## Summary\n\n{pack.summary}\n\n## Key Notes\n\n"
+        yield "".join(f"- {b}\n" for b in pack.bullets) + "\n"
+        yield "## FAQs\n\n"
+        for i, faq in enumerate(pack.faqs, 1):
+            yield f"**Q{i}. {faq.q}**\n\nA: {faq.a}\n\n"
+        yield "## MCQs\n\n"
+        for i, mcq in enumerate(pack.mcqs, 1):
+            options = "".join(f"- {_letter(j)}. {o}\n" for j, o in enumerate(mcq.options))
+            yield f"**Q{i}. {mcq.question}**\n\n{options}\n**Answer:** {mcq.answer}\n\n"
+
+
+_HTML_HEAD = (
+    "<!DOCTYPE html>\n<html lang=\"en\"><head><meta charset=\"utf-8\"><title>{title}</title>\n"
+    "<style>body{{font-family:system-ui,sans-serif;max-width:46rem;margin:2rem auto;padding:0 1rem;"
+    "line-height:1.5}}section{{page-break-after:always}}.answer{{color:#2a6f2a}}</style></head><body>\n"
+)
+
+
+def _html(packs: Iterable[StudyPack]) -> Iterator[str]:
+    head_written = False
+    for pack in packs:
+        if not head_written:
+            yield _HTML_HEAD.format(title=escape(pack.title))
+            head_written = True
+        yield f"<section>\n<h1>{escape(pack.title)}</h1>\n"
+        if pack.url:
+            yield f"<p><a href=\"{escape(pack.url)}\">{escape(pack.url)}</a></p>\n"
+        yield f"<h2>Summary</h2>\n<p>{escape(pack.summary)}</p>\n<h2>Key Notes</h2>\n<ul>\n"
+        yield "".join(f"<li>{escape(b)}</li>\n" for b in pack.bullets) + "</ul>\n<h2>FAQs</h2>\n"
+        for i, faq in enumerate(pack.faqs, 1):
+            yield f"<h3>Q{i}. {escape(faq.q)}</h3>\n<p>{escape(faq.a)}</p>\n"
+        yield "<h2>MCQs</h2>\n"
+        for i, mcq in enumerate(pack.mcqs, 1):
+            options = "".join(f"<li>{escape(o)}</li>" for o in mcq.options)
+            yield (f"<h3>Q{i}. {escape(mcq.question)}</h3>\n<ol type=\"A\">{options}</ol>\n"
+                   f"<p class=\"answer\"><strong>Answer:</strong> {escape(mcq.answer)}</p>\n")
+        yield "</section>\n"
+    if not head_written:
+        yield _HTML_HEAD.format(title="Study packs")
+    yield "</body></html>\n"
+
+
+def _json(packs: Iterable[StudyPack]) -> Iterator[str]:
+    # a JSON array, written one pack at a time
+    yield "["
+    for n, pack in enumerate(packs):
+        yield ("," if n else "") + "\n" + json.dumps(pack.to_dict(), ensure_ascii=False)
+    yield "\n]\n"
+
+
+def _cards(pack: StudyPack) -> Iterator[List[str]]:
+    # (front, back, tags) per flashcard: every FAQ and MCQ, plus the summary
+    tag = re.sub(r"\W+", "_", pack.title).strip("_").lower()[:40] or "notes"
+    if pack.summary:
+        yield [f"Summarize: {escape(pack.title)}", escape(pack.summary), tag]
+    for faq in pack.faqs:
+        yield [escape(faq.q), escape(faq.a), tag]
+    for mcq in pack.mcqs:
+        options = "<br>".join(f"{_letter(j)}. {escape(o)}" for j, o in enumerate(mcq.options))
+        yield [f"{escape(mcq.question)}<br><br>{options}", escape(mcq.answer), tag]
+
+
+def _anki_csv(packs: Iterable[StudyPack]) -> Iterator[str]:
+    # Anki's text import: front;back;tags with HTML enabled
+    yield "#separator:semicolon\n#html:true\n#tags column:3\n"
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";", lineterminator="\n")
+    for pack in packs:
+        writer.writerows(_cards(pack))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _pdf(packs: Iterable[StudyPack], out: BinaryIO) -> None:
+    from pdf_utils import write_pdf
+    write_pdf(out, ({"title": p.title, "summary": p.summary, "notes": p.bullets,
+                     "faqs": [asdict(f) for f in p.faqs], "mcqs": [asdict(m) for m in p.mcqs]} for p in packs))
+
+
+def _apkg(packs: Iterable[StudyPack], out: BinaryIO) -> None:
+    try:
+        import genanki
+    except ImportError:
+        raise ExportError("the apkg format needs the genanki package; use csv for Anki's text import")
+    import tempfile
+    model = genanki.Model(1607392319, "URL Notes", fields=[{"name": "Front"}, {"name": "Back"}],
+                          templates=[{"name": "Card", "qfmt": "{{Front}}",
+                                      "afmt": "{{FrontSide}}<hr id=\"answer\">{{Back}}"}])
+    deck = genanki.Deck(2059400110, "URL Notes")
+    for pack in packs:
+        for front, back, tag in _cards(pack):
+            deck.add_note(genanki.Note(model=model, fields=[front, back], tags=[tag]))
+    # genanki only writes to a path
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "deck.apkg")
+        genanki.Package(deck).write_to_file(path)
+        with open(path, "rb") as fh:
+            while True:
+                block = fh.read(1 << 16)
+                if not block:
+                    break
+                out.write(block)
+
+
+register_renderer(Renderer("pdf", "pdf", "application/pdf", _pdf))
+register_renderer(Renderer("md", "md", "text/markdown", _text_renderer(_markdown)))
+register_renderer(Renderer("html", "html", "text/html", _text_renderer(_html)))
+register_renderer(Renderer("json", "json", "application/json", _text_renderer(_json)))
+register_renderer(Renderer("csv", "csv", "text/csv", _text_renderer(_anki_csv)))
+register_renderer(Renderer("apkg", "apkg", "application/octet-stream", _apkg))
+
+
+################################################################################
+# Export
+################################################################################
+def write(packs: Union[StudyPack, Iterable[StudyPack]], fmt: str, out: BinaryIO) -> None:
+    """
+    Render `packs` (one or many) as `fmt` into the binary file object `out`.
+    """
+    renderer = get_renderer(fmt)
+    if isinstance(packs, StudyPack):
+        packs = [packs]
+    with tracing.span("export", format=renderer.name) as sp:
+        counted = []
+
+        def counting():
+            for pack in packs:
+                counted.append(1)
+                yield pack
+        renderer.write(counting(), out)
+        sp.set(documents=len(counted))
+
+
+def render(packs: Union[StudyPack, Iterable[StudyPack]], fmt: str) -> bytes:
+    """
+    `packs` rendered as `fmt`, in memory.
+    """
+    buffer = io.BytesIO()
+    write(packs, fmt, buffer)
+    return buffer.getvalue()
+
+
+def filename(pack: StudyPack, fmt: str) -> str:
+    """
+    File name for `pack` in `fmt`, derived from its title.
+    """
+    slug = re.sub(r"[^\w-]+", "-", pack.title.lower()).strip("-")[:60] or "study-pack"
+    return f"{slug}.{get_renderer(fmt).extension}"
+
+
+def _render_one(pack: StudyPack, fmt: str) -> bytes:
+    # process pool entry point: must be importable at module level
+    return render(pack, fmt)
+
+
+def export_zip(packs: Sequence[StudyPack], formats: Sequence[str], out: Union[str, BinaryIO],
+               workers: int = EXPORT_WORKERS) -> int:
+    """
+    Write every pack in every format into the zip `out` (path or binary
+    file object); returns the number of files. Rendering runs on `workers`
+    processes (1: in this process); files are added as they finish.
+    """
+    import zipfile
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    for fmt in formats:
+        get_renderer(fmt)
+    names: Dict[int, str] = {}
+    used = set()
+    for i, pack in enumerate(packs):
+        # unique stem per pack, shared by its formats
+        stem = os.path.splitext(filename(pack, "json"))[0]
+        unique, n = stem, 2
+        while unique in used:
+            unique, n = f"{stem}-{n}", n + 1
+        used.add(unique)
+        names[i] = unique
+    tasks = [(i, fmt) for i in range(len(packs)) for fmt in formats]
+    with tracing.span("export.zip", documents=len(packs), formats=",".join(formats), workers=workers), \
+            zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        def add(i: int, fmt: str, data: bytes) -> None:
+            zf.writestr(f"{names[i]}.{get_renderer(fmt).extension}", data)
+
+        if workers <= 1 or len(tasks) <= 1:
+            for i, fmt in tasks:
+                add(i, fmt, _render_one(packs[i], fmt))
+        else:
+            # a bounded window of renders in flight: finished files are written
+            # and dropped, so memory doesn't grow with the size of the zip
+            pending = iter(tasks)
+            futures = {}
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                while True:
+                    for i, fmt in pending:
+                        futures[pool.submit(_render_one, packs[i], fmt)] = (i, fmt)
+                        if len(futures) >= 2 * workers:
+                            break
+                    if not futures:
+                        break
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        add(*futures.pop(future), future.result())
+    return len(tasks)
@@ -0,0 +1,494 @@
+# extraction.py
+"""
+One extraction engine for every caller (utils.py, extractor.py, the batch
+CLI and jobs).
+
+extract(page) turns a downloaded page (fetch.FetchResult) into an
+ExtractionResult: text, title and metadata in one structure. The work is
+done by pluggable backends, tried in order until one returns enough text:
+
+- "trafilatura": best boilerplate removal, slowest
+- "readability": readability-style heuristic on an lxml tree; scores the
+  containers holding the most paragraph text and least link text
+- "lxml": fast path; strips boilerplate tags and keeps block-level text
+- "plain": text/plain bodies, returned as they are
+- "text": all text outside boilerplate tags; last resort for HTML
+
+Plain text skips HTML parsing, and HTML pages over NOTES_EXTRACT_LARGE_KB
+go to the streaming parser below instead. NOTES_EXTRACT_BACKENDS
+(comma-separated) overrides the order for HTML. Heavy dependencies
+(trafilatura, lxml) are imported on first use, not at import time.
+
+extract_url(url) adds the shared fetch layer and its revalidating cache.
+The body is streamed: pages up to NOTES_EXTRACT_LARGE_KB are read whole
+and go through the backends above; anything bigger is parsed while it
+downloads by lxml's incremental parser (BlockParser), which drops each
+element once its text is taken, so memory holds the extracted text and not
+the page. stream_blocks(url) yields the blocks themselves.
+"""
+import os
+import re
+from dataclasses import dataclass, field, asdict
+from html import unescape
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import tracing
+from fetch import FetchResult, cached_extract, open_stream
+
+# less text than this means the backend failed on the page
+MIN_TEXT_CHARS = 200
+LARGE_PAGE_BYTES = int(os.environ.get("NOTES_EXTRACT_LARGE_KB", 1024)) * 1024
+EXTRACT_TIMEOUT = float(os.environ.get("NOTES_EXTRACT_TIMEOUT", 20))
+# longest document text accepted as input (api.py); extraction itself
+# only cuts text when a caller passes max_chars
+MAX_TEXT_CHARS = int(os.environ.get("NOTES_EXTRACT_MAX_CHARS", 500_000))
+HTML_BACKENDS = [b for b in os.environ.get("NOTES_EXTRACT_BACKENDS", "trafilatura,readability,lxml").split(",") if b]
+
+_BOILERPLATE_TAGS = ("script", "style", "noscript", "iframe", "template", "svg",
+                     "header", "footer", "nav", "aside", "form", "button")
+_BLOCK_TAGS = ("p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "pre", "blockquote", "dt", "dd", "td", "figcaption")
+# elements that start/end a line of text: blocks plus layout containers
+_BREAK_TAGS = frozenset(_BLOCK_TAGS) | {"div", "section", "article", "main", "header", "footer", "aside",
+                                        "nav", "figure", "form", "br", "hr", "tr", "ul", "ol", "dl",
+                                        "table", "body"}
+_TITLE = re.compile(r"<title[^>]*>(.*?)</title>", re.I | re.S)
+_WHITESPACE = re.compile(r"[ \t\r\f\v]+")
+
+
+@dataclass
+class ExtractionResult:
+    text: str
+    title: str = ""
+    url: str = ""
+    backend: str = ""
+    # author, date, sitename, description, language, canonical_url, content_type, truncated ...
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ExtractionResult":
+        return cls(**data)
+
+
+# backend(html, url) -> (text, title, metadata) or None
+Backend = Callable[[str, str], Optional[Tuple[str, str, Dict[str, Any]]]]
+BACKENDS: Dict[str, Backend] = {}
+
+
+def register_backend(name: str, backend: Backend) -> None:
+    """
+    Add or replace a backend; list it in NOTES_EXTRACT_BACKENDS to use it.
+    """
+    BACKENDS[name] = backend
+
+
+def _clean(text: str) -> str:
+    lines = (_WHITESPACE.sub(" ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _title_from_html(html: str) -> str:
+    m = _TITLE.search(html[:65536])
+    return _clean(unescape(m.group(1))) if m else ""
+
+
+################################################################################
+# Backends
+################################################################################
+def _trafilatura(html: str, url: str):
+    import trafilatura
+    text = trafilatura.extract(html, url=url or None, include_comments=False, include_tables=False,
+                               include_formatting=False)
+    if not text:
+        return None
+    # trafilatura's own metadata pass costs more than the extraction; <head> has what we need
+    title, meta = _head_meta(html)
+    return text, title, meta
+
+
+def _parse_tree(html: str):
+    import lxml.html
+    from lxml import etree
+    tree = lxml.html.document_fromstring(html)
+    etree.strip_elements(tree, etree.Comment, *_BOILERPLATE_TAGS, with_tail=False)
+    return tree
+
+
+def _tree_meta(tree) -> Tuple[str, Dict[str, Any]]:
+    # <title> / og:title plus the usual <meta> fields and <link rel=canonical>
+    meta = {}
+    for el in tree.iter("meta"):
+        name = (el.get("name") or el.get("property") or "").lower()
+        content = (el.get("content") or "").strip()
+        if not content:
+            continue
+        if name in ("description", "og:description") and "description" not in meta:
+            meta["description"] = content
+        elif name in ("author", "article:author") and "author" not in meta:
+            meta["author"] = content
+        elif name in ("article:published_time", "date") and "date" not in meta:
+            meta["date"] = content
+        elif name == "og:site_name":
+            meta["sitename"] = content
+        elif name == "og:title":
+            meta["og_title"] = content
+    for el in tree.iter("link"):
+        if "canonical" in (el.get("rel") or "").lower().split() and el.get("href"):
+            meta["canonical_url"] = el.get("href").strip()
+            break
+    title_el = tree.find(".//title")
+    title = _clean(title_el.text_content()) if title_el is not None else ""
+    lang = tree.get("lang")
+    if lang:
+        meta["language"] = lang
+    return title or meta.pop("og_title", ""), {k: v for k, v in meta.items() if k != "og_title"}
+
+
+def _head_meta(html: str) -> Tuple[str, Dict[str, Any]]:
+    import lxml.html
+    end = html.find("</head>", 0, 262144)
+    head = html[:end + 7] if end != -1 else html[:65536]
+    try:
+        return _tree_meta(lxml.html.document_fromstring(head))
+    except Exception:
+        return _title_from_html(html), {}
+
+
+def _block_text(root) -> str:
+    # one line per block, each text node exactly once: a parent's own text
+    # (before, between and after its child blocks) gets lines of its own,
+    # so <div>-only layouts and <li>text<ul>...</ul></li> keep everything
+    from lxml import etree
+    lines, parts = [], []
+
+    def flush():
+        if parts:
+            lines.append("".join(parts))
+            parts.clear()
+
+    for event, el in etree.iterwalk(root, events=("start", "end")):
+        is_element = isinstance(el.tag, str)
+        if event == "start":
+            if is_element and el.tag in _BREAK_TAGS:
+                flush()
+            if is_element and el.text:
+                parts.append(el.text)
+        else:
+            if is_element and el.tag in _BREAK_TAGS:
+                flush()
+            if el.tail and el is not root:
+                parts.append(el.tail)
+    flush()
+    return _clean("\n".join(line.replace("\n", " ") for line in lines))
+
+
+def _lxml(html: str, url: str):
+    tree = _parse_tree(html)
+    title, meta = _tree_meta(tree)
+    body = tree.find("body")
+    root = body if body is not None else tree
+    text = _block_text(root) or _clean(root.text_content())
+    return text, title, meta
+
+
+_POSITIVE = re.compile(r"article|body|content|entry|main|page|post|text|story", re.I)
+_NEGATIVE = re.compile(r"comment|footer|footnote|masthead|menu|meta|nav|promo|related|share|"
+                       r"sidebar|sponsor|social|subscribe|widget|banner|\bad", re.I)
+
+
+def _class_weight(el) -> float:
+    hint = f"{el.get('class', '')} {el.get('id', '')}"
+    weight = 0.0
+    if _NEGATIVE.search(hint):
+        weight -= 25
+    if _POSITIVE.search(hint):
+        weight += 25
+    return weight
+
+
+def _readability(html: str, url: str):
+    tree = _parse_tree(html)
+    title, meta = _tree_meta(tree)
+    # every paragraph votes for its parent (and half for its grandparent)
+    scores: Dict[Any, float] = {}
+    for p in tree.iter("p", "pre", "td"):
+        text = p.text_content().strip()
+        if len(text) < 25:
+            continue
+        score = 1 + text.count(",") + min(len(text) // 100, 3)
+        parent = p.getparent()
+        for node, share in ((parent, 1.0), (parent.getparent() if parent is not None else None, 0.5)):
+            if node is None:
+                continue
+            if node not in scores:
+                scores[node] = _class_weight(node) + (5 if node.tag in ("article", "main") else 0)
+            scores[node] += score * share
+    if not scores:
+        return None
+    # discount containers that are mostly links
+    best, best_score = None, float("-inf")
+    for node, score in scores.items():
+        text_len = len(node.text_content()) or 1
+        link_len = sum(len(a.text_content()) for a in node.iter("a"))
+        score *= 1.0 - link_len / text_len
+        if score > best_score:
+            best, best_score = node, score
+    text = _block_text(best) or _clean(best.text_content())
+    return text, title, meta
+
+
+def _plain(text: str, url: str):
+    return _clean(text), "", {}
+
+
+def _document_text(html: str, url: str):
+    # last resort: every bit of text outside boilerplate tags, no structure
+    tree = _parse_tree(html)
+    title, meta = _tree_meta(tree)
+    body = tree.find("body")
+    return _clean((body if body is not None else tree).text_content()), title, meta
+
+
+register_backend("trafilatura", _trafilatura)
+register_backend("readability", _readability)
+register_backend("lxml", _lxml)
+register_backend("plain", _plain)
+register_backend("text", _document_text)
+
+
+################################################################################
+# Streaming
+################################################################################
+class BlockParser:
+    """
+    Incremental extractor for pages too big to build a whole tree for:
+    lxml's HTMLPullParser fed chunk by chunk, with the same block handling
+    as _block_text (text outside boilerplate tags, one block per break
+    element), collected in `blocks` as it's parsed (the caller drains it).
+    Finished elements are dropped as soon as their text is taken, so only
+    the path to the current element stays in memory. Title and the usual
+    <meta>/<link rel=canonical> fields are picked up on the way.
+    """
+
+    _BREAKS = _BREAK_TAGS
+    _SKIP = frozenset(_BOILERPLATE_TAGS) | {"head"}
+
+    def __init__(self):
+        from lxml import etree
+        self._parser = etree.HTMLPullParser(events=("start", "end"), remove_comments=True, remove_pis=True)
+        self.blocks: List[str] = []
+        self.title = ""
+        self.meta: Dict[str, Any] = {}
+        self._skip = 0
+        self._text: List[str] = []
+
+    def feed(self, data: str) -> None:
+        self._parser.feed(data)
+        self._drain()
+
+    def close(self) -> None:
+        self._parser.close()
+        self._drain()
+        self._flush()
+
+    def _flush(self) -> None:
+        if self._text:
+            text = _clean("".join(self._text).replace("\n", " "))
+            if text:
+                self.blocks.append(text)
+            self._text = []
+
+    def _take(self, text: Optional[str]) -> None:
+        if text and not self._skip:
+            self._text.append(text)
+
+    def _drain(self) -> None:
+        # each text node is taken once it's complete: the text before an
+        # element when it starts, the text before an end tag when it ends
+        for event, el in self._parser.read_events():
+            tag = el.tag
+            if event == "start":
+                prev = el.getprevious()
+                if prev is not None:
+                    self._take(prev.tail)
+                    # finished siblings aren't needed any more
+                    parent = el.getparent()
+                    while parent is not None and el.getprevious() is not None:
+                        del parent[0]
+                else:
+                    parent = el.getparent()
+                    if parent is not None:
+                        self._take(parent.text)
+                if tag in ("meta", "link"):
+                    self._head_tag(tag, el.attrib)
+                elif tag == "html" and el.get("lang"):
+                    self.meta["language"] = el.get("lang")
+                if tag == "body":
+                    self._skip = 0
+                elif tag in self._SKIP:
+                    self._skip += 1
+                if tag in self._BREAKS:
+                    self._flush()
+            else:
+                if tag == "title":
+                    self.title = self.title or (el.text or "")
+                last = el[-1] if len(el) else None
+                self._take(last.tail if last is not None else el.text)
+                if tag in self._SKIP and tag != "body":
+                    self._skip = max(0, self._skip - 1)
+                if tag in self._BREAKS:
+                    self._flush()
+                # its tail is still to come, and read from the next sibling or the parent
+                el.clear(keep_tail=True)
+
+    def _head_tag(self, tag, attrs):
+        if tag == "link":
+            if "canonical" in (attrs.get("rel") or "").lower().split() and attrs.get("href"):
+                self.meta.setdefault("canonical_url", attrs["href"].strip())
+            return
+        name = (attrs.get("name") or attrs.get("property") or "").lower()
+        content = (attrs.get("content") or "").strip()
+        field_name = {"description": "description", "og:description": "description", "author": "author",
+                      "article:author": "author", "article:published_time": "date", "date": "date",
+                      "og:site_name": "sitename"}.get(name)
+        if content and field_name:
+            self.meta.setdefault(field_name, content)
+
+
+def iter_blocks(chunks: Iterable[str], parser: Optional[BlockParser] = None) -> Iterator[str]:
+    """
+    Text blocks of an HTML document arriving as `chunks`, yielded as soon
+    as each is parsed. Memory use is bounded by the largest chunk/block,
+    not the page. Pass a BlockParser to read its title/meta afterwards.
+    """
+    parser = parser or BlockParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+        if parser.blocks:
+            yield from parser.blocks
+            parser.blocks = []
+    parser.close()
+    yield from parser.blocks
+    parser.blocks = []
+
+
+def stream_blocks(url: str, timeout: float = EXTRACT_TIMEOUT) -> Iterator[str]:
+    """
+    Text blocks of `url`, parsed while it downloads (uncached). For callers
+    that can work block by block, e.g. docindex.iter_sentences.
+    """
+    with open_stream(url, timeout=timeout) as (_, chunks):
+        yield from iter_blocks(chunks)
+
+
+def _replay(head: List[str], rest: Iterator[str]) -> Iterator[str]:
+    # the buffered start, released piece by piece as it's parsed, then the rest
+    while head:
+        yield head.pop(0)
+    yield from rest
+
+
+def _extract_streamed(page: FetchResult) -> Optional[ExtractionResult]:
+    # small pages are read whole and go through the normal backends; past
+    # LARGE_PAGE_BYTES the rest is parsed as it arrives and never held
+    head, size = [], 0
+    for chunk in page.body:
+        head.append(chunk)
+        size += len(chunk)
+        if size > LARGE_PAGE_BYTES:
+            break
+    else:
+        page.html = "".join(head)
+        return extract(page)
+    return _extract_blocks(page, _replay(head, page.body))
+
+
+def _extract_blocks(page: FetchResult, chunks: Iterable[str],
+                    max_chars: Optional[int] = None) -> Optional[ExtractionResult]:
+    # BlockParser over `chunks`, keeping at most `max_chars` of text if given
+    parser = BlockParser()
+    kept, chars = [], 0
+    with tracing.span("parse.stream") as sp:
+        for block in iter_blocks(chunks, parser):
+            if max_chars is not None and chars + len(block) > max_chars:
+                page.truncated = True
+                break
+            kept.append(block)
+            chars += len(block) + 1
+        text = "\n".join(kept)
+        sp.set(chars=len(text), blocks=len(kept))
+    if len(text.strip()) < MIN_TEXT_CHARS:
+        return None
+    meta = dict(parser.meta, content_type=page.content_type, truncated=page.truncated, chars=len(text))
+    return ExtractionResult(text=text, title=_clean(parser.title), url=page.url, backend="stream",
+                            metadata=meta)
+
+
+################################################################################
+# Engine
+################################################################################
+def choose_backends(page: FetchResult) -> List[str]:
+    """
+    Backends to try for `page`, in order.
+    """
+    content_type = (page.content_type or "").lower()
+    if content_type.startswith("text/plain"):
+        return ["plain"]
+    # whatever the configured order, the whole-document text comes last
+    return [b for b in HTML_BACKENDS if b != "text"] + ["text"]
+
+
+def extract(page: FetchResult, backends: Optional[List[str]] = None,
+            max_chars: Optional[int] = None) -> Optional[ExtractionResult]:
+    """
+    Run the backends for `page` until one returns at least MIN_TEXT_CHARS
+    of text. Returns None if none did. A backend that raises (e.g. its
+    package isn't installed) is skipped. HTML pages over LARGE_PAGE_BYTES
+    go through BlockParser, like streamed ones, which keeps at most
+    `max_chars` of their text when given.
+    """
+    if not page.html:
+        return None
+    if backends is None and len(page.html) > LARGE_PAGE_BYTES and \
+            not (page.content_type or "").lower().startswith("text/plain"):
+        return _extract_blocks(page, [page.html], max_chars)
+    title = ""
+    meta: Dict[str, Any] = {}
+    for name in backends or choose_backends(page):
+        backend = BACKENDS.get(name)
+        if backend is None:
+            continue
+        with tracing.span(f"parse.{name}", bytes=len(page.html)) as sp:
+            try:
+                out = backend(page.html, page.url)
+            except Exception as e:
+                sp.set(error=f"{type(e).__name__}: {e}")
+                continue
+            sp.set(chars=len(out[0]) if out else 0)
+        if not out:
+            continue
+        text, backend_title, backend_meta = out
+        # keep the best title/metadata seen so far even if the text falls short
+        title = title or backend_title
+        meta = {**backend_meta, **meta}
+        if len(text.strip()) >= MIN_TEXT_CHARS:
+            meta.update(content_type=page.content_type, truncated=page.truncated, chars=len(text))
+            return ExtractionResult(text=text, title=title or _title_from_html(page.html),
+                                    url=page.url, backend=name, metadata=meta)
+    return None
+
+
+def _extract_for_cache(page: FetchResult) -> Optional[Dict[str, Any]]:
+    result = _extract_streamed(page) if page.body is not None else extract(page)
+    return result.to_dict() if result else None
+
+
+def extract_url(url: str, timeout: float = EXTRACT_TIMEOUT) -> Optional[ExtractionResult]:
+    """
+    Download `url` through the shared fetch layer (cached and revalidated
+    with ETag/Last-Modified) and extract it. None if nothing usable.
+    """
+    data = cached_extract(url, "extraction", _extract_for_cache, timeout=timeout, stream=True)
+    return ExtractionResult.from_dict(data) if data else None
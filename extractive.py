@@ -0,0 +1,122 @@
+# extractive.py
+"""
+Extractive summarizer used by the no-API-key paths.
+
+Sentences are scored by TF-IDF centrality: every sentence becomes a sparse,
+L2-normalised TF-IDF vector and its score is the cosine similarity to the
+document centroid (the sum of all sentence vectors), i.e. how much of the
+document's overall vocabulary it covers. Final picks are made with MMR
+(maximal marginal relevance) so near-identical sentences aren't chosen twice.
+
+The sentence-term matrix is built once per DocumentIndex (docindex.py) as
+sparse numpy arrays and scored with vectorised bincounts; the centroid
+trick keeps it linear in document size (no sentence-by-sentence similarity
+matrix), and MMR only runs over a small pool of the best candidates.
+"""
+from typing import Dict, List
+
+import numpy as np
+
+from docindex import DocumentIndex, MIN_SENTENCE_CHARS
+
+# pool of top-scored sentences MMR chooses from, as a multiple of k
+_CANDIDATE_FACTOR = 5
+
+
+def split_into_sentences(text: str, min_chars: int = MIN_SENTENCE_CHARS) -> List[str]:
+    """
+    Sentences in document order; lines (paragraphs, list items) never merge.
+    """
+    if min_chars == MIN_SENTENCE_CHARS:
+        return DocumentIndex.for_text(text).sentences()
+    return DocumentIndex(text, min_chars=min_chars).sentences()
+
+
+class SentenceTermMatrix:
+    """
+    Sparse sentence x term TF-IDF matrix in coordinate form: parallel numpy
+    arrays `rows` (sentence), `cols` (term id) and `weights`, sorted by row,
+    with every row L2-normalised. Built from a DocumentIndex, so no text is
+    re-tokenized; use matrix_for() to reuse one per index.
+    """
+
+    def __init__(self, index: DocumentIndex):
+        # content words only; the index already maps every word to its sentence
+        keep = ~index.is_stop[index.word_ids]
+        row_ids = index.word_sents[keep].astype(np.int64)
+        col_ids = index.word_ids[keep].astype(np.int64)
+        n, v = index.n_sentences, max(len(index.vocab), 1)
+        self.n_rows, self.n_cols = n, v
+        # collapse repeated (sentence, term) pairs into counts
+        pairs, tf = np.unique(row_ids * v + col_ids, return_counts=True)
+        rows, cols = pairs // v, pairs % v
+        idf = np.log((1.0 + n) / (1.0 + index.doc_freq)) + 1.0
+        weights = (1.0 + np.log(tf)) * idf[cols]
+        norms = np.sqrt(np.bincount(rows, weights * weights, minlength=n))
+        norms[norms == 0] = 1.0
+        self.rows, self.cols, self.weights = rows, cols, weights / norms[rows]
+        # row i occupies [offsets[i], offsets[i + 1])
+        self.offsets = np.searchsorted(rows, np.arange(n + 1))
+
+    def row(self, i: int) -> Dict[int, float]:
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return dict(zip(self.cols[a:b].tolist(), self.weights[a:b].tolist()))
+
+    def centrality(self) -> "np.ndarray":
+        """
+        Cosine similarity of each sentence to the document centroid.
+        """
+        centroid = np.bincount(self.cols, self.weights, minlength=self.n_cols)
+        norm = np.sqrt(centroid @ centroid) or 1.0
+        return np.bincount(self.rows, self.weights * centroid[self.cols], minlength=self.n_rows) / norm
+
+
+def matrix_for(index: DocumentIndex) -> SentenceTermMatrix:
+    if index._matrix is None:
+        index._matrix = SentenceTermMatrix(index)
+    return index._matrix
+
+
+def _dot(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(w * b.get(t, 0.0) for t, w in a.items())
+
+
+def select_indices(index: DocumentIndex, k: int, diversity: float = 0.3) -> List[int]:
+    """
+    Indices of the `k` best sentences of `index` in selection order (most
+    central first), with MMR penalising similarity to sentences already picked.
+    """
+    n = index.n_sentences
+    if k <= 0 or not n:
+        return []
+    matrix = matrix_for(index)
+    # small lead bias: openings of articles tend to carry the thesis
+    scores = matrix.centrality() * (1.0 + 0.1 * (1.0 - np.arange(n) / n))
+    pool = np.argsort(-scores, kind="stable")[:k * _CANDIDATE_FACTOR].tolist()
+    vectors = {i: matrix.row(i) for i in pool}
+    chosen: List[int] = []
+    max_sim = {i: 0.0 for i in pool}
+    while pool and len(chosen) < k:
+        best = max(pool, key=lambda i: (1 - diversity) * scores[i] - diversity * max_sim[i])
+        chosen.append(best)
+        pool.remove(best)
+        for i in pool:
+            sim = _dot(vectors[i], vectors[best])
+            if sim > max_sim[i]:
+                max_sim[i] = sim
+    return chosen
+
+
+def select_sentences(text: str, k: int, diversity: float = 0.3, min_chars: int = MIN_SENTENCE_CHARS) -> List[str]:
+    """
+    The `k` most representative, mutually non-redundant sentences of `text`,
+    returned in document order.
+    """
+    index = DocumentIndex.for_text(text) if min_chars == MIN_SENTENCE_CHARS else DocumentIndex(text, min_chars)
+    return [index.sentence(i) for i in sorted(select_indices(index, k, diversity))]
+
+
+def summarize(text: str, max_sentences: int = 3) -> str:
+    return " ".join(select_sentences(text, max_sentences))
@@ -0,0 +1,210 @@
+# fetch.py
+"""
+Shared HTTP layer for page extraction.
+
+One pooled keep-alive requests.Session for the whole process, conditional
+GETs (If-None-Match / If-Modified-Since), gzip/deflate (and brotli when the
+`brotli` package is installed), a hard cap on body size and a per-host
+concurrency limit. Callers download a page once and hand the same body to
+every parser.
+"""
+import os
+import re
+import time
+import codecs
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+import tracing
+from cache import CACHE, EXTRACT_TTL, make_key, normalize_url
+
+USER_AGENT = "Mozilla/5.0"
+MAX_BODY_BYTES = int(float(os.environ.get("NOTES_FETCH_MAX_MB", 10)) * 1024 * 1024)
+PER_HOST_LIMIT = int(os.environ.get("NOTES_FETCH_PER_HOST", 4))
+POOL_SIZE = int(os.environ.get("NOTES_FETCH_POOL", 32))
+# how long validators are kept around for revalidation after EXTRACT_TTL runs out
+VALIDATOR_TTL = float(os.environ.get("NOTES_CACHE_TTL_VALIDATORS", 30 * 24 * 3600))
+
+try:
+    import brotli  # noqa: F401  (urllib3 decodes "br" when it's importable)
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except Exception:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.I)
+
+
+@dataclass
+class FetchResult:
+    url: str                      # final URL after redirects
+    status: int
+    html: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_type: str = ""
+    truncated: bool = False       # body was cut at MAX_BODY_BYTES
+    # streamed pages (cached_extract(stream=True)): the body as text pieces
+    # instead of html; only valid inside the parse call
+    body: Optional[Iterator[str]] = field(default=None, repr=False, compare=False)
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+
+_session = None
+_session_lock = threading.Lock()
+_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+_host_lock = threading.Lock()
+
+
+def get_session() -> "requests.Session":
+    """
+    Process-wide session; connections are kept alive and reused across calls.
+    requests is imported here, on first use.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                session = requests.Session()
+                retry = Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504),
+                              allowed_methods=("GET", "HEAD"))
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING})
+                _session = session
+    return _session
+
+
+def _host_slot(url: str) -> threading.BoundedSemaphore:
+    host = (urlsplit(url).hostname or "").lower()
+    with _host_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = _host_slots[host] = threading.BoundedSemaphore(PER_HOST_LIMIT)
+    return slot
+
+
+def _encoding(head: bytes, resp: "requests.Response") -> str:
+    # requests guesses ISO-8859-1 for any text/* without a charset, which is
+    # wrong for most pages, so only trust an explicit header charset
+    encoding = None
+    if "charset" in resp.headers.get("Content-Type", "").lower():
+        encoding = resp.encoding
+    if not encoding:
+        m = _META_CHARSET.search(head[:4096])
+        encoding = m.group(1).decode("ascii") if m else "utf-8"
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        encoding = "utf-8"
+    return encoding
+
+
+@contextmanager
+def open_stream(url: str, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                timeout: float = 15, max_bytes: int = MAX_BODY_BYTES):
+    """
+    Like fetch(), but the body isn't read up front: yields (result, chunks)
+    where result has everything but html and chunks is an iterator of
+    decoded text pieces (~64 KB each), cut at `max_bytes` (result.truncated
+    is set once that happens). For a 304, chunks is empty. The connection
+    is released when the block exits.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    with tracing.span("fetch", url=url, conditional=bool(headers)) as sp, _host_slot(url):
+        with get_session().get(url, headers=headers, timeout=timeout, stream=True) as resp:
+            sp.set(status=resp.status_code)
+            if resp.status_code == 304:
+                yield FetchResult(url=resp.url, status=304, etag=etag, last_modified=last_modified), iter(())
+                return
+            resp.raise_for_status()
+            result = FetchResult(
+                url=resp.url,
+                status=resp.status_code,
+                etag=resp.headers.get("ETag"),
+                last_modified=resp.headers.get("Last-Modified"),
+                content_type=resp.headers.get("Content-Type", ""),
+            )
+
+            def chunks() -> Iterator[str]:
+                size, decoder = 0, None
+                for chunk in resp.iter_content(chunk_size=64 * 1024):
+                    if size + len(chunk) > max_bytes:
+                        chunk = chunk[:max_bytes - size]
+                        result.truncated = True
+                    size += len(chunk)
+                    if decoder is None:
+                        decoder = codecs.getincrementaldecoder(_encoding(chunk, resp))(errors="replace")
+                    yield decoder.decode(chunk)
+                    if result.truncated:
+                        break
+                if decoder is not None:
+                    yield decoder.decode(b"", final=True)
+                sp.set(bytes=size, truncated=result.truncated)
+
+            yield result, chunks()
+
+
+def fetch(url: str, etag: Optional[str] = None, last_modified: Optional[str] = None,
+          timeout: float = 15, max_bytes: int = MAX_BODY_BYTES) -> FetchResult:
+    """
+    GET `url` through the shared session. Pass the validators from a previous
+    fetch to get a cheap 304 (FetchResult.not_modified) when nothing changed.
+    Raises requests.HTTPError for 4xx/5xx responses.
+    """
+    with open_stream(url, etag, last_modified, timeout, max_bytes) as (result, chunks):
+        result.html = "".join(chunks)
+    return result
+
+
+def cached_extract(url: str, namespace: str, parse: Callable[[FetchResult], Any], timeout: float = 15,
+                   stream: bool = False) -> Any:
+    """
+    Download `url` once and run `parse` on it, with a revalidating cache:
+    within EXTRACT_TTL the stored result is returned as-is; after that the
+    page is re-requested with its stored ETag/Last-Modified and a 304 keeps
+    the old result without re-parsing. Falsy results are not cached.
+    With stream=True `parse` gets the body as FetchResult.body (an iterator
+    of text pieces) instead of .html, so it never has to hold the page.
+    """
+    with tracing.span("extract", namespace=namespace, url=url) as sp:
+        key = make_key(normalize_url(url))
+        entry = CACHE.get(namespace, key)
+        if entry is not None and time.time() - entry["fetched_at"] < EXTRACT_TTL:
+            sp.set(cache="hit")
+            return entry["value"]
+        validators = (entry.get("etag"), entry.get("last_modified")) if entry is not None else (None, None)
+        with open_stream(url, *validators, timeout=timeout) as (res, chunks):
+            if res.not_modified and entry is not None:
+                sp.set(cache="revalidated")
+                entry["fetched_at"] = time.time()
+                CACHE.set(namespace, key, entry, ttl=VALIDATOR_TTL)
+                return entry["value"]
+            sp.set(cache="miss")
+            if stream:
+                res.body = chunks
+            else:
+                res.html = "".join(chunks)
+            value = parse(res)
+            res.body = None
+        if value:
+            CACHE.set(namespace, key, {
+                "value": value,
+                "etag": res.etag,
+                "last_modified": res.last_modified,
+                "fetched_at": time.time(),
+            }, ttl=VALIDATOR_TTL)
+        return value
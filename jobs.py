@@ -0,0 +1,333 @@
+# jobs.py
+"""
+Background job queue so page processing doesn't run on the Streamlit script
+thread.
+
+submit(url, options) stores a job row in a local SQLite table and hands it
+to a worker thread pool; the UI keeps only the job id and polls get(job_id)
+for progress, partial results (when streaming) and the final result.
+Identical requests that are already queued or running share one job.
+Several processes can share the table: a running job belongs to the process
+that claimed it, which keeps its heartbeat fresh, and only jobs whose owner
+has stopped beating (crashed or restarted) are picked up again.
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import tracing
+from cache import EXTRACT_TTL, make_key, normalize_url
+
+JOBS_PATH = os.environ.get("NOTES_JOBS_PATH", os.path.join(".cache", "jobs.sqlite3"))
+JOB_WORKERS = int(os.environ.get("NOTES_JOB_WORKERS", 4))
+# finished jobs older than this are purged on start (seconds)
+JOB_RETENTION = float(os.environ.get("NOTES_JOB_RETENTION", 24 * 3600))
+# seconds between heartbeats of a process's running jobs; a running job
+# whose heartbeat is older than JOB_STALE is taken over by another process
+JOB_HEARTBEAT = float(os.environ.get("NOTES_JOB_HEARTBEAT", 10))
+JOB_STALE = float(os.environ.get("NOTES_JOB_STALE", 60))
+# minimum seconds between partial-result writes while streaming
+_PARTIAL_INTERVAL = 0.5
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+logger = logging.getLogger(__name__)
+
+
+class JobError(Exception):
+    """
+    A job failed in an expected way; the message is shown to the user as-is.
+    """
+
+
+def run_pipeline(url: str, options: Dict[str, Any], report: Callable[..., None]) -> Dict[str, Any]:
+    """
+    Extract `url` and generate notes/FAQs/MCQs with `options` (bullets,
+    faq_count, mcq_count, max_tokens, single_request, stream). `report`
+    is called as report(progress, stage, partial=None).
+    """
+    # imported here so the UI process can start without loading the generation stack
+    import backends
+    import dedup
+    from extraction import extract_url
+    use_openai = backends.get_backend() is not None
+    options_key = dedup.options_key(options, use_openai)
+    urls = [dedup.canonical_url(url)]
+    # the same article under another URL spelling, recently enough that the
+    # page is unlikely to have changed: nothing to fetch or generate
+    reused = dedup.STORE.find_by_url(urls[0], options_key, max_age=EXTRACT_TTL)
+    if reused is not None:
+        tracing.annotate(dedup="url")
+        tracing.count("dedup_reused", match="url")
+        return reused
+
+    report(0.05, "Fetching the webpage")
+    try:
+        page = extract_url(url)
+    except Exception as e:
+        raise JobError(f"Failed to extract text from URL: {e}")
+    raw_text = page.text if page else ""
+    if not raw_text or len(raw_text.strip()) < 200:
+        raise JobError("Couldn't extract enough textual content from the URL. Try another page.")
+
+    # mirrors and syndicated copies: the page's rel=canonical, then the text itself
+    fingerprint = dedup.simhash(raw_text)
+    reused, match = None, ""
+    if page.metadata.get("canonical_url"):
+        # many sites point rel=canonical at the home page or page 1: only
+        # trust it when the stored document has the same text
+        canonical = dedup.canonical_url(url, page.metadata["canonical_url"])
+        reused, match = dedup.STORE.find_by_url(canonical, options_key, fingerprint=fingerprint,
+                                                chars=len(raw_text)), "canonical"
+        if reused is not None:
+            urls.append(canonical)
+    if reused is None:
+        reused, match = dedup.STORE.find_similar(fingerprint, len(raw_text), options_key), "simhash"
+    if reused is not None:
+        tracing.annotate(dedup=match)
+        tracing.count("dedup_reused", match=match)
+        # remember this URL too, so the next request for it skips the fetch
+        dedup.STORE.add(urls, fingerprint, len(raw_text), options_key, reused)
+        return reused
+
+    result = generate_sections(raw_text, options, report, use_openai=use_openai)
+    if not (use_openai and _fell_back()):
+        # LLM output that partly came from the fallback generators isn't worth sharing
+        dedup.STORE.add(urls, fingerprint, len(raw_text), options_key, result)
+    return result
+
+
+def generate_sections(raw_text: str, options: Dict[str, Any], report: Callable[..., None],
+                      use_openai: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    The generation half of run_pipeline, for text that is already extracted:
+    returns {"notes", "faqs", "mcqs"}, reporting partial results on the way.
+    """
+    import backends
+    from utils import iter_note_sections, iter_study_pack_stream
+    if use_openai is None:
+        use_openai = backends.get_backend() is not None
+    report(0.3, "Generating notes")
+    kwargs = dict(bullets=options.get("bullets", 6), faq_count=options.get("faq_count", 5),
+                  mcq_count=options.get("mcq_count", 5), max_tokens=options.get("max_tokens", 600))
+    result: Dict[str, Any] = {}
+    if use_openai and options.get("single_request", True) and options.get("stream", True):
+        # partial view built up item by item, replaced by the validated section at the end
+        live = {"notes": {"summary": "", "bullets": []}, "faqs": [], "mcqs": []}
+        for kind, key, value in iter_study_pack_stream(raw_text, **kwargs):
+            if kind == "section":
+                result[key] = value
+                live[key] = value
+            elif key == "summary":
+                live["notes"]["summary"] = value
+            elif key == "bullets":
+                live["notes"]["bullets"].append(value)
+            else:
+                live[key].append(value)
+            report(0.3 + 0.2 * len(result), "Generating notes", partial=live)
+    else:
+        for name, value in iter_note_sections(raw_text, use_openai=use_openai,
+                                              single_request=options.get("single_request", True), **kwargs):
+            result[name] = value
+            report(0.3 + 0.2 * len(result), "Generating notes", partial=dict(result))
+    return result
+
+
+def _fell_back() -> bool:
+    tr = tracing.current_trace()
+    return tr is not None and any(sp.name.startswith("fallback.") for sp in list(tr.spans))
+
+
+class JobQueue:
+    """
+    SQLite-backed job table plus a thread pool of workers. One instance per
+    process; safe to share between Streamlit sessions.
+    """
+
+    def __init__(self, path: str = JOBS_PATH, workers: int = JOB_WORKERS,
+                 pipeline: Callable[..., Dict[str, Any]] = run_pipeline):
+        self.path = path
+        self.pipeline = pipeline
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, dedup_key TEXT NOT NULL, url TEXT NOT NULL, options TEXT NOT NULL,"
+            " status TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0, stage TEXT NOT NULL DEFAULT '',"
+            " partial TEXT, result TEXT, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        # tables created before jobs had owners
+        for column, kind in (("owner", "TEXT"), ("heartbeat", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs(dedup_key, status)")
+        self._conn.commit()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._recover()
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def _execute(self, sql: str, params=()) -> int:
+        """
+        Run a write statement; returns the number of affected rows.
+        """
+        with self._lock:
+            cur = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cur.rowcount
+
+    def _query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _recover(self) -> None:
+        # drop old finished jobs, then pick up queued ones and those of dead owners
+        self._execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                      (DONE, FAILED, time.time() - JOB_RETENTION))
+        self._requeue_stale()
+        for (job_id,) in self._query("SELECT id FROM jobs WHERE status=?", (QUEUED,)):
+            self._pool.submit(self._run, job_id)
+
+    def _requeue_stale(self) -> list:
+        """
+        Requeue running jobs whose owner stopped sending heartbeats; returns
+        their ids. Jobs of live processes, this one included, are left alone.
+        """
+        stale = time.time() - JOB_STALE
+        requeued = []
+        for (job_id,) in self._query(
+                "SELECT id FROM jobs WHERE status=? AND (heartbeat IS NULL OR heartbeat < ?)", (RUNNING, stale)):
+            # conditional, so only one process takes each job over
+            if self._execute(
+                    "UPDATE jobs SET status=?, stage='Queued (resumed)', owner=NULL WHERE id=? AND status=?"
+                    " AND (heartbeat IS NULL OR heartbeat < ?)", (QUEUED, job_id, RUNNING, stale)):
+                requeued.append(job_id)
+        return requeued
+
+    def _heartbeat(self) -> None:
+        while True:
+            time.sleep(JOB_HEARTBEAT)
+            try:
+                self._execute("UPDATE jobs SET heartbeat=? WHERE owner=? AND status=?",
+                              (time.time(), self.owner, RUNNING))
+                for job_id in self._requeue_stale():
+                    self._pool.submit(self._run, job_id)
+            except sqlite3.Error as e:
+                logger.warning("job heartbeat failed: %s", e)
+
+    def submit(self, url: str, options: Dict[str, Any]) -> str:
+        """
+        Queue `url` and return the job id. If an identical request is already
+        queued or running, its id is returned instead of starting a new job.
+        """
+        dedup_key = make_key(normalize_url(url), options)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE dedup_key=? AND status IN (?, ?) ORDER BY created LIMIT 1",
+                (dedup_key, QUEUED, RUNNING),
+            ).fetchone()
+            if row:
+                return row[0]
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, dedup_key, url, options, status, stage, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, 'Queued', ?, ?)",
+                (job_id, dedup_key, url, json.dumps(options, sort_keys=True), QUEUED, now, now),
+            )
+            self._conn.commit()
+        self._pool.submit(self._run, job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Job as a dict (id, url, status, progress, stage, partial, result,
+        error) or None for an unknown id.
+        """
+        rows = self._query(
+            "SELECT id, url, status, progress, stage, partial, result, error FROM jobs WHERE id=?",
+            (job_id,),
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        return {
+            "id": row[0], "url": row[1], "status": row[2], "progress": row[3], "stage": row[4],
+            "partial": json.loads(row[5]) if row[5] else None,
+            "result": json.loads(row[6]) if row[6] else None,
+            "error": row[7],
+        }
+
+    def _run(self, job_id: str) -> None:
+        # claim atomically so two processes sharing the table never run one job twice
+        now = time.time()
+        claimed = self._execute(
+            "UPDATE jobs SET status=?, stage='Starting', owner=?, heartbeat=?, updated=? WHERE id=? AND status=?",
+            (RUNNING, self.owner, now, now, job_id, QUEUED),
+        )
+        if not claimed:
+            return
+        url, options = self._query("SELECT url, options FROM jobs WHERE id=?", (job_id,))[0]
+        last_partial = [0.0]
+
+        def report(progress: float, stage: str, partial: Optional[Dict[str, Any]] = None) -> None:
+            now = time.time()
+            if partial is not None and now - last_partial[0] >= _PARTIAL_INTERVAL:
+                last_partial[0] = now
+                self._execute("UPDATE jobs SET progress=?, stage=?, partial=?, updated=? WHERE id=? AND owner=?",
+                              (min(progress, 0.99), stage, json.dumps(partial), now, job_id, self.owner))
+            elif partial is None:
+                self._execute("UPDATE jobs SET progress=?, stage=?, updated=? WHERE id=? AND owner=?",
+                              (min(progress, 0.99), stage, now, job_id, self.owner))
+
+        try:
+            # trace id = job id, so the app's debug panel can find it
+            with tracing.trace("job", trace_id=job_id, url=url):
+                result = self.pipeline(url, json.loads(options), report)
+        except JobError as e:
+            self._finish(job_id, FAILED, error=str(e))
+        except Exception as e:
+            self._finish(job_id, FAILED, error=f"Unexpected error: {e}")
+        else:
+            self._finish(job_id, DONE, result=result)
+
+    def _finish(self, job_id: str, status: str, result=None, error=None) -> None:
+        # only while this process still owns the job: once it was requeued
+        # and claimed elsewhere, the new owner's outcome is the one that counts
+        finished = self._execute(
+            "UPDATE jobs SET status=?, progress=1, stage=?, partial=NULL, result=?, error=?, updated=?"
+            " WHERE id=? AND owner=? AND status=?",
+            (status, "Done" if status == DONE else "Failed",
+             json.dumps(result) if result is not None else None, error, time.time(), job_id,
+             self.owner, RUNNING),
+        )
+        if not finished:
+            logger.info("job %s was taken over by another worker; dropping its late %s result", job_id, status)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    """
+    Process-wide queue, created (and recovered) on first use.
+    """
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
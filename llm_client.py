@@ -0,0 +1,374 @@
+# llm_client.py
+"""
+The one place that talks to the OpenAI API.
+
+chat(messages, ...) returns the reply text (or, with stream=True, an
+iterator of text deltas) and takes care of everything around the call:
+
+- one pooled OpenAI client per API key / base URL, reused by every caller
+- the shared disk cache (cache.py), keyed by model, messages and params
+- coalescing: identical prompts already in flight wait for that request
+  instead of sending their own
+- a limiter sized to the org's limits: at most OPENAI_MAX_CONCURRENCY calls
+  in flight, OPENAI_RPM requests and OPENAI_TPM tokens (prompt + max_tokens,
+  as OpenAI counts them) per minute
+- retries on 429/5xx/timeouts/connection errors with exponential backoff and
+  full jitter, honouring Retry-After; a 429 pauses every caller, not just
+  the one that got it
+- a deadline per call (OPENAI_CALL_TIMEOUT seconds, retries included)
+
+Failures after that raise LLMError; callers decide whether to fall back.
+"""
+import os
+import time
+import random
+import logging
+import threading
+import importlib.util
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+import tracing
+from cache import CACHE, LLM_TTL, make_key
+from chunking import count_tokens
+
+# the SDK takes most of a second to import; it's loaded by the first call
+# (or warmup.py), not when the app starts
+OPENAI_AVAILABLE = importlib.util.find_spec("openai") is not None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")
+# Seconds a single call may take, retries and rate-limit waits included
+LLM_CALL_TIMEOUT = float(os.environ.get("OPENAI_CALL_TIMEOUT", 45))
+MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", 4))
+MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", 8))
+RPM_LIMIT = float(os.environ.get("OPENAI_RPM", 500))
+TPM_LIMIT = float(os.environ.get("OPENAI_TPM", 200_000))
+# backoff: base * 2**attempt, capped, with full jitter
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20.0
+
+_RETRY_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+
+class LLMError(RuntimeError):
+    """
+    The call failed for good (no key, non-retryable error, retries used up).
+    """
+
+
+class LLMTimeout(LLMError):
+    """
+    The call's deadline passed before an answer arrived.
+    """
+
+
+################################################################################
+# Client
+################################################################################
+@lru_cache(maxsize=1)
+def _openai():
+    import openai
+    return openai
+
+
+_clients: Dict[Tuple[str, Optional[str]], "openai.OpenAI"] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key: Optional[str] = None) -> "openai.OpenAI":
+    """
+    Shared client for `api_key` (default: OPENAI_API_KEY). The SDK's own
+    retries are off; chat() does its own, across the limiter.
+    """
+    if not OPENAI_AVAILABLE:
+        raise LLMError("openai package not installed in environment.")
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise LLMError("OPENAI_API_KEY not set.")
+    base_url = os.environ.get("OPENAI_BASE_URL") or None
+    with _clients_lock:
+        client = _clients.get((api_key, base_url))
+        if client is None:
+            client = _openai().OpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=LLM_CALL_TIMEOUT)
+            _clients[(api_key, base_url)] = client
+    return client
+
+
+################################################################################
+# Rate limiting
+################################################################################
+class RateLimiter:
+    """
+    Concurrency slots plus request and token buckets refilled continuously
+    at rpm/60 and tpm/60 per second. pause() stops everyone for a while
+    (after a 429).
+    """
+
+    def __init__(self, rpm: float = RPM_LIMIT, tpm: float = TPM_LIMIT, concurrency: int = MAX_CONCURRENCY):
+        self.rpm, self.tpm = rpm, tpm
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._requests, self._tokens = rpm, tpm
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    def acquire(self, tokens: int, deadline: float) -> float:
+        """
+        Block until a slot and budget for one request of `tokens` are
+        available; returns seconds waited. Raises LLMTimeout at `deadline`
+        (time.monotonic()).
+        """
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=max(0.0, deadline - started)):
+            raise LLMTimeout("timed out waiting for a free LLM slot")
+        # a request bigger than the whole budget can only ever wait for a full bucket
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._requests >= 1 and self._tokens >= tokens:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        return now - started
+                    wait = max((1 - self._requests) * 60.0 / self.rpm, (tokens - self._tokens) * 60.0 / self.tpm)
+            if now + wait > deadline:
+                self._slots.release()
+                raise LLMTimeout("rate limit budget not available before the deadline")
+            time.sleep(min(wait, 1.0))
+
+    def release(self) -> None:
+        self._slots.release()
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+LIMITER = RateLimiter()
+
+
+################################################################################
+# Retries
+################################################################################
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    if not OPENAI_AVAILABLE:
+        return False
+    openai = _openai()
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in _RETRY_STATUS
+
+
+def _backoff(attempt: int, error: Exception) -> float:
+    hinted = _retry_after(error)
+    if hinted is not None:
+        return min(hinted, BACKOFF_CAP)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def _create(client, span, deadline: float, tokens: int, **params):
+    """
+    One logical request: limiter slot, then attempts with backoff until it
+    succeeds, fails for good or runs out of time. With stream=True the
+    retries cover opening the stream; the returned stream still holds its
+    limiter slot (_Stream releases it).
+    """
+    attempt = 0
+    while True:
+        span.set(wait_ms=round(span.attrs.get("wait_ms", 0) + LIMITER.acquire(tokens, deadline) * 1000, 1))
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMTimeout("deadline passed before the request was sent")
+            resp = client.chat.completions.create(timeout=remaining, **params)
+        except Exception as e:
+            LIMITER.release()
+            if isinstance(e, LLMError):
+                raise
+            if not _is_retryable(e) or attempt >= MAX_RETRIES:
+                logger.warning("LLM call failed after %d attempt(s): %s", attempt + 1, e)
+                raise LLMError(f"{type(e).__name__}: {e}") from e
+            delay = _backoff(attempt, e)
+            if getattr(e, "status_code", None) == 429:
+                # everyone is over the limit, not just us
+                LIMITER.pause(delay)
+            if time.monotonic() + delay >= deadline:
+                logger.warning("LLM call out of time after %d attempt(s): %s", attempt + 1, e)
+                raise LLMTimeout(f"gave up after {attempt + 1} attempts: {type(e).__name__}") from e
+            attempt += 1
+            span.set(retries=attempt)
+            tracing.count("llm_retries", status=getattr(e, "status_code", type(e).__name__))
+            time.sleep(delay)
+            continue
+        if not params.get("stream"):
+            LIMITER.release()
+        return resp
+
+
+################################################################################
+# Public API
+################################################################################
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def chat(messages, model: Optional[str] = None, max_tokens: int = 800, temperature: float = 0.2,
+         stream: bool = False, timeout: Optional[float] = None, api_key: Optional[str] = None,
+         cache: bool = True) -> Union[str, Iterator[str]]:
+    """
+    Send a chat completion and return the stripped reply text, or with
+    stream=True an iterator of text deltas (a cached reply comes back as
+    one piece). Raises LLMError / LLMTimeout.
+    """
+    model = model or DEFAULT_MODEL
+    deadline = time.monotonic() + (timeout if timeout is not None else LLM_CALL_TIMEOUT)
+    key = make_key(model, messages, max_tokens, temperature)
+    # a streamed call's span stays open until the stream is consumed
+    span = tracing.start_span("llm", model=model, max_tokens=max_tokens, stream=stream)
+    cached = CACHE.get("llm", key) if cache else None
+    if cached is not None:
+        span.set(cache="hit")
+        span.finish()
+        return iter([cached]) if stream else cached
+    span.set(cache="miss" if cache else "off")
+    try:
+        client = get_client(api_key)
+    except LLMError as e:
+        span.finish(e)
+        raise
+    params = dict(model=model, messages=messages, max_tokens=max_tokens, temperature=temperature)
+    tokens = count_tokens("\n".join(str(m.get("content", "")) for m in messages)) + max_tokens
+    if stream:
+        try:
+            resp = _create(client, span, deadline, tokens, stream=True,
+                           stream_options={"include_usage": True}, **params)
+        except Exception as e:
+            span.finish(e)
+            raise
+        return _Stream(resp, key, span, messages, cache)
+
+    with _inflight_lock:
+        pending = _inflight.get(key)
+        leader = pending is None
+        if leader:
+            pending = _inflight[key] = Future()
+    if not leader:
+        span.set(coalesced=True)
+        try:
+            out = pending.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception as e:
+            span.finish(e)
+            if isinstance(e, LLMError):
+                raise
+            raise LLMTimeout("timed out waiting for an identical request") from e
+        span.finish()
+        return out
+    try:
+        resp = _create(client, span, deadline, tokens, **params)
+        out = (resp.choices[0].message.content or "").strip()
+    except Exception as e:
+        span.finish(e)
+        pending.set_exception(e if isinstance(e, LLMError) else LLMError(str(e)))
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+    # answer the followers before any bookkeeping that could fail
+    pending.set_result(out)
+    try:
+        tracing.record_llm_usage(span, model, messages, out, getattr(resp, "usage", None))
+        if cache:
+            CACHE.set("llm", key, out, ttl=LLM_TTL)
+    except Exception as e:
+        # the reply is good; losing its usage numbers or cache entry isn't worth failing over
+        logger.warning("LLM bookkeeping failed: %s: %s", type(e).__name__, e)
+    finally:
+        span.finish()
+    return out
+
+
+class _Stream:
+    """
+    Iterator of text deltas. Holds a limiter slot until it is exhausted,
+    closed or garbage collected, whichever comes first.
+    """
+
+    def __init__(self, resp, key: str, span, messages, cache: bool):
+        self._resp, self._key, self._span, self._messages, self._cache = resp, key, span, messages, cache
+        self._parts = []
+        self._usage = None
+        self._done = False
+        self._deltas = self._iter()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        return next(self._deltas)
+
+    def _iter(self) -> Iterator[str]:
+        try:
+            for chunk in self._resp:
+                # with include_usage the last chunk has no choices, only usage
+                if getattr(chunk, "usage", None) is not None:
+                    self._usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not self._parts:
+                        self._span.set(first_token_ms=round(self._span.duration * 1000, 1))
+                    self._parts.append(delta)
+                    yield delta
+        except Exception as e:
+            self._finish(e)
+            raise LLMError(f"stream interrupted: {type(e).__name__}: {e}") from e
+        self._finish()
+        # only a fully consumed stream is cached
+        if self._cache:
+            CACHE.set("llm", self._key, "".join(self._parts).strip(), ttl=LLM_TTL)
+
+    def _finish(self, error: Optional[Exception] = None) -> None:
+        if self._done:
+            return
+        self._done = True
+        LIMITER.release()
+        try:
+            self._resp.close()
+        except Exception:
+            pass
+        tracing.record_llm_usage(self._span, self._span.attrs["model"], self._messages,
+                                 "".join(self._parts), self._usage)
+        self._span.finish(error)
+
+    def close(self) -> None:
+        self._deltas.close()
+        self._finish()
+
+    def __del__(self):
+        self._finish()
@@ -0,0 +1,293 @@
+# notes.py
+"""
+Headless entry point.
+
+    python -m notes batch urls.txt --out results.jsonl
+    python -m notes watch urls.txt --out refreshed.jsonl
+    python -m notes export results.jsonl --formats pdf,md,csv --out packs.zip
+    python -m notes warmup
+
+Reads one URL per line (blank lines and #comments are skipped), extracts
+and generates notes/FAQs/MCQs for each, and appends one JSON line per URL
+to --out as soon as it finishes. Re-running with the same --out skips
+URLs that already have an "ok" record, so an interrupted run resumes.
+
+watch refreshes the stored notes of every URL in the file, regenerating
+only what changed since the last run (watch.py); records carry "change".
+
+export renders the "ok" records of such a file into a zip, one file per
+record and format (export.py), on a process pool.
+
+warmup imports and exercises the heavy dependencies once (warmup.py), but
+loads no model weights; the Procfile runs it at boot, before the server
+starts, to fill the bytecode and OS page caches.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Set
+
+
+def read_urls(path: str) -> List[str]:
+    urls = []
+    seen = set()
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            url = line.strip()
+            if not url or url.startswith("#") or url in seen:
+                continue
+            seen.add(url)
+            urls.append(url)
+    return urls
+
+
+def completed_urls(out_path: str) -> Set[str]:
+    """
+    URLs that already have a successful record in `out_path`.
+    A truncated last line (killed mid-write) is ignored.
+    """
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get("status") == "ok":
+                done.add(rec.get("url"))
+    return done
+
+
+def generate_record(url: str, text: str, opts: argparse.Namespace) -> Dict:
+    import backends
+    import dedup
+    import tracing
+    from jobs import _fell_back
+    from utils import iter_note_sections
+    record = {"url": url, "status": "ok", "chars": len(text)}
+    # mirrored/syndicated copies (here or in the app) share one generation
+    use_openai = opts.llm and backends.get_backend() is not None
+    options = dedup.options_key({"bullets": opts.bullets, "faq_count": opts.faqs, "mcq_count": opts.mcqs,
+                                 "max_tokens": opts.max_tokens}, use_openai)
+    fingerprint = dedup.simhash(text)
+    sections = dedup.STORE.find_similar(fingerprint, len(text), options)
+    if sections is not None:
+        record["deduplicated"] = True
+        record.update(sections)
+        return record
+    # traced so fallback spans show up for _fell_back
+    with tracing.trace("batch", url=url):
+        sections = dict(iter_note_sections(
+            text, bullets=opts.bullets, faq_count=opts.faqs, mcq_count=opts.mcqs,
+            max_tokens=opts.max_tokens, use_openai=use_openai,
+            single_request=not opts.separate_requests,
+        ))
+        if not (use_openai and _fell_back()):
+            # LLM output that partly came from the fallback generators isn't worth sharing
+            dedup.STORE.add([dedup.canonical_url(url)], fingerprint, len(text), options, sections)
+    record.update(sections)
+    return record
+
+
+def run_batch(urls: Iterable[str], opts: argparse.Namespace) -> Dict[str, int]:
+    """
+    Fetch on one bounded pool and generate on a second, smaller one so the
+    LLM concurrency limit is independent of how many pages are in flight.
+    Records are appended to opts.out from the caller's thread as they finish.
+    """
+    from utils import extract_text_from_url
+    counts = {"ok": 0, "error": 0}
+    # caps how many URLs are fetched-but-not-written, so fast fetching can't
+    # pile up extracted text in memory while generation catches up
+    in_flight = threading.BoundedSemaphore(opts.fetch_workers + 2 * opts.llm_workers)
+    write_lock = threading.Lock()
+    fetch_pool = ThreadPoolExecutor(max_workers=opts.fetch_workers, thread_name_prefix="fetch")
+    llm_pool = ThreadPoolExecutor(max_workers=opts.llm_workers, thread_name_prefix="generate")
+
+    out = open(opts.out, "a", encoding="utf-8")
+
+    def write(record: Dict) -> None:
+        with write_lock:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts[record["status"]] += 1
+        in_flight.release()
+        if not opts.quiet:
+            print(f"[{record['status']}] {record['url']} ({record.get('elapsed', 0):.1f}s)", file=sys.stderr)
+
+    def generate(url: str, text: str, started: float) -> None:
+        try:
+            record = generate_record(url, text, opts)
+        except Exception as e:
+            record = {"url": url, "status": "error", "error": f"generate: {e}"}
+        record["elapsed"] = time.monotonic() - started
+        write(record)
+
+    def fetch(url: str) -> None:
+        started = time.monotonic()
+        try:
+            text = extract_text_from_url(url)
+        except Exception as e:
+            text, error = "", f"extract: {e}"
+        else:
+            error = "extract: not enough text"
+        if not text or len(text.strip()) < 200:
+            write({"url": url, "status": "error", "error": error, "elapsed": time.monotonic() - started})
+            return
+        llm_pool.submit(generate, url, text, started)
+
+    try:
+        for url in urls:
+            in_flight.acquire()
+            fetch_pool.submit(fetch, url)
+        fetch_pool.shutdown(wait=True)
+        llm_pool.shutdown(wait=True)
+    finally:
+        out.close()
+    return counts
+
+
+def cmd_batch(opts: argparse.Namespace) -> int:
+    urls = read_urls(opts.input)
+    done = completed_urls(opts.out)
+    todo = [u for u in urls if u not in done]
+    if not opts.quiet:
+        print(f"{len(urls)} URLs, {len(urls) - len(todo)} already done, {len(todo)} to process",
+              file=sys.stderr)
+    counts = run_batch(todo, opts)
+    if not opts.quiet:
+        print(f"done: {counts['ok']} ok, {counts['error']} failed", file=sys.stderr)
+    return 1 if counts["error"] else 0
+
+
+def cmd_watch(opts: argparse.Namespace) -> int:
+    from watch import refresh
+    options = {"bullets": opts.bullets, "faq_count": opts.faqs, "mcq_count": opts.mcqs,
+               "max_tokens": opts.max_tokens, "use_openai": None if opts.llm else False,
+               "single_request": not opts.separate_requests}
+    counts: Dict[str, int] = {}
+    write_lock = threading.Lock()
+
+    def run(url: str, out) -> None:
+        started = time.monotonic()
+        try:
+            change, result = refresh(url, options)
+            record = {"url": url, "status": "ok", "change": change, **result}
+        except Exception as e:
+            change, record = "error", {"url": url, "status": "error", "error": str(e)}
+        record["elapsed"] = time.monotonic() - started
+        with write_lock:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts[change] = counts.get(change, 0) + 1
+        if not opts.quiet:
+            print(f"[{change}] {url} ({record['elapsed']:.1f}s)", file=sys.stderr)
+
+    urls = read_urls(opts.input)
+    with open(opts.out, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=opts.workers, thread_name_prefix="watch") as pool:
+        for url in urls:
+            pool.submit(run, url, out)
+    if not opts.quiet:
+        print("done: " + ", ".join(f"{n} {change}" for change, n in sorted(counts.items())), file=sys.stderr)
+    return 1 if counts.get("error") else 0
+
+
+def read_packs(path: str) -> list:
+    """
+    StudyPacks for the "ok" records in a batch JSONL file.
+    """
+    from export import StudyPack
+    packs = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get("status") == "ok":
+                packs.append(StudyPack.from_sections(rec))
+    return packs
+
+
+def cmd_export(opts: argparse.Namespace) -> int:
+    from export import ExportError, export_zip
+    packs = read_packs(opts.input)
+    started = time.monotonic()
+    try:
+        files = export_zip(packs, [f for f in opts.formats.split(",") if f], opts.out, workers=opts.workers)
+    except ExportError as e:
+        print(f"export: {e}", file=sys.stderr)
+        return 2
+    if not opts.quiet:
+        print(f"{files} files from {len(packs)} packs written to {opts.out} ({time.monotonic() - started:.1f}s)",
+              file=sys.stderr)
+    return 0
+
+
+def cmd_warmup(opts: argparse.Namespace) -> int:
+    from warmup import warm
+    # this process exits before the server starts: no point loading model weights
+    timings = warm(models=False)
+    for name, seconds in timings.items():
+        print(f"{name:<12}{'failed' if seconds < 0 else f'{seconds * 1000:.0f} ms'}", file=sys.stderr)
+    return 0
+
+
+def _generation_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--bullets", type=int, default=6)
+    parser.add_argument("--faqs", type=int, default=5)
+    parser.add_argument("--mcqs", type=int, default=5)
+    parser.add_argument("--max-tokens", type=int, default=600)
+    parser.add_argument("--no-llm", dest="llm", action="store_false",
+                        help="use the local fallback generators even if a generation backend is available")
+    parser.add_argument("--separate-requests", action="store_true",
+                        help="one LLM request per section instead of a single study-pack request")
+    parser.add_argument("-q", "--quiet", action="store_true")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m notes", description="URL → Smart Notes, headless.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    batch = sub.add_parser("batch", help="process a file of URLs into JSONL")
+    batch.add_argument("input", help="text file with one URL per line")
+    batch.add_argument("--out", required=True, help="JSONL file to append results to")
+    batch.add_argument("--fetch-workers", type=int, default=8, help="concurrent page downloads")
+    batch.add_argument("--llm-workers", type=int, default=4, help="concurrent documents in generation")
+    _generation_args(batch)
+    batch.set_defaults(func=cmd_batch)
+
+    watch = sub.add_parser("watch", help="refresh the notes of watched URLs, regenerating only what changed")
+    watch.add_argument("input", help="text file with one URL per line")
+    watch.add_argument("--out", required=True, help="JSONL file to append refreshed results to")
+    watch.add_argument("--workers", type=int, default=8, help="URLs refreshed at once")
+    _generation_args(watch)
+    watch.set_defaults(func=cmd_watch)
+
+    export = sub.add_parser("export", help="render a batch JSONL file into a zip of study packs")
+    export.add_argument("input", help="JSONL file written by the batch command")
+    export.add_argument("--out", required=True, help="zip file to write")
+    export.add_argument("--formats", default="pdf,md", help="comma-separated: pdf, md, html, json, csv, apkg")
+    export.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="rendering processes")
+    export.add_argument("-q", "--quiet", action="store_true")
+    export.set_defaults(func=cmd_export)
+
+    warmup = sub.add_parser("warmup", help="import and exercise the heavy dependencies once")
+    warmup.set_defaults(func=cmd_warmup)
+    return parser
+
+
+def main(argv=None) -> int:
+    opts = build_parser().parse_args(argv)
+    return opts.func(opts)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,57 @@
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, KeepTogether
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
-from reportlab.lib.utils import ImageReader
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.fonts import addMapping
+from xml.sax.saxutils import escape
+from functools import lru_cache
 import io
 
-# Register a Unicode font (No unicode errors anymore)
-pdfmetrics.registerFont(TTFont("DejaVu", "DejaVuSans.ttf"))
+import tracing
 
-def create_pdf_bytes(title, summary, notes, faqs, mcqs):
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
+# Lines longer than this are split at sentence ends so no single Paragraph
+# has to be reflowed across many pages
+MAX_PARAGRAPH_CHARS = 2000
+
+
+@lru_cache(maxsize=None)
+def _fonts():
+    """
+    Register the Unicode font once per process (No unicode errors anymore).
+    Returns (regular, bold) font names; falls back to Helvetica if DejaVu
+    isn't installed.
+    """
+    try:
+        pdfmetrics.registerFont(TTFont("DejaVu", "DejaVuSans.ttf"))
+    except Exception:
+        return "Helvetica", "Helvetica-Bold"
+    bold = "DejaVu"
+    try:
+        pdfmetrics.registerFont(TTFont("DejaVu-Bold", "DejaVuSans-Bold.ttf"))
+        bold = "DejaVu-Bold"
+    except Exception:
+        pass
+    # lets <b> inside paragraphs resolve to the bold face
+    addMapping("DejaVu", 0, 0, "DejaVu")
+    addMapping("DejaVu", 1, 0, bold)
+    addMapping("DejaVu", 0, 1, "DejaVu")
+    addMapping("DejaVu", 1, 1, bold)
+    return "DejaVu", bold
 
+
+@lru_cache(maxsize=None)
+def _styles():
+    """
+    Stylesheet built once per process.
+    """
+    regular, bold = _fonts()
     styles = getSampleStyleSheet()
     styles.add(
         ParagraphStyle(
             name="Plain",
-            fontName="DejaVu",
+            fontName=regular,
             fontSize=11,
             leading=14,
         )
@@ -26,42 +59,149 @@ def create_pdf_bytes(title, summary, notes, faqs, mcqs):
     styles.add(
         ParagraphStyle(
             name="Heading",
-            fontName="DejaVu",
+            fontName=bold,
             fontSize=16,
             leading=18,
             spaceAfter=12,
-            bold=True,
         )
     )
+    styles.add(
+        ParagraphStyle(
+            name="Item",
+            parent=styles["Plain"],
+            leftIndent=14,
+            bulletIndent=2,
+            spaceAfter=3,
+        )
+    )
+    styles.add(
+        ParagraphStyle(
+            name="Question",
+            parent=styles["Plain"],
+            fontName=bold,
+            spaceBefore=6,
+            spaceAfter=2,
+        )
+    )
+    return styles
+
 
-    content = []
+def _markup(text):
+    return escape(str(text)).replace("\n", "<br/>")
 
-    # Title
-    content.append(Paragraph(title, styles["Heading"]))
-    content.append(Spacer(1, 0.2 * inch))
 
-    # Summary
-    content.append(Paragraph("<b>Summary</b>", styles["Heading"]))
-    content.append(Paragraph(summary.replace("\n", "<br/>"), styles["Plain"]))
-    content.append(Spacer(1, 0.2 * inch))
+def _split_long(line):
+    if len(line) <= MAX_PARAGRAPH_CHARS:
+        return [line]
+    parts, current = [], ""
+    for sentence in line.replace(". ", ".\n").split("\n"):
+        if current and len(current) + len(sentence) > MAX_PARAGRAPH_CHARS:
+            parts.append(current)
+            current = ""
+        current = f"{current} {sentence}".strip()
+        while len(current) > MAX_PARAGRAPH_CHARS:
+            parts.append(current[:MAX_PARAGRAPH_CHARS])
+            current = current[MAX_PARAGRAPH_CHARS:]
+    if current:
+        parts.append(current)
+    return parts
 
-    # Notes
-    content.append(Paragraph("<b>Key Notes</b>", styles["Heading"]))
-    content.append(Paragraph(notes.replace("\n", "<br/>"), styles["Plain"]))
-    content.append(Spacer(1, 0.2 * inch))
 
-    # FAQs
-    content.append(Paragraph("<b>FAQs</b>", styles["Heading"]))
-    content.append(Paragraph(faqs.replace("\n", "<br/>"), styles["Plain"]))
-    content.append(Spacer(1, 0.2 * inch))
+def _text_flowables(text, style):
+    # one Paragraph per line (and per ~2k chars within a line)
+    out = []
+    for line in str(text).splitlines():
+        line = line.strip()
+        if line:
+            out.extend(Paragraph(_markup(part), style) for part in _split_long(line))
+    return out
 
-    # MCQs
-    content.append(Paragraph("<b>MCQs</b>", styles["Heading"]))
-    content.append(Paragraph(mcqs.replace("\n", "<br/>"), styles["Plain"]))
-    content.append(Spacer(1, 0.2 * inch))
 
-    doc.build(content)
+def _section(heading, flowables):
+    styles = _styles()
+    out = [Paragraph(_markup(heading), styles["Heading"])]
+    out.extend(flowables)
+    out.append(Spacer(1, 0.2 * inch))
+    return out
 
+
+def _notes_flowables(notes):
+    styles = _styles()
+    if isinstance(notes, str):
+        return _text_flowables(notes, styles["Plain"])
+    return [Paragraph(_markup(b), styles["Item"], bulletText="•") for b in notes]
+
+
+def _faq_flowables(faqs):
+    styles = _styles()
+    if isinstance(faqs, str):
+        return _text_flowables(faqs, styles["Plain"])
+    out = []
+    for i, qa in enumerate(faqs, 1):
+        out.append(KeepTogether([
+            Paragraph(_markup(f"Q{i}. {qa['q']}"), styles["Question"]),
+            Paragraph(_markup(f"A: {qa['a']}"), styles["Plain"]),
+        ]))
+    return out
+
+
+def _mcq_flowables(mcqs):
+    styles = _styles()
+    if isinstance(mcqs, str):
+        return _text_flowables(mcqs, styles["Plain"])
+    out = []
+    for i, mcq in enumerate(mcqs, 1):
+        group = [Paragraph(_markup(f"Q{i}. {mcq['question']}"), styles["Question"])]
+        for idx, opt in enumerate(mcq["options"], 1):
+            group.append(Paragraph(_markup(opt), styles["Item"], bulletText=f"{chr(64 + idx)}."))
+        group.append(Paragraph(_markup(f"Answer: {mcq['answer']}"), styles["Plain"]))
+        out.append(KeepTogether(group))
+    return out
+
+
+def document_flowables(title, summary, notes, faqs, mcqs):
+    """
+    Flowables for one study pack. `notes` may be a pre-flattened string or a
+    list of bullets; `faqs` a string or a list of {q, a}; `mcqs` a string or a
+    list of {question, options, answer}. Every bullet, FAQ and MCQ becomes its
+    own flowable so large sets paginate cheaply.
+    """
+    styles = _styles()
+    content = [Paragraph(_markup(title), styles["Heading"]), Spacer(1, 0.2 * inch)]
+    content += _section("Summary", _text_flowables(summary, styles["Plain"]))
+    content += _section("Key Notes", _notes_flowables(notes))
+    content += _section("FAQs", _faq_flowables(faqs))
+    content += _section("MCQs", _mcq_flowables(mcqs))
+    return content
+
+
+def write_pdf(out, documents):
+    """
+    Render one or more study packs into `out` (a filename or a writable
+    binary file object such as an open file or an HTTP response body).
+    `documents` is an iterable of dicts with keys title, summary, notes,
+    faqs and mcqs; each document starts on a new page.
+    """
+    with tracing.span("pdf") as sp:
+        doc = SimpleDocTemplate(out, pagesize=letter)
+        content = []
+        count = 0
+        for pack in documents:
+            if content:
+                content.append(PageBreak())
+            content += document_flowables(
+                pack.get("title", "Document"), pack.get("summary", ""),
+                pack.get("notes", ""), pack.get("faqs", ""), pack.get("mcqs", ""),
+            )
+            count += 1
+        sp.set(documents=count, flowables=len(content))
+        doc.build(content)
+        sp.set(pages=doc.page)
+
+
+def create_pdf_bytes(title, summary, notes, faqs, mcqs):
+    buffer = io.BytesIO()
+    write_pdf(buffer, [{"title": title, "summary": summary, "notes": notes, "faqs": faqs, "mcqs": mcqs}])
     pdf_bytes = buffer.getvalue()
     buffer.close()
     return pdf_bytes
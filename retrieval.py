@@ -0,0 +1,170 @@
+# retrieval.py
+"""
+Passage retrieval for document Q&A.
+
+The document is cut into passages of a few consecutive sentences (never
+across paragraphs once a passage has some substance) and indexed with BM25
+over an inverted index: for every term, the passages it occurs in and how
+often. Everything is derived from the shared DocumentIndex (docindex.py),
+so no text is re-tokenized, and stored as flat numpy arrays.
+
+Questions are answered from the top-k passages instead of the whole text.
+With NOTES_EMBED_MODEL set (and sentence-transformers installed) passages
+are also embedded locally and the two rankings are fused (reciprocal rank
+fusion), which helps with questions that paraphrase the document.
+
+Use RetrievalIndex.for_text(text); it is memoised like DocumentIndex, so
+building it while generating notes makes every later question cheap.
+"""
+import os
+import re
+from functools import lru_cache
+from typing import List, Optional
+
+import numpy as np
+
+from docindex import DocumentIndex
+
+# target passage size in words; a paragraph break ends a passage once it has MIN words
+PASSAGE_WORDS = int(os.environ.get("NOTES_PASSAGE_WORDS", 120))
+MIN_PASSAGE_WORDS = 40
+EMBED_MODEL = os.environ.get("NOTES_EMBED_MODEL", "")
+
+# BM25 parameters
+_K1 = 1.5
+_B = 0.75
+# reciprocal rank fusion constant
+_RRF_K = 60
+
+_WORD = re.compile(r"\w{3,}")
+
+
+@lru_cache(maxsize=1)
+def _embedder():
+    # optional dependency, loaded on first use only
+    if not EMBED_MODEL:
+        return None
+    try:
+        from sentence_transformers import SentenceTransformer
+    except Exception:
+        return None
+    return SentenceTransformer(EMBED_MODEL)
+
+
+class RetrievalIndex:
+    """
+    Passages of one document plus a BM25 inverted index over them.
+    Postings are grouped by term: passages containing term t are
+    post_passage[term_offsets[t]:term_offsets[t + 1]].
+    """
+
+    __slots__ = ("doc", "passage_starts", "passage_ends", "passage_len", "avg_len",
+                 "term_ids", "term_offsets", "post_passage", "post_tf", "_embeddings")
+
+    def __init__(self, doc: DocumentIndex):
+        self.doc = doc
+        self._embeddings = None
+        self._build_postings(self._build_passages())
+
+    @classmethod
+    def for_text(cls, text: str) -> "RetrievalIndex":
+        return _cached_index(text)
+
+    def _build_passages(self) -> np.ndarray:
+        # returns the passage number of every sentence
+        doc = self.doc
+        words = np.diff(doc.word_offsets).tolist()
+        paras = doc.sent_para.tolist()
+        first_sents, last_sents = [], []
+        start, size = 0, 0
+        for i in range(doc.n_sentences):
+            if size and (size >= PASSAGE_WORDS or (paras[i] != paras[i - 1] and size >= MIN_PASSAGE_WORDS)):
+                first_sents.append(start)
+                last_sents.append(i - 1)
+                start, size = i, 0
+            size += words[i]
+        if doc.n_sentences:
+            first_sents.append(start)
+            last_sents.append(doc.n_sentences - 1)
+        self.passage_starts = doc.sent_starts[first_sents] if first_sents else np.zeros(0, dtype=np.int32)
+        self.passage_ends = doc.sent_ends[last_sents] if last_sents else np.zeros(0, dtype=np.int32)
+        return np.repeat(
+            np.arange(len(first_sents), dtype=np.int64),
+            np.asarray(last_sents, dtype=np.int64) - np.asarray(first_sents, dtype=np.int64) + 1,
+        ) if first_sents else np.zeros(0, dtype=np.int64)
+
+    def _build_postings(self, sentence_passage: np.ndarray) -> None:
+        doc = self.doc
+        n_terms = max(len(doc.vocab), 1)
+        n_passages = max(self.n_passages, 1)
+        keep = ~doc.is_stop[doc.word_ids]
+        terms = doc.word_ids[keep].astype(np.int64)
+        passages = sentence_passage[doc.word_sents[keep]]
+        self.passage_len = np.bincount(passages, minlength=self.n_passages).astype(np.float64)
+        self.avg_len = float(self.passage_len.mean()) if self.n_passages else 0.0
+        pairs, tf = np.unique(terms * n_passages + passages, return_counts=True)
+        self.post_passage = (pairs % n_passages).astype(np.int32)
+        self.post_tf = tf.astype(np.float64)
+        self.term_offsets = np.searchsorted(pairs // n_passages, np.arange(n_terms + 1))
+        self.term_ids = {t: i for i, t in enumerate(doc.vocab)}
+
+    @property
+    def n_passages(self) -> int:
+        return len(self.passage_starts)
+
+    def passage(self, i: int) -> str:
+        return self.doc.text[self.passage_starts[i]:self.passage_ends[i]]
+
+    def bm25(self, query: str) -> np.ndarray:
+        """
+        BM25 score of every passage for `query`.
+        """
+        scores = np.zeros(self.n_passages)
+        n = self.n_passages
+        ids = {self.term_ids.get(w) for w in _WORD.findall(query.lower())}
+        ids.discard(None)
+        for t in ids:
+            a, b = self.term_offsets[t], self.term_offsets[t + 1]
+            if a == b:
+                continue  # stopword: not indexed
+            passages, tf = self.post_passage[a:b], self.post_tf[a:b]
+            idf = np.log(1.0 + (n - (b - a) + 0.5) / ((b - a) + 0.5))
+            norm = _K1 * (1.0 - _B + _B * self.passage_len[passages] / (self.avg_len or 1.0))
+            scores[passages] += idf * tf * (_K1 + 1.0) / (tf + norm)
+        return scores
+
+    def _embedding_scores(self, query: str) -> Optional[np.ndarray]:
+        model = _embedder()
+        if model is None or not self.n_passages:
+            return None
+        if self._embeddings is None:
+            texts = [self.passage(i) for i in range(self.n_passages)]
+            self._embeddings = np.asarray(model.encode(texts, normalize_embeddings=True))
+        q = np.asarray(model.encode([query], normalize_embeddings=True))[0]
+        return self._embeddings @ q
+
+    def search(self, query: str, k: int = 5) -> List[int]:
+        """
+        Indices of the `k` passages most relevant to `query`, best first.
+        Passages sharing no term with the query are left out unless
+        embeddings are enabled.
+        """
+        if not self.n_passages or k <= 0:
+            return []
+        lexical = self.bm25(query)
+        dense = self._embedding_scores(query)
+        if dense is None:
+            ranked = np.argsort(-lexical, kind="stable")[:k]
+            return [int(i) for i in ranked if lexical[i] > 0]
+        # reciprocal rank fusion of the two rankings
+        fused = np.zeros(self.n_passages)
+        for scores in (lexical, dense):
+            ranks = np.empty(self.n_passages)
+            ranks[np.argsort(-scores, kind="stable")] = np.arange(self.n_passages)
+            fused += 1.0 / (_RRF_K + ranks + 1)
+        return np.argsort(-fused, kind="stable")[:k].tolist()
+
+
+@lru_cache(maxsize=8)
+def _cached_index(text: str) -> RetrievalIndex:
+    return RetrievalIndex(DocumentIndex.for_text(text))
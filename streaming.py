@@ -0,0 +1,140 @@
+# streaming.py
+"""
+Incremental parser for a streamed JSON object.
+
+The study-pack reply is one JSON object whose values are strings or arrays
+(summary, bullets, faqs, mcqs, ...). JSONItemStream is fed the reply piece
+by piece as tokens arrive and reports each top-level value, and each element
+of a top-level array, the moment its closing quote/brace is seen, so the UI
+can show the first bullet long before the model has finished the MCQs.
+
+Anything before the first "{" (e.g. a ```json fence) is skipped.
+"""
+import json
+from typing import Iterator, List, Optional, Tuple
+
+# Event kinds
+VALUE = "value"   # a complete top-level value: (VALUE, key, value)
+ITEM = "item"     # one element of a top-level array: (ITEM, key, element)
+
+Event = Tuple[str, str, object]
+
+
+class JSONItemStream:
+    """
+    Character-level scanner that tracks nesting, strings and the current
+    top-level key. Elements are decoded with json.loads once complete;
+    malformed ones are skipped rather than aborting the stream.
+    """
+
+    def __init__(self):
+        self._pos = 0                 # absolute offset of the next char to scan
+        self._stack: List[str] = []   # open containers: "{" / "["
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self.done = False
+        self._expect_key = False
+        self._key: Optional[str] = None
+        self._start: Optional[int] = None   # offset where the pending value/element began
+        self._text = ""
+
+    def feed(self, chunk: str) -> Iterator[Event]:
+        """
+        Consume the next piece of the reply and yield any events it completes.
+        """
+        if self.done or not chunk:
+            return
+        self._text += chunk
+        text = self._text
+        while self._pos < len(text) and not self.done:
+            i = self._pos
+            ch = text[i]
+            self._pos += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    event = self._string_closed(i + 1)
+                    if event:
+                        yield event
+                continue
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._stack.append("{")
+                    self._expect_key = True
+                continue
+
+            depth = len(self._stack)
+            in_top_array = depth == 2 and self._stack[1] == "["
+            if ch == '"':
+                self._in_string = True
+                if depth == 1 or (in_top_array and self._start is None):
+                    self._start = i
+            elif ch in "{[":
+                # a "[" directly under a key is the array itself, not a value we report
+                if (depth == 1 and ch == "{") or in_top_array:
+                    self._start = i
+                self._stack.append(ch)
+            elif ch in "}]":
+                if depth == 1:
+                    event = self._finish(i, VALUE)     # bare literal before the final "}"
+                    if event:
+                        yield event
+                    self.done = True
+                    return
+                closed = self._stack.pop()
+                if depth == 2:
+                    if closed == "[":
+                        event = self._finish(i, ITEM)  # bare literal before "]"
+                    else:
+                        event = self._finish(i + 1, VALUE)
+                elif depth == 3 and self._stack[1] == "[":
+                    event = self._finish(i + 1, ITEM)
+                else:
+                    event = None
+                if event:
+                    yield event
+            elif ch == ":" and depth == 1:
+                self._expect_key = False
+            elif ch == ",":
+                event = None
+                if depth == 1:
+                    event = self._finish(i, VALUE)
+                    self._expect_key = True
+                elif in_top_array:
+                    event = self._finish(i, ITEM)
+                if event:
+                    yield event
+            elif not ch.isspace() and self._start is None:
+                # start of a number / true / false / null
+                if (depth == 1 and not self._expect_key) or in_top_array:
+                    self._start = i
+
+    def _string_closed(self, end: int) -> Optional[Event]:
+        depth = len(self._stack)
+        if depth == 1 and self._expect_key:
+            start, self._start = self._start, None
+            try:
+                self._key = json.loads(self._text[start:end])
+            except (TypeError, ValueError):
+                self._key = None
+            return None
+        if depth == 1:
+            return self._finish(end, VALUE)
+        if depth == 2 and self._stack[1] == "[":
+            return self._finish(end, ITEM)
+        return None
+
+    def _finish(self, end: int, kind: str) -> Optional[Event]:
+        start, self._start = self._start, None
+        if start is None or self._key is None:
+            return None
+        try:
+            return kind, self._key, json.loads(self._text[start:end])
+        except ValueError:
+            return None
@@ -3,37 +3,38 @@ import os
 import json
 import textwrap
 from typing import Dict, List
-from openai import OpenAI
-import openai
 import re
 
-OPENAI_KEY = os.getenv("OPENAI_API_KEY", None)
+import tracing
+import backends
+from chunking import condense_text, chunk_summary_prompt
+from extractive import select_sentences
+from retrieval import RetrievalIndex
 
-# helper simple local summarizer if API key not present
+# passages sent with each question
+QA_PASSAGES = int(os.environ.get("NOTES_QA_PASSAGES", 5))
+
+# helper simple local summarizer if no generation backend is available
+@tracing.traced("fallback.summary")
 def local_summarize(text: str, max_sentences: int = 6) -> str:
-    # naive heuristic: split into sentences and pick the longest ones
-    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
-    sentences = [s.strip() for s in sentences if len(s.strip()) > 30]
-    sentences_sorted = sorted(sentences, key=lambda s: len(s), reverse=True)
-    top = sentences_sorted[:max_sentences]
-    return " ".join(top)
+    # extractive: TF-IDF centrality + MMR, see extractive.py
+    return " ".join(select_sentences(text.strip(), max_sentences, min_chars=30))
 
 def call_openai_chat(prompt: str, model: str = "gpt-4o-mini", max_tokens: int = 1200) -> str:
-    if not OPENAI_KEY:
-        raise RuntimeError("OPENAI_API_KEY not set")
-    # use OpenAI python client
-    openai.api_key = OPENAI_KEY
-    resp = openai.ChatCompletion.create(
-        model=model,
-        messages=[
+    if backends.get_backend() is None:
+        raise RuntimeError("no generation backend (set OPENAI_API_KEY or NOTES_LOCAL_MODEL)")
+    # OpenAI (shared client: cache, retries with backoff, rate limits, deadline) or the local model
+    return backends.chat(
+        [
             {"role": "system", "content": "You are a helpful assistant that turns article text into study materials."},
             {"role": "user", "content": prompt}
         ],
+        model=model,
         max_tokens=max_tokens,
         temperature=0.2,
     )
-    return resp.choices[0].message.content.strip()
 
+@tracing.traced("generate.pack")
 def generate_notes_pack(text: str, title: str = "Document", model: str = "gpt-4o-mini", max_tokens: int = 1200) -> Dict:
     """
     Returns a dict with:
@@ -46,8 +47,11 @@ def generate_notes_pack(text: str, title: str = "Document", model: str = "gpt-4o
     - flashcards (list of {front, back})
     - raw_text (original raw)
     """
+    # index passages now so follow-up questions (answer_question_about_doc) are cheap
+    RetrievalIndex.for_text(text)
+
     # Short-circuit fallback
-    if not OPENAI_KEY:
+    if backends.get_backend() is None:
         summary = local_summarize(text, max_sentences=6)
         bullets = [summary]
         return {
@@ -61,10 +65,13 @@ def generate_notes_pack(text: str, title: str = "Document", model: str = "gpt-4o
             "raw_text": text
         }
 
-    # Prepare prompt carefully. We chunk text if huge.
-    MAX_CHUNK = 20000  # characters per chunk
-    chunks = [text[i:i+MAX_CHUNK] for i in range(0, len(text), MAX_CHUNK)]
-    joined_chunks_preview = "\n\n[CHUNK 1 PREVIEW]\n" + (chunks[0][:4096] if chunks else "")
+    # Prepare prompt carefully. Long text is condensed chunk by chunk (map-reduce)
+    # so the whole document is represented, not just its opening. The map step
+    # sends the shared chunk messages as they are, so it reuses utils' cache entries.
+    content = condense_text(
+        text,
+        lambda chunk: backends.chat(chunk_summary_prompt(chunk), model=model, max_tokens=400),
+    )
 
     prompt = f"""
 You are an expert educational assistant. Given the article title: "{title}" and the article content (below), produce a JSON object with the following keys:
@@ -77,7 +84,7 @@ You are an expert educational assistant. Given the article title: "{title}" and
 - flashcards: 8 flashcards with front/back text.
 Return ONLY valid JSON. Do not include commentary. The content follows below:
 ----
-{joined_chunks_preview}
+{content}
 ----
 If the article is long, prioritize the main ideas and educational value. Keep answers short and precise.
 """
@@ -108,37 +115,34 @@ If the article is long, prioritize the main ideas and educational value. Keep an
     return data
 
 def answer_question_about_doc(question: str, doc_text: str, model: str = "gpt-4o-mini", max_tokens: int = 600) -> str:
-    if not OPENAI_KEY:
-        # simple local search-based answer: find sentences that contain keywords
-        import re
-        keywords = [w for w in re.findall(r'\w+', question.lower()) if len(w) > 3][:6]
-        matches = []
-        for kw in keywords:
-            idx = doc_text.lower().find(kw)
-            if idx != -1:
-                start = max(0, idx-200)
-                matches.append(doc_text[start:start+400])
-        if matches:
-            return "Found related passages:\n\n" + "\n\n---\n\n".join(matches[:3])
-        return "No API key — simple fallback cannot answer precisely. Generate notes first or set OPENAI_API_KEY."
-    # call to LLM with context
-    openai.api_key = OPENAI_KEY
+    # BM25 over the document's passages (built once per document, see retrieval.py)
+    index = RetrievalIndex.for_text(doc_text)
+    with tracing.span("retrieve", passages=index.n_passages) as span:
+        hits = index.search(question, k=QA_PASSAGES)
+        span.set(hits=len(hits))
+    if backends.get_backend() is None:
+        # simple local answer: the best-ranked passages
+        if hits:
+            return "Found related passages:\n\n" + "\n\n---\n\n".join(index.passage(i) for i in hits[:3])
+        return "No generation backend — simple fallback cannot answer precisely. Generate notes first or set OPENAI_API_KEY (or NOTES_LOCAL_MODEL)."
+    # call to LLM with only the relevant passages; with no keyword overlap, the opening ones
+    passages = hits or list(range(min(QA_PASSAGES, index.n_passages)))
+    context = "\n\n".join(f"[{n}] {index.passage(i)}" for n, i in enumerate(passages, 1))
     prompt = f"""
-You are an expert tutor. Use the provided document context to answer the question concisely. If the document does not contain the answer, say "Not stated in document."
+You are an expert tutor. Use the provided document passages to answer the question concisely. If the passages do not contain the answer, say "Not stated in document."
 
-Document (short excerpt or entirety):
-\"\"\"\n{doc_text[:30000]}\n\"\"\"
+Document passages (most relevant first):
+\"\"\"\n{context}\n\"\"\"
 
 Question: {question}
-Answer in 2-8 sentences, cite the part of the document if possible.
+Answer in 2-8 sentences, cite the passage numbers (e.g. [2]) if possible.
 """
-    resp = openai.ChatCompletion.create(
-        model=model,
-        messages=[
+    return backends.chat(
+        [
             {"role": "system", "content": "You are a helpful tutor."},
             {"role": "user", "content": prompt},
         ],
+        model=model,
         max_tokens=max_tokens,
         temperature=0.1,
     )
-    return resp.choices[0].message.content.strip()
@@ -0,0 +1,446 @@
+# tracing.py
+"""
+Lightweight tracing and metrics.
+
+A trace covers one unit of work (a job, a request) and is made of spans:
+fetch, parse, each LLM call, the fallbacks, PDF rendering. Spans carry
+attributes such as cache hits, retries, token counts and estimated cost.
+
+    with tracing.trace("job", trace_id=job_id, url=url):
+        with tracing.span("parse.trafilatura") as sp:
+            ...
+            sp.set(chars=len(text))
+
+The current trace/span live in contextvars, so nesting works without
+passing anything around; wrap callables handed to a thread pool with
+bind() so their spans land in the caller's trace. Spans opened with no
+trace active still feed the process-wide metrics.
+
+Exports:
+- recent traces in memory (get_trace / recent_traces), e.g. for the app's
+  debug waterfall (format_waterfall)
+- one JSON line per finished trace appended to NOTES_TRACE_LOG, if set
+- prometheus_text(): counters in the Prometheus text format, also served
+  by start_metrics_server(port)
+"""
+import os
+import json
+import time
+import uuid
+import threading
+import functools
+import contextvars
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+TRACE_LOG = os.environ.get("NOTES_TRACE_LOG")
+# finished traces kept in memory for the debug panel
+TRACE_KEEP = int(os.environ.get("NOTES_TRACE_KEEP", 200))
+
+# USD per 1K (prompt, completion) tokens; the longest matching model prefix wins.
+# Override or extend with NOTES_LLM_PRICES='{"model": [prompt, completion]}'.
+PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4": (0.03, 0.06),
+}
+PRICES.update({k: tuple(v) for k, v in json.loads(os.environ.get("NOTES_LLM_PRICES", "{}")).items()})
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """
+    One timed step. `start`/`end` are perf_counter values; `end` is None
+    while the span is open.
+    """
+
+    __slots__ = ("id", "name", "parent", "trace", "start", "end", "attrs")
+
+    def __init__(self, name: str, parent: Optional["Span"], trace: Optional["Trace"], attrs: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.parent = parent.id if parent else None
+        self.trace = trace
+        self.start = time.perf_counter()
+        self.end = None
+        self.attrs = dict(attrs)
+
+    def set(self, **attrs) -> "Span":
+        self.attrs.update(attrs)
+        return self
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if self.end is not None:
+            return
+        self.end = time.perf_counter()
+        if error is not None:
+            self.attrs["error"] = f"{type(error).__name__}: {error}"
+        _record_span(self)
+
+    def to_dict(self, t0: float) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "parent": self.parent,
+            "start_ms": round((self.start - t0) * 1000, 2),
+            "duration_ms": round(self.duration * 1000, 2),
+            "open": self.end is None,
+            "attrs": self.attrs,
+        }
+
+
+class Trace:
+    """
+    Spans of one unit of work, in the order they were opened.
+    """
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, attrs: Optional[Dict[str, Any]] = None):
+        self.id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.attrs = dict(attrs or {})
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.end = None
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def totals(self) -> Dict[str, Any]:
+        """
+        Token, cost, cache and retry totals over all spans so far.
+        """
+        out = {"prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+               "llm_calls": 0, "cache_hits": 0, "retries": 0, "errors": 0}
+        with self._lock:
+            spans = list(self.spans)
+        for sp in spans:
+            a = sp.attrs
+            out["prompt_tokens"] += a.get("prompt_tokens", 0)
+            out["completion_tokens"] += a.get("completion_tokens", 0)
+            out["cost_usd"] += a.get("cost_usd", 0.0)
+            out["llm_calls"] += sp.name == "llm"
+            out["cache_hits"] += a.get("cache") == "hit"
+            out["retries"] += a.get("retries", 0)
+            out["errors"] += "error" in a
+        out["cost_usd"] = round(out["cost_usd"], 6)
+        return out
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [sp.to_dict(self.t0) for sp in self.spans]
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started": self.started,
+            "duration_ms": round((end - self.t0) * 1000, 2),
+            "open": self.end is None,
+            "attrs": self.attrs,
+            "totals": self.totals(),
+            "spans": spans,
+        }
+
+
+################################################################################
+# Recording
+################################################################################
+_lock = threading.Lock()
+_traces: "OrderedDict[str, Trace]" = OrderedDict()
+_span_stats: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0, 0])   # count, seconds, errors
+_tokens: Dict[Tuple[str, str], int] = defaultdict(int)                   # (model, kind) -> tokens
+_cost: Dict[str, float] = defaultdict(float)                             # model -> USD
+_counters: Dict[Tuple[str, Tuple], float] = defaultdict(float)           # (name, labels) -> value
+_sources: List[Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]] = []
+_log_lock = threading.Lock()
+
+
+def _record_span(span: Span) -> None:
+    with _lock:
+        stats = _span_stats[span.name]
+        stats[0] += 1
+        stats[1] += span.duration
+        stats[2] += "error" in span.attrs
+
+
+@contextmanager
+def trace(name: str, trace_id: Optional[str] = None, **attrs):
+    """
+    Start a trace and make it current for the block. Finished traces are
+    kept in memory and, with NOTES_TRACE_LOG set, appended to that file.
+    """
+    tr = Trace(name, trace_id, attrs)
+    with _lock:
+        _traces[tr.id] = tr
+        _traces.move_to_end(tr.id)
+        while len(_traces) > TRACE_KEEP:
+            _traces.popitem(last=False)
+    trace_token = _current_trace.set(tr)
+    span_token = _current_span.set(None)
+    try:
+        yield tr
+    except BaseException as e:
+        tr.attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        tr.end = time.perf_counter()
+        if TRACE_LOG:
+            line = json.dumps(tr.to_dict(), default=str)
+            with _log_lock, open(TRACE_LOG, "a", encoding="utf-8") as fh:
+                fh.write(line + "\n")
+
+
+def start_span(name: str, **attrs) -> Span:
+    """
+    Open a span without making it current; call .finish() when done. For
+    work that outlives the opening block, e.g. a streamed response.
+    """
+    tr = _current_trace.get()
+    span = Span(name, _current_span.get(), tr, attrs)
+    if tr is not None:
+        tr.add(span)
+    return span
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time the block as a child of the current span.
+    """
+    sp = start_span(name, **attrs)
+    token = _current_span.set(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.finish(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        sp.finish()
+
+
+def traced(name: str):
+    """
+    Decorator: run the function inside span(name).
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def annotate(**attrs) -> None:
+    """
+    Set attributes on the current span, if there is one.
+    """
+    sp = _current_span.get()
+    if sp is not None:
+        sp.set(**attrs)
+
+
+def bind(fn: Callable) -> Callable:
+    """
+    Wrap `fn` so it runs in the caller's trace context when executed on
+    another thread (thread pools don't inherit contextvars).
+    """
+    ctx = contextvars.copy_context()
+
+    def bound(*args, **kwargs):
+        # a Context can only be entered by one thread at a time
+        return ctx.copy().run(fn, *args, **kwargs)
+    return bound
+
+
+def count(name: str, value: float = 1, **labels) -> None:
+    """
+    Add to a free-form counter exported as notes_<name>_total.
+    """
+    with _lock:
+        _counters[(name, tuple(sorted(labels.items())))] += value
+
+
+################################################################################
+# LLM usage
+################################################################################
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    matches = [m for m in PRICES if model.startswith(m)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = PRICES[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000.0
+
+
+def record_llm_usage(span: Optional[Span], model: str, messages, reply: str, usage=None) -> None:
+    """
+    Put token counts and cost on `span` and the global counters. Uses the
+    API's `usage` when given (dict or object), else estimates from the text.
+    """
+    prompt_tokens = completion_tokens = None
+    if usage is not None:
+        get = usage.get if isinstance(usage, dict) else (lambda k: getattr(usage, k, None))
+        prompt_tokens, completion_tokens = get("prompt_tokens"), get("completion_tokens")
+    estimated = prompt_tokens is None or completion_tokens is None
+    if estimated:
+        from chunking import count_tokens
+        if isinstance(messages, str):
+            prompt_text = messages
+        else:
+            prompt_text = "\n".join(str(m.get("content", "")) for m in messages)
+        prompt_tokens = count_tokens(prompt_text)
+        completion_tokens = count_tokens(reply or "")
+    cost = estimate_cost(model, prompt_tokens, completion_tokens)
+    if span is not None:
+        span.set(model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                 cost_usd=round(cost, 6), tokens_estimated=estimated)
+    with _lock:
+        _tokens[(model, "prompt")] += prompt_tokens
+        _tokens[(model, "completion")] += completion_tokens
+        _cost[model] += cost
+
+
+################################################################################
+# Export
+################################################################################
+def get_trace(trace_id: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        tr = _traces.get(trace_id)
+    return tr.to_dict() if tr else None
+
+
+def recent_traces(limit: int = 20) -> List[Dict[str, Any]]:
+    with _lock:
+        traces = list(_traces.values())[-limit:]
+    return [tr.to_dict() for tr in reversed(traces)]
+
+
+def register_metrics(source: Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]) -> None:
+    """
+    Add a callable yielding (metric name, labels, value) samples that
+    prometheus_text() includes on every scrape (e.g. cache counters).
+    """
+    _sources.append(source)
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+def prometheus_text() -> str:
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    with _lock:
+        spans = {name: list(stats) for name, stats in _span_stats.items()}
+        tokens = dict(_tokens)
+        cost = dict(_cost)
+        counters = dict(_counters)
+    lines = [
+        "# TYPE notes_span_seconds summary",
+    ]
+    for name, (n, seconds, _) in sorted(spans.items()):
+        lines.append(f"notes_span_seconds_count{_labels({'span': name})} {n}")
+        lines.append(f"notes_span_seconds_sum{_labels({'span': name})} {seconds:.6f}")
+    lines.append("# TYPE notes_span_errors_total counter")
+    for name, (_, _, errors) in sorted(spans.items()):
+        lines.append(f"notes_span_errors_total{_labels({'span': name})} {errors}")
+    lines.append("# TYPE notes_llm_tokens_total counter")
+    for (model, kind), n in sorted(tokens.items()):
+        lines.append(f"notes_llm_tokens_total{_labels({'model': model, 'kind': kind})} {n}")
+    lines.append("# TYPE notes_llm_cost_usd_total counter")
+    for model, usd in sorted(cost.items()):
+        lines.append(f"notes_llm_cost_usd_total{_labels({'model': model})} {usd:.6f}")
+    for (name, labels), value in sorted(counters.items()):
+        lines.append(f"notes_{name}_total{_labels(dict(labels))} {value:g}")
+    for source in _sources:
+        try:
+            samples = list(source())
+        except Exception:
+            continue
+        for name, labels, value in samples:
+            lines.append(f"notes_{name}{_labels(labels)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve prometheus_text() at http://host:port/metrics on a daemon thread.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
+
+
+def format_waterfall(trace_dict: Dict[str, Any], width: int = 30) -> str:
+    """
+    Text waterfall of a trace (as returned by get_trace): one line per span,
+    indented by depth, with a bar showing when it ran.
+    """
+    spans = trace_dict["spans"]
+    total = max(trace_dict["duration_ms"], 1e-6)
+    depth: Dict[str, int] = {}
+    lines = []
+    for sp in spans:
+        d = depth[sp["id"]] = depth.get(sp["parent"], -1) + 1 if sp["parent"] else 0
+        begin = int(sp["start_ms"] / total * width)
+        length = max(1, int(round(sp["duration_ms"] / total * width)))
+        bar = (" " * begin + "█" * length)[:width].ljust(width)
+        label = ("  " * d + sp["name"])[:22]
+        notes = []
+        attrs = sp["attrs"]
+        if attrs.get("cache"):
+            notes.append(f"cache={attrs['cache']}")
+        if attrs.get("prompt_tokens") is not None:
+            notes.append(f"{attrs['prompt_tokens']}+{attrs.get('completion_tokens', 0)} tok")
+        if attrs.get("retries"):
+            notes.append(f"retries={attrs['retries']}")
+        if "error" in attrs:
+            notes.append("error")
+        if sp["open"]:
+            notes.append("…")
+        lines.append(f"{label:<22} |{bar}| {sp['duration_ms']:>8.0f}ms {' '.join(notes)}".rstrip())
+    return "\n".join(lines)
@@ -1,84 +1,76 @@
 # utils.py
 import os
-import trafilatura
-import requests
-from bs4 import BeautifulSoup
 from typing import List, Dict, Any
 import re
+import json
 import math
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-# Optional OpenAI
-try:
-    import openai
-    OPENAI_AVAILABLE = True
-except Exception:
-    OPENAI_AVAILABLE = False
+import numpy as np
+
+import tracing
+from extraction import extract_url
+from chunking import condense_text, chunk_summary_prompt
+from streaming import JSONItemStream
+
+# OpenAI (optional package) or a local model, see backends.py
+import backends
+from llm_client import LLM_CALL_TIMEOUT
 
 # Fallback summarizer
-try:
-    from gensim.summarization import summarize as gensim_summarize
-except Exception:
-    gensim_summarize = None
+from docindex import DocumentIndex
+from extractive import select_indices
+from distractors import DistractorIndex
 
 ################################################################################
 # Extraction
 ################################################################################
 def extract_text_from_url(url: str) -> str:
     """
-    Attempt to extract readable text from a URL using trafilatura first,
-    then fallback to requests + BeautifulSoup.
-    Returns long continuous text.
-    """
-    downloaded = trafilatura.fetch_url(url)
-    if downloaded:
-        txt = trafilatura.extract(downloaded, include_comments=False, include_tables=False, include_formatting=False)
-        if txt and len(txt.strip()) > 100:
-            return txt
-
-    # Fallback: simple requests + BeautifulSoup text extraction
-    r = requests.get(url, timeout=15, headers={"User-Agent": "Mozilla/5.0"})
-    r.raise_for_status()
-    soup = BeautifulSoup(r.text, "html.parser")
-
-    # Remove script/style
-    for tag in soup(["script", "style", "header", "footer", "nav", "aside", "form"]):
-        tag.decompose()
-
-    # Get visible text
-    texts = [t.strip() for t in soup.stripped_strings]
-    text = "\n".join(texts)
-    # Heuristic: if it's HTML of a PDF viewer or too noisy, return empty
-    if len(text) < 200:
-        return ""
-    return text
+    Download the page once through the shared fetch layer (cached and
+    revalidated with ETag/Last-Modified) and extract its text with the
+    extraction engine (extraction.py). Returns "" if nothing usable.
+    """
+    result = extract_url(url)
+    return result.text if result else ""
 
 ################################################################################
 # OpenAI helpers
 ################################################################################
-def _ensure_openai_api():
-    key = os.environ.get("OPENAI_API_KEY")
-    if not key:
-        raise RuntimeError("OPENAI_API_KEY not set.")
-    if OPENAI_AVAILABLE:
-        openai.api_key = key
-    else:
-        raise RuntimeError("openai package not installed in environment.")
-
-def _call_openai_chat(messages, max_tokens=800, temperature=0.2):
-    _ensure_openai_api()
-    # Use ChatCompletion (gpt-3.5-turbo or gpt-4 if available)
+def _call_openai_chat(messages, max_tokens=800, temperature=0.2, stream=False):
+    """
+    Returns the reply text, or with stream=True an iterator of text deltas
+    as the model produces them (a cached reply comes back as one piece).
+    Sent to the active generation backend (OpenAI or a local model); caching,
+    retries, rate limiting and deadlines live there.
+    """
+    # Use gpt-3.5-turbo unless OPENAI_MODEL says otherwise (ignored by the local model)
     model = os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")
-    resp = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        max_tokens=max_tokens,
-        temperature=float(os.environ.get("OPENAI_TEMP", 0.2))
-    )
-    return resp["choices"][0]["message"]["content"].strip()
+    temperature = float(os.environ.get("OPENAI_TEMP", 0.2))
+    # no timeout: each backend applies its own per-call deadline
+    return backends.chat(messages, model=model, max_tokens=max_tokens, temperature=temperature,
+                         stream=stream)
+
+# Tokens allowed for each chunk summary in the map step
+CHUNK_SUMMARY_TOKENS = int(os.environ.get("NOTES_CHUNK_SUMMARY_TOKENS", 400))
+
+def _summarize_chunk(chunk: str) -> str:
+    return _call_openai_chat(chunk_summary_prompt(chunk), max_tokens=CHUNK_SUMMARY_TOKENS)
+
+def _article_text(text: str) -> str:
+    """
+    Article body for a prompt: the text itself if it fits the input token
+    budget, otherwise a map-reduce condensation of the whole document.
+    Chunk summaries are cached, so repeated calls on one text are cheap.
+    """
+    return condense_text(text, _summarize_chunk)
 
 ################################################################################
 # Notes / summary generation
 ################################################################################
+@tracing.traced("generate.notes")
 def generate_notes_with_openai(text: str, bullets: int = 6, max_tokens: int = 600) -> Dict:
     prompt = [
         {"role":"system", "content": "You are a helpful assistant that makes concise study notes."},
@@ -88,7 +80,7 @@ def generate_notes_with_openai(text: str, bullets: int = 6, max_tokens: int = 60
             f"2) {bullets} bullet points listing the most important concepts (short lines).\n"
             "3) 2-3 key definitions (if present).\n\n"
             "Respond in JSON with keys: summary, bullets, definitions.\n\n"
-            "ARTICLE:\n\n" + text[:4000]  # truncate long input
+            "ARTICLE:\n\n" + _article_text(text)
         )}
     ]
     try:
@@ -110,13 +102,14 @@ def generate_notes_with_openai(text: str, bullets: int = 6, max_tokens: int = 60
         # in case of failure, fallback to simpler generator
         return generate_notes_fallback(text, bullets=bullets)
 
+@tracing.traced("generate.faqs")
 def generate_faqs_with_openai(text: str, count: int = 5, max_tokens: int = 600) -> List[Dict[str,str]]:
     prompt = [
         {"role":"system", "content":"You are a helpful assistant that produces FAQs from text."},
         {"role":"user", "content": (
             f"Read the article below and produce {count} frequently asked questions and concise answers. "
             "Return JSON array of objects with keys 'q' and 'a'.\n\n"
-            "ARTICLE:\n\n" + text[:4000]
+            "ARTICLE:\n\n" + _article_text(text)
         )}
     ]
     try:
@@ -139,6 +132,7 @@ def generate_faqs_with_openai(text: str, count: int = 5, max_tokens: int = 600)
     except Exception:
         return generate_faqs_fallback(text, count=count)
 
+@tracing.traced("generate.mcqs")
 def generate_mcqs_with_openai(text: str, count: int = 5, max_tokens: int = 600) -> List[Dict[str, Any]]:
     prompt = [
         {"role":"system", "content":"You are a helpful assistant that generates multiple-choice questions for studying."},
@@ -146,7 +140,7 @@ def generate_mcqs_with_openai(text: str, count: int = 5, max_tokens: int = 600)
             f"From the following article, generate {count} multiple-choice questions (4 options each). "
             "Return JSON array of objects with keys: question, options (array of 4), answer (the correct option text). "
             "Avoid very ambiguous questions.\n\n"
-            "ARTICLE:\n\n" + text[:4000]
+            "ARTICLE:\n\n" + _article_text(text)
         )}
     ]
     try:
@@ -160,94 +154,363 @@ def generate_mcqs_with_openai(text: str, count: int = 5, max_tokens: int = 600)
     except Exception:
         return generate_mcqs_fallback(text, count=count)
 
+################################################################################
+# Concurrent generation
+################################################################################
+# Shared across sessions so each rerun doesn't spin up its own threads
+_GENERATION_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("OPENAI_MAX_WORKERS", 8)),
+    thread_name_prefix="llm",
+)
+
+def iter_generated_sections(text: str, bullets: int = 6, faq_count: int = 5, mcq_count: int = 5,
+                            max_tokens: int = 600, timeout: float = LLM_CALL_TIMEOUT, sections=None):
+    """
+    Send the notes, FAQ and MCQ requests at once and yield (section, result)
+    pairs in the order they finish. A call that fails or is still running
+    after `timeout` seconds is answered by its fallback generator instead,
+    so one slow request never holds up the other sections.
+    `sections` limits the run to a subset of "notes", "faqs", "mcqs".
+    """
+    calls = {
+        "notes": (lambda: generate_notes_with_openai(text, bullets=bullets, max_tokens=max_tokens),
+                  lambda: generate_notes_fallback(text, bullets=bullets)),
+        "faqs": (lambda: generate_faqs_with_openai(text, count=faq_count, max_tokens=max_tokens),
+                 lambda: generate_faqs_fallback(text, count=faq_count)),
+        "mcqs": (lambda: generate_mcqs_with_openai(text, count=mcq_count, max_tokens=max_tokens),
+                 lambda: generate_mcqs_fallback(text, count=mcq_count)),
+    }
+    if sections is not None:
+        calls = {name: calls[name] for name in sections}
+    # condense once up front; the three requests then reuse the cached chunk summaries
+    _article_text(text)
+    futures = {_GENERATION_POOL.submit(tracing.bind(call)): name for name, (call, _) in calls.items()}
+    deadline = time.monotonic() + timeout
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                             return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for fut in done:
+            name = futures[fut]
+            try:
+                result = fut.result()
+            except Exception:
+                result = calls[name][1]()
+            yield name, result
+    # whatever is left ran past the deadline
+    for fut in pending:
+        fut.cancel()
+        name = futures[fut]
+        yield name, calls[name][1]()
+
+def generate_all_with_openai(text: str, bullets: int = 6, faq_count: int = 5, mcq_count: int = 5,
+                             max_tokens: int = 600, timeout: float = LLM_CALL_TIMEOUT) -> Dict[str, Any]:
+    """
+    Blocking helper around iter_generated_sections.
+    Returns {"notes": ..., "faqs": ..., "mcqs": ...}.
+    """
+    return dict(iter_generated_sections(text, bullets=bullets, faq_count=faq_count, mcq_count=mcq_count,
+                                        max_tokens=max_tokens, timeout=timeout))
+
+################################################################################
+# Single-call study pack
+################################################################################
+def _parse_json_block(out: str, opener: str = "{"):
+    """
+    Pull the first {...} (or [...]) block out of a model reply and load it.
+    Returns None when nothing parseable is found.
+    """
+    pattern = r"\{.*\}" if opener == "{" else r"\[.*\]"
+    m = re.search(pattern, out, flags=re.S)
+    if not m:
+        return None
+    try:
+        return json.loads(m.group(0))
+    except ValueError:
+        return None
+
+def _clean_notes(obj, bullets: int):
+    if not isinstance(obj, dict):
+        return None
+    summary = obj.get("summary")
+    bullets_list = obj.get("bullets")
+    if not isinstance(summary, str) or not summary.strip():
+        return None
+    if not isinstance(bullets_list, list):
+        return None
+    bullets_list = [b.strip() for b in bullets_list if isinstance(b, str) and b.strip()]
+    if not bullets_list:
+        return None
+    definitions = obj.get("definitions")
+    return {
+        "summary": summary.strip(),
+        "bullets": bullets_list[:bullets],
+        "definitions": definitions if isinstance(definitions, list) else [],
+    }
+
+def _clean_faqs(obj, count: int):
+    # nothing was asked for, so there is nothing to re-request
+    if count <= 0:
+        return []
+    if not isinstance(obj, list):
+        return None
+    faqs = [
+        {"q": qa["q"].strip(), "a": qa["a"].strip()}
+        for qa in obj
+        if isinstance(qa, dict) and isinstance(qa.get("q"), str) and isinstance(qa.get("a"), str)
+        and qa["q"].strip() and qa["a"].strip()
+    ]
+    return faqs[:count] or None
+
+def _clean_mcqs(obj, count: int):
+    if count <= 0:
+        return []
+    if not isinstance(obj, list):
+        return None
+    mcqs = []
+    for mcq in obj:
+        if not isinstance(mcq, dict):
+            continue
+        question, options, answer = mcq.get("question"), mcq.get("options"), mcq.get("answer")
+        if not isinstance(question, str) or not isinstance(answer, str):
+            continue
+        if not isinstance(options, list) or len(options) != 4 or not all(isinstance(o, str) for o in options):
+            continue
+        if answer not in options:
+            continue
+        mcqs.append({"question": question.strip(), "options": options, "answer": answer})
+    return mcqs[:count] or None
+
+def _study_pack_prompt(text: str, bullets: int, faq_count: int, mcq_count: int):
+    return [
+        {"role":"system", "content": "You are a helpful assistant that makes concise study material."},
+        {"role":"user", "content": (
+            "Given the following article/text, return ONE JSON object with keys:\n"
+            "- summary: a 2-3 sentence concise summary.\n"
+            f"- bullets: array of {bullets} short bullet points listing the most important concepts.\n"
+            "- definitions: array of 2-3 key definitions (if present).\n"
+            f"- faqs: array of {faq_count} objects with keys 'q' and 'a' (concise answers).\n"
+            f"- mcqs: array of {mcq_count} objects with keys question, options (array of 4), "
+            "answer (the correct option text). Avoid very ambiguous questions.\n"
+            "Return ONLY valid JSON.\n\n"
+            "ARTICLE:\n\n" + _article_text(text)
+        )}
+    ]
+
+def _clean_pack(data, bullets: int, faq_count: int, mcq_count: int) -> Dict[str, Any]:
+    pack = {"notes": None, "faqs": None, "mcqs": None}
+    if isinstance(data, dict):
+        pack["notes"] = _clean_notes(data, bullets)
+        pack["faqs"] = _clean_faqs(data.get("faqs"), faq_count)
+        pack["mcqs"] = _clean_mcqs(data.get("mcqs"), mcq_count)
+    return pack
+
+def request_study_pack_with_openai(text: str, bullets: int = 6, faq_count: int = 5, mcq_count: int = 5,
+                                   max_tokens: int = 600) -> Dict[str, Any]:
+    """
+    Ask for notes, FAQs and MCQs in a single request. `max_tokens` is the
+    per-section budget, matching the other generators.
+    Returns {"notes": ..., "faqs": ..., "mcqs": ...} where a section is None
+    if the model left it out or it failed validation.
+    """
+    prompt = _study_pack_prompt(text, bullets, faq_count, mcq_count)
+    try:
+        data = _parse_json_block(_call_openai_chat(prompt, max_tokens=max_tokens * 3))
+    except Exception:
+        data = None
+    return _clean_pack(data, bullets, faq_count, mcq_count)
+
+def iter_study_pack_sections(text: str, bullets: int = 6, faq_count: int = 5, mcq_count: int = 5,
+                             max_tokens: int = 600, timeout: float = LLM_CALL_TIMEOUT):
+    """
+    Yield (section, result) pairs from one study-pack request. Sections the
+    model got wrong are re-requested individually (concurrently), so only
+    the broken part of the pack costs a second call.
+    """
+    pack = request_study_pack_with_openai(text, bullets=bullets, faq_count=faq_count,
+                                          mcq_count=mcq_count, max_tokens=max_tokens)
+    missing = [name for name, result in pack.items() if result is None]
+    _record_retries(missing)
+    for name, result in pack.items():
+        if result is not None:
+            yield name, result
+    if missing:
+        yield from iter_generated_sections(text, bullets=bullets, faq_count=faq_count, mcq_count=mcq_count,
+                                           max_tokens=max_tokens, timeout=timeout,
+                                           sections=missing)
+
+def iter_study_pack_stream(text: str, bullets: int = 6, faq_count: int = 5, mcq_count: int = 5,
+                           max_tokens: int = 600, timeout: float = LLM_CALL_TIMEOUT):
+    """
+    Streaming variant of iter_study_pack_sections. Yields
+    ("item", key, value) for every summary/bullet/FAQ/MCQ as soon as the
+    model finishes writing it (key is "summary", "bullets", "faqs" or
+    "mcqs"), then ("section", name, result) with the validated final
+    notes/faqs/mcqs, re-requesting any section that came back broken.
+    """
+    prompt = _study_pack_prompt(text, bullets, faq_count, mcq_count)
+    parser = JSONItemStream()
+    parts = []
+    counts = {"bullets": bullets, "faqs": faq_count, "mcqs": mcq_count}
+    seen = {"bullets": 0, "faqs": 0, "mcqs": 0}
+    stream = None
+    try:
+        stream = _call_openai_chat(prompt, max_tokens=max_tokens * 3, stream=True)
+        for delta in stream:
+            parts.append(delta)
+            for kind, key, value in parser.feed(delta):
+                if kind == "value" and key == "summary" and isinstance(value, str) and value.strip():
+                    yield "item", "summary", value.strip()
+                elif kind == "item" and key in seen and seen[key] < counts[key]:
+                    item = _clean_stream_item(key, value)
+                    if item is not None:
+                        seen[key] += 1
+                        yield "item", key, item
+    except Exception:
+        pass
+    finally:
+        # a pack abandoned mid-stream (client gone, job cancelled) gives back
+        # its limiter slot and connection now rather than at garbage collection
+        if hasattr(stream, "close"):
+            stream.close()
+    pack = _clean_pack(_parse_json_block("".join(parts)), bullets, faq_count, mcq_count)
+    missing = [name for name, result in pack.items() if result is None]
+    _record_retries(missing)
+    for name, result in pack.items():
+        if result is not None:
+            yield "section", name, result
+    if missing:
+        for name, result in iter_generated_sections(text, bullets=bullets, faq_count=faq_count,
+                                                    mcq_count=mcq_count, max_tokens=max_tokens,
+                                                    timeout=timeout, sections=missing):
+            yield "section", name, result
+
+def _record_retries(missing):
+    # sections of a study pack that have to be asked for again
+    if missing:
+        with tracing.span("study_pack.retry", retries=len(missing), sections=",".join(missing)):
+            pass
+        tracing.count("study_pack_retries", len(missing))
+
+def _clean_stream_item(key: str, value):
+    if key == "bullets":
+        return value.strip() if isinstance(value, str) and value.strip() else None
+    if key == "faqs":
+        cleaned = _clean_faqs([value], 1)
+    else:
+        cleaned = _clean_mcqs([value], 1)
+    return cleaned[0] if cleaned else None
+
+def generate_study_pack_with_openai(text: str, bullets: int = 6, faq_count: int = 5, mcq_count: int = 5,
+                                    max_tokens: int = 600, timeout: float = LLM_CALL_TIMEOUT) -> Dict[str, Any]:
+    """
+    Blocking helper around iter_study_pack_sections.
+    Returns {"notes": ..., "faqs": ..., "mcqs": ...}.
+    """
+    return dict(iter_study_pack_sections(text, bullets=bullets, faq_count=faq_count, mcq_count=mcq_count,
+                                         max_tokens=max_tokens, timeout=timeout))
+
+def iter_note_sections(text: str, bullets: int = 6, faq_count: int = 5, mcq_count: int = 5,
+                       max_tokens: int = 600, use_openai: bool = None, single_request: bool = True):
+    """
+    Pick the generation path for one document and yield (section, result)
+    pairs: the study-pack request, three concurrent requests, or the local
+    fallbacks when no generation backend is available.
+    """
+    if use_openai is None:
+        use_openai = backends.get_backend() is not None
+    if use_openai and single_request:
+        return iter_study_pack_sections(text, bullets=bullets, faq_count=faq_count,
+                                        mcq_count=mcq_count, max_tokens=max_tokens)
+    if use_openai:
+        return iter_generated_sections(text, bullets=bullets, faq_count=faq_count,
+                                       mcq_count=mcq_count, max_tokens=max_tokens)
+    return iter([
+        ("notes", generate_notes_fallback(text, bullets=bullets)),
+        ("faqs", generate_faqs_fallback(text, count=faq_count)),
+        ("mcqs", generate_mcqs_fallback(text, count=mcq_count)),
+    ])
+
 ################################################################################
 # Fallback methods (no OpenAI)
 ################################################################################
+def _summary_length(n_sentences: int, ratio: float) -> int:
+    return max(2, min(5, round(n_sentences * ratio)))
+
 def _short_summary(text: str, ratio=0.05):
-    if gensim_summarize:
-        try:
-            s = gensim_summarize(text, ratio=ratio)
-            if s and len(s.strip())>20:
-                return s
-        except Exception:
-            pass
-    # fallback: take first 3 paragraphs or first 3 sentences
-    paragraphs = [p for p in text.split("\n\n") if len(p.strip())>30]
-    if paragraphs:
-        head = paragraphs[0]
-        sentences = re.split(r'(?<=[.!?])\s+', head)
-        return " ".join(sentences[:3])
-    return text[:500] + "..."
+    # extractive: most central, non-redundant sentences in document order
+    index = DocumentIndex.for_text(text)
+    if not index.n_sentences:
+        return text[:500] + "..."
+    picks = select_indices(index, _summary_length(index.n_sentences, ratio))
+    return " ".join(index.sentence(i) for i in sorted(picks))
 
 def split_sentences(text):
-    sents = re.split(r'(?<=[.!?])\s+', text)
-    return [s.strip() for s in sents if len(s.strip())>20]
+    return DocumentIndex.for_text(text).sentences()
 
+@tracing.traced("fallback.notes")
 def generate_notes_fallback(text: str, bullets: int = 6) -> Dict:
-    summary = _short_summary(text, ratio=0.06)
-    # pick top N sentences as bullets (heuristic: use first N sentences from first 2 paragraphs)
-    paragraphs = [p for p in text.split("\n\n") if len(p.strip())>40]
-    bullets_list = []
-    if paragraphs:
-        candidate = " ".join(paragraphs[:2])
-        sents = split_sentences(candidate)
-        for s in sents:
-            if len(bullets_list) >= bullets:
-                break
-            bullets_list.append(s.strip())
+    index = DocumentIndex.for_text(text)
+    if not index.n_sentences:
+        return {"summary": text[:500] + "...", "bullets": [], "definitions": []}
+    # one ranking for both: the best few sentences form the summary, the next ones the bullets
+    k = _summary_length(index.n_sentences, 0.06)
+    picks = select_indices(index, k + bullets)
+    summary = " ".join(index.sentence(i) for i in sorted(picks[:k]))
+    bullets_list = [index.sentence(i) for i in sorted(picks[k:] or picks)][:bullets]
     # trim bullets length
     bullets_list = [b if len(b) < 200 else b[:200] + "..." for b in bullets_list]
     return {"summary": summary, "bullets": bullets_list, "definitions": []}
 
+@tracing.traced("fallback.faqs")
 def generate_faqs_fallback(text: str, count: int = 5) -> List[Dict[str,str]]:
     # Create simple FAQs by picking top sentences and turning them into Q/A
-    sents = split_sentences(text)
+    index = DocumentIndex.for_text(text)
     faqs = []
-    for i in range(min(count, len(sents)//2)):
-        q = sents[i]
-        a = sents[i+1] if i+1 < len(sents) else q
+    for i in range(min(count, index.n_sentences//2)):
+        q = index.sentence(i)
+        a = index.sentence(i+1) if i+1 < index.n_sentences else q
         # Make q concise
         if len(q) > 150:
             q = q[:140] + "..."
         faqs.append({"q": f"What is meant by: {q}", "a": a})
     return faqs
 
+def _match_case(word: str, like: str) -> str:
+    return word.capitalize() if like[:1].isupper() else word
+
+@tracing.traced("fallback.mcqs")
 def generate_mcqs_fallback(text: str, count: int = 5) -> List[Dict]:
-    sents = split_sentences(text)
+    index = DocumentIndex.for_text(text)
+    engine = DistractorIndex.for_index(index)
+    n = index.n_sentences
     mcqs = []
     i = 0
-    while len(mcqs) < count and i < len(sents):
-        sent = sents[i]
-        # find a noun-ish word to mask (simple heuristic: longest word >4 chars)
-        words = re.findall(r"\w+", sent)
-        candidate = None
-        for w in sorted(words, key=lambda x: -len(x)):
-            if len(w) > 4 and not w.isdigit():
-                candidate = w
-                break
-        if not candidate:
+    while len(mcqs) < count and i < n:
+        # find a noun-ish word to mask (simple heuristic: longest content word >4 chars)
+        ids = index.sentence_terms(i)
+        ids = ids[index.is_keyword[ids]]
+        if not ids.size:
             i += 1
             continue
-        question = sent.replace(candidate, "_____")
-        # options: correct and 3 close distractors from other sentences (or permuted substrings)
+        term = int(ids[np.argmax(index.term_len[ids])])
+        sent = index.sentence(i)
+        pattern = re.compile(r"\b%s\b" % re.escape(index.vocab[term]), flags=re.I)
+        m = pattern.search(sent)
+        candidate = m.group(0) if m else index.vocab[term]
+        question = pattern.sub("_____", sent)
+        # options: correct and 3 distractors that look like it and share its context
         options = [candidate]
-        # pick distractors
-        distractors = []
-        j = i+1
-        while len(distractors) < 3 and j < len(sents):
-            ws = re.findall(r"\w+", sents[j])
-            for w in ws:
-                if len(w) > 4 and w.lower() != candidate.lower() and w not in distractors:
-                    distractors.append(w)
-                    if len(distractors) >= 3:
-                        break
-            j += 1
-        # if insufficient distractors, create variants
-        while len(distractors) < 3:
-            distractors.append(candidate[::-1][:6])  # silly filler
+        distractors = [_match_case(index.vocab[t], candidate) for t in engine.pick(term, 3)]
+        # very short texts may not have enough keywords
+        for word in ("None of these", "All of these", "Not stated"):
+            if len(distractors) >= 3:
+                break
+            distractors.append(word)
         options.extend(distractors[:3])
         # shuffle options
-        import random
         random.shuffle(options)
         mcqs.append({"question": question, "options": options, "answer": candidate})
         i += 2
@@ -0,0 +1,128 @@
+# warmup.py
+"""
+Load the expensive parts of the app before the first user needs them.
+
+Heavy modules (openai, trafilatura, lxml, reportlab, numpy) are imported
+lazily so the Streamlit script starts fast; whoever touches them first pays
+for the import. warm() pays that up front: it imports them, builds the
+process-wide singletons (HTTP session, OpenAI client or local model,
+PDF fonts and styles, embedding model) and runs the fallback generators once on a
+small text so their code paths and regexes are hot.
+
+- app.py and api.py call start() once per server process; the work runs
+  on a background thread so the first request isn't delayed. This is also
+  where model weights (NOTES_LOCAL_MODEL, NOTES_EMBED_MODEL) are loaded:
+  they are only useful in the process that serves.
+- `python -m notes warmup` runs warm(models=False) at dyno boot (see
+  Procfile): it writes bytecode caches and pulls the libraries into the OS
+  page cache for the server that starts next, without loading weights the
+  exiting process would throw away.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Tuple
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+_SAMPLE = (
+    "Photosynthesis is the process plants use to turn light into chemical energy. "
+    "Chlorophyll in the chloroplasts absorbs mostly blue and red light. "
+    "The light reactions split water, releasing oxygen and producing ATP and NADPH.\n\n"
+    "The Calvin cycle then uses that ATP and NADPH to fix carbon dioxide into sugars. "
+    "Rubisco, the enzyme that captures carbon dioxide, is the most abundant protein on Earth. "
+    "Plants in hot climates use C4 or CAM pathways to limit water loss."
+)
+
+
+def _generation():
+    import utils
+    utils.generate_notes_fallback(_SAMPLE, bullets=3)
+    utils.generate_faqs_fallback(_SAMPLE, count=2)
+    utils.generate_mcqs_fallback(_SAMPLE, count=2)
+
+
+def _extraction():
+    import extraction
+    from fetch import FetchResult, get_session
+    get_session()
+    page = FetchResult(url="", status=200, html=f"<html><head><title>t</title></head><body><p>{_SAMPLE}</p></body></html>")
+    for name in extraction.HTML_BACKENDS:
+        extraction.extract(page, backends=[name])
+
+
+def _llm():
+    import llm_client
+    from chunking import count_tokens
+    count_tokens(_SAMPLE)
+    if llm_client.OPENAI_AVAILABLE:
+        llm_client._openai()
+        if os.environ.get("OPENAI_API_KEY"):
+            llm_client.get_client()
+
+
+def _pdf():
+    from pdf_utils import create_pdf_bytes
+    create_pdf_bytes("warmup", _SAMPLE, ["warmup"], [], [])
+
+
+def _retrieval():
+    import retrieval
+    retrieval.RetrievalIndex.for_text(_SAMPLE).bm25("light energy")
+
+
+def _models():
+    # model weights: slow to read, and worth it only in the serving process
+    import backends
+    import retrieval
+    backend = backends.get_backend()
+    if backend is not None and backend.name == "local":
+        backend.model
+    if retrieval._embedder() is not None:
+        retrieval.RetrievalIndex.for_text(_SAMPLE).search("light energy", k=1)
+
+
+STEPS: List[Tuple[str, Callable[[], None]]] = [
+    ("generation", _generation),
+    ("extraction", _extraction),
+    ("llm", _llm),
+    ("pdf", _pdf),
+    ("retrieval", _retrieval),
+]
+# only with warm(models=True)
+MODEL_STEPS: List[Tuple[str, Callable[[], None]]] = [
+    ("models", _models),
+]
+
+
+def warm(models: bool = True) -> Dict[str, float]:
+    """
+    Run every step, plus MODEL_STEPS with `models`; returns seconds per
+    step (-1 if it failed). A failing step (e.g. an optional package
+    missing) doesn't stop the others.
+    """
+    timings = {}
+    with tracing.span("warmup") as sp:
+        for name, step in STEPS + (MODEL_STEPS if models else []):
+            started = time.perf_counter()
+            try:
+                step()
+                timings[name] = time.perf_counter() - started
+            except Exception as e:
+                # usually an optional package that isn't installed
+                logger.warning("warmup step %s failed: %s: %s", name, type(e).__name__, e)
+                timings[name] = -1.0
+        sp.set(**{f"{name}_ms": round(t * 1000, 1) for name, t in timings.items()})
+    return timings
+
+
+def start() -> threading.Thread:
+    """
+    warm() on a daemon thread; returns the thread.
+    """
+    thread = threading.Thread(target=warm, name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,274 @@
+# watch.py
+"""
+Watched URLs: refresh notes for pages that get edited without redoing
+everything.
+
+For every watched URL (and output options) the store keeps the page's
+validators, the paragraph hashes of the last extracted text, the generated
+notes/FAQs/MCQs and, for every bullet, FAQ and MCQ, the paragraph it was
+drawn from. refresh(url) then does the least work it can:
+
+- the server answers 304 to the stored ETag/Last-Modified: nothing else
+  runs ("not_modified")
+- the page changed but its paragraphs didn't (ads, timestamps): no
+  generation ("unchanged")
+- some paragraphs changed: items drawn from paragraphs that are gone are
+  dropped, only the new/edited paragraphs go through generation, and the
+  new items are merged in document order ("incremental")
+- more than FULL_REFRESH_RATIO of the text changed, or nothing is stored
+  yet: the whole page is generated as usual ("full" / "new")
+
+The summary is kept on incremental refreshes; it's regenerated with the
+rest on a full one.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import tracing
+from cache import make_key, normalize_url
+from docindex import STOPWORDS
+
+WATCH_PATH = os.environ.get("NOTES_WATCH_PATH", os.path.join(".cache", "watch.sqlite3"))
+# above this share of changed text (by characters) a refresh regenerates everything
+FULL_REFRESH_RATIO = float(os.environ.get("NOTES_WATCH_FULL_RATIO", 0.5))
+# changed text shorter than this is not worth a generation call
+MIN_DELTA_CHARS = 200
+
+NOT_MODIFIED, UNCHANGED, INCREMENTAL, FULL, NEW = "not_modified", "unchanged", "incremental", "full", "new"
+
+_WORD = re.compile(r"\w{3,}")
+_WHITESPACE = re.compile(r"\s+")
+# section -> (list key inside the result, option giving its target size)
+_SECTIONS = {"bullets": ("notes", "bullets"), "faqs": ("faqs", "faq_count"), "mcqs": ("mcqs", "mcq_count")}
+
+
+def paragraphs(text: str) -> List[str]:
+    """
+    The extracted text's paragraphs (extraction puts one per line).
+    """
+    return [p.strip() for p in text.splitlines() if p.strip()]
+
+
+def paragraph_hash(paragraph: str) -> str:
+    # whitespace and case edits don't count as changes
+    norm = _WHITESPACE.sub(" ", paragraph).strip().lower()
+    return hashlib.blake2b(norm.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _target(options: Dict[str, Any], name: str) -> int:
+    # requested size of a section, with the generators' defaults
+    return int(options.get(_SECTIONS[name][1], 6 if name == "bullets" else 5))
+
+
+def _words(text: str) -> set:
+    return {w for w in _WORD.findall(text.lower()) if w not in STOPWORDS}
+
+
+def _items(sections: Dict[str, Any], name: str) -> list:
+    if name == "bullets":
+        return list((sections.get("notes") or {}).get("bullets", []))
+    return list(sections.get(_SECTIONS[name][0]) or [])
+
+
+def _item_text(section: str, item: Any) -> str:
+    if section == "faqs":
+        return f"{item.get('q', '')} {item.get('a', '')}"
+    if section == "mcqs":
+        return f"{item.get('question', '')} {item.get('answer', '')}"
+    return str(item)
+
+
+def attribute(sections: Dict[str, Any], paras: List[str], hashes: List[str]) -> Dict[str, List[str]]:
+    """
+    For every bullet, FAQ and MCQ, the hash of the paragraph sharing the
+    most content words with it ("" if none does).
+    """
+    para_words = [_words(p) for p in paras]
+    sources = {}
+    for name in _SECTIONS:
+        out = []
+        for item in _items(sections, name):
+            words = _words(_item_text(name, item))
+            best, best_overlap = "", 0
+            for h, pw in zip(hashes, para_words):
+                overlap = len(words & pw)
+                if overlap > best_overlap:
+                    best, best_overlap = h, overlap
+            out.append(best)
+        sources[name] = out
+    return sources
+
+
+def merge(old: Dict[str, Any], old_sources: Dict[str, List[str]], delta: Dict[str, Any],
+          delta_sources: Dict[str, List[str]], hashes: List[str], options: Dict[str, Any]
+          ) -> Tuple[Dict[str, Any], Dict[str, List[str]]]:
+    """
+    Keep the old items whose source paragraph survived, add the items
+    generated from the changed paragraphs, order everything by source
+    position in the new text and trim each section to its target size
+    (new items win over old ones when trimming). Old items that couldn't
+    be attributed to a paragraph (source "") are kept too, and go last.
+    """
+    position = {h: i for i, h in enumerate(hashes)}
+    merged, sources = {}, {}
+    for name in _SECTIONS:
+        target = _target(options, name)
+        old_items = _items(old, name)
+        old_srcs = list(old_sources.get(name, []))
+        old_srcs += [""] * (len(old_items) - len(old_srcs))
+        # no source means no way to tell it went stale: keep it
+        kept = [(item, src) for item, src in zip(old_items, old_srcs) if src in position or not src]
+        fresh = [(item, src) for item, src in zip(_items(delta, name), delta_sources.get(name, []))]
+        chosen = fresh[:target] + kept[:max(0, target - len(fresh))]
+        chosen.sort(key=lambda pair: position.get(pair[1], len(position)))
+        merged[name] = [item for item, _ in chosen]
+        sources[name] = [src for _, src in chosen]
+    notes = dict(old.get("notes") or {})
+    notes["bullets"] = merged.pop("bullets")
+    result = dict(old)
+    result.update(notes=notes, faqs=merged["faqs"], mcqs=merged["mcqs"])
+    return result, sources
+
+
+class WatchStore:
+    """
+    One row per watched URL and options: validators, paragraph hashes,
+    result and item sources. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = WATCH_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS watched ("
+                " key TEXT PRIMARY KEY, url TEXT NOT NULL, etag TEXT, last_modified TEXT,"
+                " hashes TEXT NOT NULL, result TEXT NOT NULL, sources TEXT NOT NULL,"
+                " checked REAL NOT NULL, changed REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT url, etag, last_modified, hashes, result, sources, checked, changed FROM watched"
+                " WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {"url": row[0], "etag": row[1], "last_modified": row[2], "hashes": json.loads(row[3]),
+                "result": json.loads(row[4]), "sources": json.loads(row[5]), "checked": row[6],
+                "changed": row[7]}
+
+    def put(self, key: str, url: str, etag: Optional[str], last_modified: Optional[str], hashes: List[str],
+            result: Dict[str, Any], sources: Dict[str, List[str]], changed: bool = True) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            if changed:
+                conn.execute(
+                    "INSERT OR REPLACE INTO watched"
+                    " (key, url, etag, last_modified, hashes, result, sources, checked, changed)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, url, etag, last_modified, json.dumps(hashes), json.dumps(result),
+                     json.dumps(sources), now, now),
+                )
+            else:
+                conn.execute("UPDATE watched SET etag=?, last_modified=?, checked=? WHERE key=?",
+                             (etag, last_modified, now, key))
+            conn.commit()
+
+    def touch(self, key: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("UPDATE watched SET checked=? WHERE key=?", (time.time(), key))
+            conn.commit()
+
+
+STORE = WatchStore()
+
+
+def _generate(text: str, options: Dict[str, Any], counts: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    from utils import iter_note_sections
+    counts = counts or {}
+    return dict(iter_note_sections(
+        text, bullets=counts.get("bullets", options.get("bullets", 6)),
+        faq_count=counts.get("faqs", options.get("faq_count", 5)),
+        mcq_count=counts.get("mcqs", options.get("mcq_count", 5)),
+        max_tokens=options.get("max_tokens", 600), use_openai=options.get("use_openai"),
+        single_request=options.get("single_request", True),
+    ))
+
+
+def _done(sp, change: str) -> str:
+    sp.set(change=change)
+    tracing.count("watch_refreshes", change=change)
+    return change
+
+
+def refresh(url: str, options: Optional[Dict[str, Any]] = None, timeout: float = 20,
+            store: WatchStore = STORE) -> Tuple[str, Dict[str, Any]]:
+    """
+    Bring the stored notes for `url` up to date; returns (change, result)
+    where change is one of not_modified, unchanged, incremental, full, new.
+    `options` takes the generation options (bullets, faq_count, mcq_count,
+    max_tokens, use_openai, single_request). Raises on fetch errors or
+    when the page has too little text.
+    """
+    from extraction import extract, MIN_TEXT_CHARS
+    from fetch import fetch
+    options = dict(options or {})
+    key = make_key(normalize_url(url), options)
+    with tracing.span("watch.refresh", url=url) as sp:
+        entry = store.get(key)
+        page = fetch(url, etag=entry and entry["etag"], last_modified=entry and entry["last_modified"],
+                     timeout=timeout)
+        if page.not_modified and entry is not None:
+            store.touch(key)
+            return _done(sp, NOT_MODIFIED), entry["result"]
+        extracted = extract(page)
+        if extracted is None:
+            raise ValueError("not enough text on the page")
+        paras = paragraphs(extracted.text)
+        hashes = [paragraph_hash(p) for p in paras]
+        if entry is not None and hashes == entry["hashes"]:
+            store.put(key, url, page.etag, page.last_modified, hashes, entry["result"], entry["sources"],
+                      changed=False)
+            return _done(sp, UNCHANGED), entry["result"]
+
+        old = set(entry["hashes"]) if entry else set()
+        changed = [p for p, h in zip(paras, hashes) if h not in old]
+        changed_chars = sum(len(p) for p in changed)
+        ratio = changed_chars / max(1, sum(len(p) for p in paras))
+        sp.set(paragraphs=len(paras), changed_paragraphs=len(changed), changed_ratio=round(ratio, 3))
+
+        if entry is None or ratio > FULL_REFRESH_RATIO:
+            change = NEW if entry is None else FULL
+            result = _generate(extracted.text, options)
+            sources = attribute(result, paras, hashes)
+        else:
+            change = INCREMENTAL
+            delta, delta_sources = {}, {}
+            if changed_chars >= max(MIN_DELTA_CHARS, MIN_TEXT_CHARS):
+                # each section gets new items in proportion to how much of the text is new
+                counts = {name: max(1, round(_target(options, name) * ratio)) for name in _SECTIONS}
+                delta = _generate("\n".join(changed), options, counts)
+                delta_sources = attribute(delta, paras, hashes)
+            result, sources = merge(entry["result"], entry["sources"], delta, delta_sources, hashes, options)
+        store.put(key, url, page.etag, page.last_modified, hashes, result, sources)
+        return _done(sp, change), result